@@ -0,0 +1,56 @@
+# bench_allocation.py (benchmarks)
+# !/usr/bin/env python3
+# coding=utf-8
+"""
+Benchmarks of allocating FlowByActivity data to sectors using an allocation dataset
+"""
+
+import flowsa
+import flowsa.mapping
+from flowsa.common import get_fips_level
+from flowsa.fbs_allocation import dataset_allocation_method
+from flowsa.mapping import add_sectors_to_flowbyactivity, map_elementary_flows
+from .synthetic import synthetic_activity_fba, synthetic_sector_like_fba, \
+    synthetic_flowmapping
+
+method = {'target_sector_level': 'NAICS_6', 'target_sector_source': 'NAICS_2012_Code',
+          'target_geoscale': 'national'}
+
+
+class DatasetAllocation:
+    # allocation data is used at the geoscale of the allocated data, so county level
+    # allocation is not benchmarked
+    params = (['national', 'state'], ['merge', 'sparse'])
+    param_names = ['geoscale', 'allocation_engine']
+    timeout = 600
+
+    def setup(self, geoscale, allocation_engine):
+        # the allocated data, subset to the geoscale
+        fba = synthetic_activity_fba(geoscale)
+        fba = fba[get_fips_level(fba['Location']) == geoscale]
+        self.names = fba['ActivityConsumedBy'].unique().tolist()
+        fba_wsec = add_sectors_to_flowbyactivity(fba, sectorsourcename='NAICS_2012_Code')
+        # replace the fedelemflowlist mapping and the allocation FBA with local stand-ins
+        flowmapping = synthetic_flowmapping(fba, 'USGS_NWIS_WU')
+        self._read_flowmapping = flowsa.mapping._read_flowmapping
+        flowsa.mapping._read_flowmapping = lambda from_fba_source: flowmapping
+        self.flow_subset_mapped = map_elementary_flows(fba_wsec, 'USGS_NWIS_WU').rename(
+            columns={'SourceName': 'MetaSources'})
+        allocation_fba = synthetic_sector_like_fba(geoscale)
+        self.getFlowByActivity = flowsa.getFlowByActivity
+        flowsa.getFlowByActivity = lambda **kwargs: allocation_fba.copy()
+
+        self.attr = {'names': self.names, 'allocation_method': 'proportional',
+                     'allocation_source': 'BLS_QCEW', 'allocation_source_class': 'Employment',
+                     'allocation_source_year': 2015, 'allocation_flow': ['Number of employees'],
+                     'allocation_compartment': 'None', 'allocation_from_scale': geoscale,
+                     'allocation_helper': 'no', 'allocation_engine': allocation_engine}
+        self.v = {'geoscale_to_use': geoscale}
+
+    def teardown(self, geoscale, allocation_engine):
+        flowsa.mapping._read_flowmapping = self._read_flowmapping
+        flowsa.getFlowByActivity = self.getFlowByActivity
+
+    def time_dataset_allocation_method(self, geoscale, allocation_engine):
+        dataset_allocation_method(self.flow_subset_mapped, self.attr, self.names, method,
+                                  'USGS_NWIS_WU', self.v, 'benchmark', 'Benchmark', None)
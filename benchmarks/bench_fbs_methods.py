@@ -0,0 +1,29 @@
+# bench_fbs_methods.py (benchmarks)
+# !/usr/bin/env python3
+# coding=utf-8
+"""
+Benchmarks of running the bundled FBS methods end-to-end from fixtures, the pinned methods
+from the fixtures committed in benchmarks/fixtures_pinned/ and the other methods from
+recorded fixtures, skipping methods without recorded fixtures
+"""
+
+import os
+from .fbs_harness import bundled_methods, golden_file, run_method
+
+
+class FBSMethods:
+    params = bundled_methods()
+    param_names = ['method']
+    timeout = 3600
+    number = 1
+    repeat = 1
+
+    def setup(self, method):
+        if not os.path.exists(golden_file(method)):
+            raise NotImplementedError
+
+    def time_method(self, method):
+        run_method(method)
+
+    def peakmem_method(self, method):
+        run_method(method)
@@ -0,0 +1,49 @@
+# bench_flowbyfunctions.py (benchmarks)
+# !/usr/bin/env python3
+# coding=utf-8
+"""
+Benchmarks of aggregating and subsetting FlowByActivity and FlowBySector dfs
+"""
+
+from flowsa.common import fbs_default_grouping_fields, flow_by_sector_fields, \
+    fba_default_grouping_fields
+from flowsa.flowbyfunctions import aggregator, sector_aggregation, sector_disaggregation, \
+    subset_df_by_geoscale
+from .synthetic import geoscales, synthetic_fbs, synthetic_sector_like_fba
+
+
+class Aggregation:
+    params = geoscales
+    param_names = ['geoscale']
+    timeout = 600
+
+    def setup(self, geoscale):
+        self.fbs = synthetic_fbs(geoscale)
+
+    def time_aggregator(self, geoscale):
+        aggregator(self.fbs, fbs_default_grouping_fields)
+
+    def time_sector_aggregation(self, geoscale):
+        sector_aggregation(self.fbs, fbs_default_grouping_fields)
+
+    def time_sector_disaggregation(self, geoscale):
+        sector_disaggregation(self.fbs, flow_by_sector_fields)
+
+    def peakmem_sector_aggregation(self, geoscale):
+        sector_aggregation(self.fbs, fbs_default_grouping_fields)
+
+
+class GeoscaleSubset:
+    params = geoscales
+    param_names = ['geoscale']
+    timeout = 600
+
+    def setup(self, geoscale):
+        self.fba = synthetic_sector_like_fba(geoscale)
+
+    def time_subset_df_by_geoscale(self, geoscale):
+        # aggregate the finest geoscale in the df to national
+        subset_df_by_geoscale(self.fba, geoscale, 'national')
+
+    def time_aggregator_fba(self, geoscale):
+        aggregator(self.fba, fba_default_grouping_fields)
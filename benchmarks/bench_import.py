@@ -0,0 +1,98 @@
+# bench_import.py (benchmarks)
+# !/usr/bin/env python3
+# coding=utf-8
+"""
+Benchmarks of the time to import flowsa in a new process, such as a worker process of a
+pool, and a check of the import time against a budget:
+    python -m benchmarks.bench_import --budget 0.15
+The budget applies to the time spent importing flowsa after pandas and numpy are
+imported, as pandas dominates the total import time and does not depend on flowsa.
+The check also fails if importing flowsa configures logging handlers or imports
+modules only needed when calling data source urls or writing bibliographies.
+"""
+
+import sys
+import json
+import argparse
+import subprocess
+
+# seconds spent importing flowsa after pandas and numpy
+import_time_budget = 0.15
+
+# modules that are imported on first use rather than by 'import flowsa'
+deferred_modules = ['requests', 'requests_ftp', 'pkg_resources', 'bibtexparser', 'tabula',
+                    'flowsa.data_source_scripts']
+
+_measure_import = """
+import sys, json, time, logging
+start = time.perf_counter()
+import numpy, pandas
+pandas_time = time.perf_counter() - start
+start = time.perf_counter()
+import flowsa
+flowsa_time = time.perf_counter() - start
+print(json.dumps({'pandas': pandas_time, 'flowsa': flowsa_time,
+                  'handlers': len(logging.getLogger().handlers),
+                  'modules': sorted(sys.modules)}))
+"""
+
+
+class Import:
+    timeout = 120
+
+    def timeraw_import_flowsa(self):
+        return "import flowsa"
+
+    def timeraw_import_flowsa_after_pandas(self):
+        return "import flowsa", "import numpy, pandas"
+
+
+def measure_import(repeat=5):
+    """
+    Import flowsa in new processes
+    :param repeat: int, number of processes
+    :return: dictionary of the fastest pandas and flowsa import times (s), the number of
+        root logger handlers after importing flowsa, and the deferred modules imported
+    """
+    results = []
+    for _ in range(repeat):
+        out = subprocess.check_output([sys.executable, '-c', _measure_import])
+        results.append(json.loads(out.decode().strip().splitlines()[-1]))
+    imported = set(results[0]['modules'])
+    return {'pandas': min(r['pandas'] for r in results),
+            'flowsa': min(r['flowsa'] for r in results),
+            'handlers': results[0]['handlers'],
+            'deferred_imported': [m for m in deferred_modules
+                                  if m in imported or any(i.startswith(m + '.') for i in imported)]}
+
+
+def parse_args():
+    """Make budget and repeat parameters"""
+    ap = argparse.ArgumentParser(description='Check the time to import flowsa')
+    ap.add_argument('-b', '--budget', type=float, default=import_time_budget,
+                    help='Seconds allowed to import flowsa after pandas and numpy')
+    ap.add_argument('-r', '--repeat', type=int, default=5,
+                    help='Number of processes, the fastest import is reported')
+    return ap.parse_args()
+
+
+def main():
+    args = parse_args()
+    result = measure_import(args.repeat)
+    print('import numpy, pandas: %.3f s' % result['pandas'])
+    print('import flowsa: %.3f s (budget %.3f s)' % (result['flowsa'], args.budget))
+    failures = []
+    if result['flowsa'] > args.budget:
+        failures.append('flowsa import time exceeds the budget')
+    if result['handlers'] > 0:
+        failures.append('importing flowsa configured logging handlers')
+    if result['deferred_imported']:
+        failures.append('importing flowsa imported ' + ', '.join(result['deferred_imported']))
+    for f in failures:
+        print(f)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
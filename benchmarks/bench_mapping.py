@@ -0,0 +1,66 @@
+# bench_mapping.py (benchmarks)
+# !/usr/bin/env python3
+# coding=utf-8
+"""
+Benchmarks of mapping activities to sectors and flows to federal elementary flows
+"""
+
+import flowsa.mapping
+from flowsa.mapping import add_sectors_to_flowbyactivity, map_elementary_flows
+from .synthetic import geoscales, synthetic_activity_fba, synthetic_sector_like_fba, \
+    synthetic_flowmapping
+
+
+def skip_county_activities(geoscale):
+    """
+    Activities map to ~100 sectors each, so FBS methods add sectors to activity sets
+    rather than full county level datasets, skip county level benchmarks of activities
+    """
+    if geoscale == 'county':
+        raise NotImplementedError
+
+
+class AddSectorsSectorLike:
+    params = geoscales
+    param_names = ['geoscale']
+    timeout = 600
+
+    def setup(self, geoscale):
+        self.fba = synthetic_sector_like_fba(geoscale)
+
+    def time_add_sectors_to_flowbyactivity(self, geoscale):
+        add_sectors_to_flowbyactivity(self.fba, sectorsourcename='NAICS_2012_Code')
+
+
+class AddSectorsActivities:
+    params = geoscales
+    param_names = ['geoscale']
+    timeout = 600
+
+    def setup(self, geoscale):
+        skip_county_activities(geoscale)
+        self.fba = synthetic_activity_fba(geoscale)
+
+    def time_add_sectors_to_flowbyactivity(self, geoscale):
+        add_sectors_to_flowbyactivity(self.fba, sectorsourcename='NAICS_2012_Code')
+
+
+class MapElementaryFlows:
+    params = geoscales
+    param_names = ['geoscale']
+    timeout = 600
+
+    def setup(self, geoscale):
+        skip_county_activities(geoscale)
+        fba = synthetic_activity_fba(geoscale)
+        self.fba_wsec = add_sectors_to_flowbyactivity(fba, sectorsourcename='NAICS_2012_Code')
+        # replace the fedelemflowlist mapping with a local stand-in
+        flowmapping = synthetic_flowmapping(fba, 'USGS_NWIS_WU')
+        self._read_flowmapping = flowsa.mapping._read_flowmapping
+        flowsa.mapping._read_flowmapping = lambda from_fba_source: flowmapping
+
+    def teardown(self, geoscale):
+        flowsa.mapping._read_flowmapping = self._read_flowmapping
+
+    def time_map_elementary_flows(self, geoscale):
+        map_elementary_flows(self.fba_wsec, 'USGS_NWIS_WU')
@@ -0,0 +1,45 @@
+# bench_parsers.py (benchmarks)
+# !/usr/bin/env python3
+# coding=utf-8
+"""
+Benchmarks of the call, parse, and processing functions of data sources, replaying
+raw responses recorded by parser_harness.py. Sources without recorded responses are skipped
+"""
+
+import os
+from .parser_harness import default_sources, recorded_sources, response_folder, \
+    RecordedResponses, replay_source
+import flowsa.flowbyactivity as fba
+from flowsa.common import load_sourceconfig
+
+
+class Parsers:
+    params = sorted(set(['{}_{}'.format(s, y) for s, y in default_sources + recorded_sources()]))
+    param_names = ['source_year']
+    timeout = 1800
+    number = 1
+
+    def setup(self, source_year):
+        self.source, self.year = source_year.rsplit('_', 1)
+        if not os.path.exists(os.path.join(response_folder(self.source, self.year),
+                                           'manifest.json')):
+            raise NotImplementedError
+        self.config = load_sourceconfig(self.source)
+        self.args = {'source': self.source, 'year': self.year}
+        with RecordedResponses(self.source, self.year) as responses:
+            self.dataframe_list = fba.call_urls(responses.manifest['urls'], self.args,
+                                                self.config)
+
+    def time_call(self, source_year):
+        with RecordedResponses(self.source, self.year) as responses:
+            fba.call_urls(responses.manifest['urls'], self.args, self.config)
+
+    def time_parse(self, source_year):
+        # parse functions can modify the dfs in place
+        fba.parse_data([df.copy() for df in self.dataframe_list], self.args, self.config)
+
+    def time_replay(self, source_year):
+        replay_source(self.source, self.year)
+
+    def peakmem_replay(self, source_year):
+        replay_source(self.source, self.year)
@@ -0,0 +1,359 @@
+# fbs_harness.py (benchmarks)
+# !/usr/bin/env python3
+# coding=utf-8
+"""
+Run the FlowBySector methods bundled with flowsa offline, reporting the time and peak
+memory of each method and activity set, and comparing the output to golden FBS files.
+
+Inputs are recorded once, with network access, by running the methods in 'record' mode,
+which saves each FBA and FBS loaded, each fedelemflowlist flow mapping, and the output of
+each 'FBS_outside_flowsa' function (stewi/stewicombo) as parquet fixtures, along with the
+output FBS as the golden file. 'run' mode then loads all inputs from the fixtures.
+    python -m benchmarks.fbs_harness record -m Water_national_2015_m1
+    python -m benchmarks.fbs_harness run -m Water_national_2015_m1
+Fixtures are saved to benchmarks/fixtures/, or the folder in the environment variable
+FLOWSA_BENCHMARK_FIXTURES, which are local to each machine. The pinned methods instead run
+from the fixtures committed in benchmarks/fixtures_pinned/, seeded synthetic inputs and
+the golden FBS of those inputs, so their outputs are compared across machines. 'pin' mode
+regenerates the pinned fixtures and golden files.
+    python -m benchmarks.fbs_harness pin
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import numpy as np
+import pandas as pd
+import flowsa
+import flowsa.mapping
+import flowsa.flowbysector
+from flowsa.common import log, flowbysectormethodpath, fbsoutputpath, \
+    fbs_default_grouping_fields, configure_logging
+from flowsa.dataclean import replace_NoneType_with_empty_cells
+from flowsa.flowbysector import load_method
+from flowsa.instrumentation import get_peak_rss
+from flowsa.mapping import encode_flowmapping
+from flowsa.registry import get_function, register_function, unregister_function
+from .synthetic import synthetic_sector_like_fba
+
+fixture_path = os.environ.get('FLOWSA_BENCHMARK_FIXTURES',
+                              os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures'))
+pinned_fixture_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures_pinned')
+
+# methods run from the pinned fixtures unless a fixture folder is given
+pinned_methods = ['Employment_national_2017']
+
+
+def bundled_methods():
+    """
+    Names of the FBS methods bundled with flowsa
+    :return: list of method names
+    """
+    return sorted(f[:-len('.yaml')] for f in os.listdir(flowbysectormethodpath)
+                  if f.endswith('.yaml'))
+
+
+def golden_file(method_name, path=None):
+    """
+    :param method_name: str, FBS method name
+    :param path: str, fixture folder
+    :return: str, file path of the golden FBS of a method
+    """
+    return os.path.join(method_fixture_path(method_name, path), 'golden',
+                        method_name + '.parquet')
+
+
+def method_fixture_path(method_name, path=None):
+    """
+    :param method_name: str, FBS method name
+    :param path: str, fixture folder
+    :return: str, fixture folder of a method, the pinned fixtures for pinned methods
+        unless a folder is given
+    """
+    if path is None and method_name in pinned_methods:
+        return pinned_fixture_path
+    return path or fixture_path
+
+
+def pin_fixtures(path=None):
+    """
+    Write the pinned fixtures, the seeded synthetic FBAs and flow mappings loaded by the
+    pinned methods, and record the golden FBS of each pinned method from the fixtures
+    :param path: str, fixture folder, defaults to pinned_fixture_path
+    """
+    path = path or pinned_fixture_path
+    # Employment_national_2017: national BLS_QCEW employment, mapped to 'Jobs'
+    for folder in ['FlowByActivity', 'FlowMapping', 'golden']:
+        os.makedirs(os.path.join(path, folder), exist_ok=True)
+    fba = synthetic_sector_like_fba('national').assign(Year=2017)
+    fba.to_parquet(os.path.join(path, 'FlowByActivity', 'BLS_QCEW_2017.parquet'),
+                   index=False)
+    flowmapping = pd.DataFrame({'SourceListName': ['BLS_QCEW'], 'SourceFlowName': ['Jobs'],
+                                'SourceFlowContext': [None], 'SourceUnit': ['p'],
+                                'ConversionFactor': [1.0], 'TargetFlowName': ['Jobs'],
+                                'TargetFlowContext': [None], 'TargetUnit': ['p']})
+    flowmapping.to_parquet(os.path.join(path, 'FlowMapping', 'BLS_QCEW.parquet'), index=False)
+    for m in pinned_methods:
+        log.info('Recording the golden FBS of ' + m + ' from the pinned fixtures')
+        fbs = run_method(m, path)['fbs']
+        fbs.to_parquet(golden_file(m, path), index=False)
+
+
+class OfflineFixtures:
+    """
+    Context manager replacing the flowsa functions that load data from outside the
+    FBS method run with functions loading parquet fixtures, or recording the fixtures
+    when record=True. The FBS written by the run is captured in 'outputs' rather than
+    saved to the local flowsa folder.
+    """
+
+    def __init__(self, path=None, record=False, outside_fxns=()):
+        """
+        :param path: str, fixture folder, defaults to fixture_path
+        :param record: bool, True to load data with flowsa and save the fixtures
+        :param outside_fxns: list, names of 'FBS_outside_flowsa' functions to replace
+        """
+        self.path = path or fixture_path
+        self.record = record
+        self.outside_fxns = list(outside_fxns)
+        # dictionary of FBS name and df written by the run
+        self.outputs = {}
+        self._originals = {}
+
+    def _file(self, folder, name):
+        os.makedirs(os.path.join(self.path, folder), exist_ok=True)
+        return os.path.join(self.path, folder, name + '.parquet')
+
+    def _load(self, file, columns=None, filters=None):
+        if not os.path.exists(file):
+            raise FileNotFoundError(file + ' not found, record fixtures with '
+                                    '"python -m benchmarks.fbs_harness record"')
+        return pd.read_parquet(file, columns=columns, filters=filters)
+
+    def load_preprocessed_output(self, meta, paths):
+        """
+        Stand-in for esupy load_preprocessed_output() used by getFlowBySector()
+        """
+        file = self._file(meta.category, meta.name_data)
+        if self.record:
+            df = self._originals['load_preprocessed_output'](meta, paths)
+            if df is not None:
+                df.to_parquet(file, index=False)
+            return df
+        return self._load(file)
+
+    def load_fba_output(self, meta, columns=None, filters=None):
+        """
+        Stand-in for load_fba_output() used by getFlowByActivity(), recording the whole
+        FBA and applying the columns and filters to the fixture
+        """
+        file = self._file(meta.category, meta.name_data)
+        if self.record:
+            df = self._originals['load_fba_output'](meta)
+            if df is None:
+                return None
+            df.to_parquet(file, index=False)
+        return self._load(file, columns, filters)
+
+    def read_flowmapping(self, from_fba_source):
+        """
+        Stand-in for the fedelemflowlist flow mapping loaded by map_elementary_flows()
+        """
+        sources = [from_fba_source] if isinstance(from_fba_source, str) else list(from_fba_source)
+        file = self._file('FlowMapping', '_'.join(sources))
+        if self.record:
+            from fedelemflowlist import get_flowmapping
+            flowmapping = get_flowmapping(sources)
+            flowmapping.to_parquet(file, index=False)
+        else:
+            flowmapping = self._load(file)
+        return encode_flowmapping(flowmapping)
+
+    def outside_fxn(self, fxn_name):
+        """
+        Stand-in for an 'FBS_outside_flowsa' function, with fixtures identified by the
+        function name and the method yaml parameters passed to the function
+        """
+        def load_fbs(v):
+            params = hashlib.md5(json.dumps(v, sort_keys=True, default=str).encode())
+            file = self._file('FBS_outside_flowsa', fxn_name + '_' + params.hexdigest()[0:10])
+            if self.record:
+                df = self._originals[fxn_name](v)
+                df.to_parquet(file, index=False)
+                return df
+            return self._load(file)
+        return load_fbs
+
+    def write_df_to_file(self, df, paths, meta):
+        """
+        Stand-in for esupy write_df_to_file() used by flowbysector.main()
+        """
+        self.outputs[meta.name_data] = df
+        if self.record:
+            df.to_parquet(self._file('golden', meta.name_data), index=False)
+
+    def __enter__(self):
+        self._originals['load_preprocessed_output'] = flowsa.load_preprocessed_output
+        self._originals['load_fba_output'] = flowsa.load_fba_output
+        self._originals['dataset_years'] = flowsa.dataset_years
+        self._originals['_read_flowmapping'] = flowsa.mapping._read_flowmapping
+        self._originals['write_df_to_file'] = flowsa.flowbysector.write_df_to_file
+        flowsa.load_preprocessed_output = self.load_preprocessed_output
+        flowsa.load_fba_output = self.load_fba_output
+        # FBA fixtures are single files, FBAs in a local partitioned dataset are not used
+        flowsa.dataset_years = lambda source: []
+        flowsa.mapping._read_flowmapping = self.read_flowmapping
+        flowsa.flowbysector.write_df_to_file = self.write_df_to_file
+        for fxn_name in self.outside_fxns:
+            if self.record:
+                self._originals[fxn_name] = get_function(fxn_name)
+            register_function(fxn_name, self.outside_fxn(fxn_name))
+        return self
+
+    def __exit__(self, *args):
+        flowsa.load_preprocessed_output = self._originals.pop('load_preprocessed_output')
+        flowsa.load_fba_output = self._originals.pop('load_fba_output')
+        flowsa.dataset_years = self._originals.pop('dataset_years')
+        flowsa.mapping._read_flowmapping = self._originals.pop('_read_flowmapping')
+        flowsa.flowbysector.write_df_to_file = self._originals.pop('write_df_to_file')
+        for fxn_name in self.outside_fxns:
+            unregister_function(fxn_name)
+        self._originals = {}
+
+
+def run_method(method_name, path=None, record=False):
+    """
+    Run an FBS method using the fixtures
+    :param method_name: str, FBS method name
+    :param path: str, fixture folder, defaults to the pinned fixtures for pinned methods
+    :param record: bool, True to record the fixtures and golden FBS
+    :return: dictionary of the FBS, the wall time (s), peak memory increase (MB), and
+        the df of the run report stages
+    """
+    # recordings are never saved to the pinned fixtures
+    path = (path or fixture_path) if record else method_fixture_path(method_name, path)
+    method = load_method(method_name)
+    outside_fxns = {v['FBS_datapull_fxn'] for v in method['source_names'].values()
+                    if v['data_format'] == 'FBS_outside_flowsa'}
+    with OfflineFixtures(path, record, outside_fxns) as fixtures:
+        rss_start = get_peak_rss()
+        wall_start = time.perf_counter()
+        flowsa.flowbysector.main(method=method_name)
+        wall_time = time.perf_counter() - wall_start
+        rss_end = get_peak_rss()
+    with open(fbsoutputpath + method_name + '_run_report.json') as f:
+        stages = pd.DataFrame(json.load(f)['stages'])
+    return {'fbs': fixtures.outputs[method_name], 'WallTime': wall_time,
+            'PeakRSSDelta': None if rss_start is None else rss_end - rss_start,
+            'stages': stages}
+
+
+def compare_to_golden(fbs, golden, rtol=1e-5, atol=1e-8):
+    """
+    Compare an FBS to the golden FBS, matching rows on the FBS grouping fields
+    :param fbs: df, FBS
+    :param golden: df, golden FBS
+    :param rtol: float, relative tolerance of FlowAmount differences
+    :param atol: float, absolute tolerance of FlowAmount differences
+    :return: df of the rows missing from either FBS or with FlowAmounts outside the tolerance
+    """
+    key_cols = [c for c in fbs_default_grouping_fields
+                if c in fbs.columns and c in golden.columns]
+    df = pd.merge(replace_NoneType_with_empty_cells(fbs[key_cols + ['FlowAmount']].copy()),
+                  replace_NoneType_with_empty_cells(golden[key_cols + ['FlowAmount']].copy()),
+                  on=key_cols, how='outer', suffixes=('', '_golden'), indicator=True)
+    within_tolerance = np.isclose(df['FlowAmount'], df['FlowAmount_golden'],
+                                  rtol=rtol, atol=atol)
+    df = df[~within_tolerance].rename(columns={'_merge': 'Comparison'})
+    df['Comparison'] = df['Comparison'].map({'left_only': 'not in golden',
+                                             'right_only': 'missing',
+                                             'both': 'FlowAmount differs'})
+    return df.reset_index(drop=True)
+
+
+def run_methods(method_names, path=None, record=False, rtol=1e-5):
+    """
+    Run FBS methods using the fixtures, summarizing the time and memory of each method
+    and activity set and comparing the outputs to the golden FBS
+    :param method_names: list, FBS method names
+    :param path: str, fixture folder
+    :param record: bool, True to record the fixtures and golden FBS
+    :param rtol: float, relative tolerance of FlowAmount differences
+    :return: df summary of methods, df summary of activity sets, dictionary of method
+        names and df of differences from the golden FBS
+    """
+    methods = []
+    activity_sets = []
+    differences = {}
+    for m in method_names:
+        log.info('Running ' + m + ' from fixtures' + (', recording fixtures' if record else ''))
+        result = run_method(m, path, record)
+        summary = {'Method': m, 'WallTime': result['WallTime'],
+                   'PeakRSSDelta': result['PeakRSSDelta'], 'Rows': len(result['fbs'])}
+        if os.path.exists(golden_file(m, path)) and not record:
+            differences[m] = compare_to_golden(result['fbs'],
+                                               pd.read_parquet(golden_file(m, path)), rtol)
+            summary['Differences'] = len(differences[m])
+            summary['Status'] = 'pass' if len(differences[m]) == 0 else 'fail'
+        else:
+            summary['Status'] = 'recorded' if record else 'no golden file'
+        methods.append(summary)
+        stages = result['stages']
+        stages = stages[stages['ActivitySet'].notnull()]
+        activity_sets.append(stages.groupby(['Source', 'ActivitySet'], sort=False)[
+            ['WallTime', 'CPUTime', 'PeakRSSDelta']].sum().reset_index().assign(Method=m))
+    activity_sets = pd.concat(activity_sets, ignore_index=True)
+    activity_sets = activity_sets[['Method', 'Source', 'ActivitySet', 'WallTime', 'CPUTime',
+                                   'PeakRSSDelta']]
+    return pd.DataFrame(methods), activity_sets, differences
+
+
+def parse_args():
+    """Make mode, method, and fixture parameters"""
+    ap = argparse.ArgumentParser(description='Run bundled FBS methods offline from fixtures')
+    ap.add_argument('mode', choices=['record', 'run', 'pin'],
+                    help='record fixtures and golden FBS, run from the fixtures, or '
+                         'regenerate the pinned fixtures and golden FBS')
+    ap.add_argument('-m', '--method', nargs='*', default=None,
+                    help='FBS method names, defaults to all bundled methods, or to the '
+                         'methods with pinned or recorded fixtures in run mode')
+    ap.add_argument('-f', '--fixtures', default=None, help='Fixture folder')
+    ap.add_argument('-o', '--output', default=None,
+                    help='Folder to save csvs of the summaries and differences')
+    ap.add_argument('--rtol', type=float, default=1e-5,
+                    help='Relative tolerance of FlowAmount differences')
+    return ap.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.mode == 'pin':
+        pin_fixtures(args.fixtures)
+        return
+    method_names = args.method or bundled_methods()
+    if args.mode == 'run' and not args.method:
+        # run all methods with recorded fixtures
+        method_names = [m for m in method_names if os.path.exists(golden_file(m, args.fixtures))]
+    methods, activity_sets, differences = run_methods(method_names, args.fixtures,
+                                                      args.mode == 'record', args.rtol)
+    float_format = lambda x: '%.2f' % x
+    print(methods.to_string(index=False, float_format=float_format))
+    print(activity_sets.to_string(index=False, float_format=float_format))
+    if args.output is not None:
+        os.makedirs(args.output, exist_ok=True)
+        methods.to_csv(os.path.join(args.output, 'fbs_harness_methods.csv'), index=False)
+        activity_sets.to_csv(os.path.join(args.output, 'fbs_harness_activity_sets.csv'),
+                             index=False)
+        for m, df in differences.items():
+            if len(df) > 0:
+                df.to_csv(os.path.join(args.output, m + '_golden_differences.csv'), index=False)
+    if (methods['Status'] == 'fail').any():
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    configure_logging()
+    main()
@@ -0,0 +1,289 @@
+# parser_harness.py (benchmarks)
+# !/usr/bin/env python3
+# coding=utf-8
+"""
+Replay raw responses recorded from the data source urls through the call, parse, and
+processing functions of flowbyactivity.py, reporting the throughput of each data source
+parser in rows/sec and MB/sec without network access.
+
+Responses are recorded once, with network access and any required API keys, and saved
+with a manifest of the urls called:
+    python -m benchmarks.parser_harness record -s USGS_NWIS_WU -y 2015
+    python -m benchmarks.parser_harness run -s USGS_NWIS_WU -y 2015
+Responses are saved to benchmarks/fixtures/responses/<source>/<year>/, in the fixture
+folder of fbs_harness.py.
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import argparse
+import mimetypes
+import pandas as pd
+import requests
+from requests.structures import CaseInsensitiveDict
+import flowsa.flowbyactivity as fba
+from flowsa.common import log, load_sourceconfig, load_api_key, configure_logging
+from .fbs_harness import fixture_path
+
+# data source parsers benchmarked by default, as (source, year)
+default_sources = [('USGS_NWIS_WU', '2015'), ('BLS_QCEW', '2015'), ('EPA_GHGI', '2018'),
+                   ('BLM_PLS', '2012')]
+
+# file extensions of response content types, for content types mimetypes does not guess
+response_extensions = {'text/plain': '.txt', 'text/rdb': '.txt', 'application/json': '.json',
+                       'application/x-zip-compressed': '.zip'}
+
+
+def response_folder(source, year, path=None):
+    """
+    :param source: str, data source name
+    :param year: str, year
+    :param path: str, fixture folder
+    :return: str, folder of the recorded responses of a data source and year
+    """
+    return os.path.join(path or fixture_path, 'responses', source, str(year))
+
+
+def recorded_sources(path=None):
+    """
+    Data sources and years with recorded responses
+    :param path: str, fixture folder
+    :return: list of (source, year)
+    """
+    folder = os.path.join(path or fixture_path, 'responses')
+    if not os.path.isdir(folder):
+        return []
+    return sorted((s, y) for s in os.listdir(folder) for y in os.listdir(os.path.join(folder, s))
+                  if os.path.exists(os.path.join(folder, s, y, 'manifest.json')))
+
+
+def response_extension(url, content_type):
+    """
+    Guess the file extension of a response, from the content type or else the url
+    :param url: str, url called
+    :param content_type: str, content type header of the response
+    :return: str, file extension
+    """
+    content_type = (content_type or '').split(';')[0].strip()
+    ext = response_extensions.get(content_type) or mimetypes.guess_extension(content_type)
+    if ext is None or ext == '.bin':
+        ext = os.path.splitext(url.split('?')[0])[1] or '.bin'
+    return ext
+
+
+class RecordedResponses:
+    """
+    Context manager replacing make_http_request() in flowbyactivity.py with a function
+    returning recorded responses, or recording the responses when record=True.
+    Responses are matched to urls in the order the urls are called
+    """
+
+    def __init__(self, source, year, path=None, record=False, api_key=None):
+        """
+        :param source: str, data source name
+        :param year: str, year
+        :param path: str, fixture folder
+        :param record: bool, True to call the urls and save the responses
+        :param api_key: str, API key removed from the urls saved to the manifest
+        """
+        self.folder = response_folder(source, year, path)
+        self.record = record
+        self.api_key = api_key
+        self.manifest = {'source': source, 'year': str(year), 'urls': [], 'responses': []}
+        self._original = None
+
+    def load_manifest(self):
+        """
+        :return: dictionary of the data source, year, urls called, and recorded responses
+        """
+        file = os.path.join(self.folder, 'manifest.json')
+        if not os.path.exists(file):
+            raise FileNotFoundError(file + ' not found, record responses with '
+                                    '"python -m benchmarks.parser_harness record"')
+        with open(file) as f:
+            self.manifest = json.load(f)
+        return self.manifest
+
+    def save_manifest(self):
+        os.makedirs(self.folder, exist_ok=True)
+        with open(os.path.join(self.folder, 'manifest.json'), 'w') as f:
+            json.dump(self.manifest, f, indent=1)
+
+    def redact(self, url):
+        if url is None or not self.api_key:
+            return url
+        return url.replace(self.api_key, '__apiKey__')
+
+    def make_http_request(self, url):
+        """
+        Stand-in for make_http_request()
+        """
+        n = len(self._responses_called)
+        self._responses_called.append(url)
+        if self.record:
+            r = self._original(url)
+            content = r.content
+            file = '{}_{}{}'.format(n, hashlib.md5(content).hexdigest()[0:10],
+                                    response_extension(url, r.headers.get('content-type')))
+            os.makedirs(self.folder, exist_ok=True)
+            with open(os.path.join(self.folder, file), 'wb') as f:
+                f.write(content)
+            self.manifest['responses'].append(
+                {'url': self.redact(url), 'file': file, 'status_code': r.status_code,
+                 'content_type': r.headers.get('content-type'), 'encoding': r.encoding})
+            return r
+        recorded = self.manifest['responses'][n]
+        r = requests.Response()
+        with open(os.path.join(self.folder, recorded['file']), 'rb') as f:
+            r._content = f.read()
+        r.status_code = recorded['status_code']
+        r.headers = CaseInsensitiveDict({'content-type': recorded['content_type']})
+        r.encoding = recorded['encoding']
+        r.url = url
+        return r
+
+    def response_bytes(self):
+        """
+        :return: int, total size of the recorded responses
+        """
+        return sum(os.path.getsize(os.path.join(self.folder, r['file']))
+                   for r in self.manifest['responses'])
+
+    def __enter__(self):
+        if not self.record:
+            self.load_manifest()
+        self._responses_called = []
+        self._original = fba.make_http_request
+        fba.make_http_request = self.make_http_request
+        return self
+
+    def __exit__(self, *args):
+        fba.make_http_request = self._original
+        self._original = None
+
+
+def replay_source(source, year, path=None, record=False):
+    """
+    Run the url calls, parsing, and processing of a data source for a year, with the
+    responses replayed from, or recorded to, the fixtures. The FBA is not saved
+    :param source: str, data source name
+    :param year: str, year
+    :param path: str, fixture folder
+    :param record: bool, True to call the urls and record the responses
+    :return: dictionary of the FBA dfs, and the time (s), rows and MB of each stage
+    """
+    year = str(year)
+    config = load_sourceconfig(source)
+    args = {'source': source, 'year': year}
+    api_key = None
+    if record and config.get('api_name') not in (None, 'None'):
+        api_key = load_api_key(config['api_name'])
+    fbas = []
+    original_write = fba.write_fba_file
+    fba.write_fba_file = lambda df, paths, meta: fbas.append(df)
+    try:
+        with RecordedResponses(source, year, path, record, api_key) as responses:
+            if record:
+                urls = fba.assemble_urls_for_query(fba.build_url_for_query(config, args),
+                                                   config, args)
+                responses.manifest['urls'] = [responses.redact(u) for u in urls]
+            else:
+                # replay the urls recorded, the api key is not required
+                urls = responses.manifest['urls']
+            start = time.perf_counter()
+            dataframe_list = fba.call_urls(urls, args, config)
+            call_time = time.perf_counter() - start
+            start = time.perf_counter()
+            df = fba.parse_data(dataframe_list, args, config)
+            parse_time = time.perf_counter() - start
+            frames = df if isinstance(df, list) else [df]
+            start = time.perf_counter()
+            for frame in frames:
+                if len(frame) > 0:
+                    name = frame['SourceName'].iloc[0] if 'SourceName' in frame else source
+                    fba.process_data_frame(frame, name, year)
+            process_time = time.perf_counter() - start
+            if record:
+                responses.save_manifest()
+            response_mb = responses.response_bytes() / 1024 ** 2
+    finally:
+        fba.write_fba_file = original_write
+    return {'fbas': fbas, 'CallTime': call_time, 'ParseTime': parse_time,
+            'ProcessTime': process_time, 'Responses': len(responses.manifest['responses']),
+            'ResponseMB': response_mb, 'RowsCalled': sum(len(d) for d in dataframe_list),
+            'RowsParsed': sum(len(f) for f in frames)}
+
+
+def parser_throughput(result):
+    """
+    Throughput of the call and parse functions of a data source
+    :param result: dictionary returned by replay_source()
+    :return: dictionary of rows/sec and MB/sec of the call and parse functions
+    """
+    call_parse_time = result['CallTime'] + result['ParseTime']
+    return {'RowsPerSec': result['RowsParsed'] / call_parse_time if call_parse_time else None,
+            'MBPerSec': result['ResponseMB'] / call_parse_time if call_parse_time else None}
+
+
+def replay_sources(sources, path=None, record=False, repeat=1):
+    """
+    Replay the responses of data sources, summarizing the throughput of each parser
+    :param sources: list of (source, year)
+    :param path: str, fixture folder
+    :param record: bool, True to call the urls and record the responses
+    :param repeat: int, number of replays, the fastest replay is reported
+    :return: df, one row per data source and year
+    """
+    summary = []
+    for source, year in sources:
+        log.info('Replaying ' + source + ' ' + str(year) +
+                 (', recording responses' if record else ''))
+        results = [replay_source(source, year, path, record) for _ in range(1 if record else repeat)]
+        result = min(results, key=lambda r: r['CallTime'] + r['ParseTime'])
+        row = {'Source': source, 'Year': str(year)}
+        row.update({k: v for k, v in result.items() if k != 'fbas'})
+        row.update(parser_throughput(result))
+        summary.append(row)
+    return pd.DataFrame(summary)
+
+
+def parse_args():
+    """Make mode, source, year, and fixture parameters"""
+    ap = argparse.ArgumentParser(description='Replay recorded data source responses through '
+                                             'the FBA parsers')
+    ap.add_argument('mode', choices=['record', 'run'],
+                    help='record responses from the urls, or replay the recorded responses')
+    ap.add_argument('-s', '--source', nargs='*', default=None,
+                    help='Data source names, defaults to the sources with recorded responses '
+                         'in run mode')
+    ap.add_argument('-y', '--year', default=None,
+                    help='Year, required when recording or when a source is named')
+    ap.add_argument('-f', '--fixtures', default=None, help='Fixture folder')
+    ap.add_argument('-r', '--repeat', type=int, default=3,
+                    help='Number of replays of each source, the fastest is reported')
+    ap.add_argument('-o', '--output', default=None, help='csv file to save the summary')
+    return ap.parse_args()
+
+
+def main():
+    args = parse_args()
+    if args.source:
+        if args.year is None:
+            sys.exit('A year is required with --source')
+        sources = [(s, args.year) for s in args.source]
+    elif args.mode == 'record':
+        sources = default_sources
+    else:
+        sources = recorded_sources(args.fixtures)
+    summary = replay_sources(sources, args.fixtures, args.mode == 'record', args.repeat)
+    print(summary.to_string(index=False, float_format=lambda x: '%.2f' % x))
+    if args.output is not None:
+        summary.to_csv(args.output, index=False)
+
+
+if __name__ == '__main__':
+    configure_logging()
+    main()
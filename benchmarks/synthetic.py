@@ -0,0 +1,152 @@
+# synthetic.py (benchmarks)
+# !/usr/bin/env python3
+# coding=utf-8
+"""
+Seeded generators of synthetic FlowByActivity and FlowBySector dfs at national, state,
+and county scale. Sectors are sampled from the bundled NAICS crosswalk, each sampled
+6-digit NAICS is reported along with its 2- to 5-digit parents, and each location
+reports fewer sectors at finer geoscales, as in county level datasets.
+"""
+
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from flowsa.common import load_sector_length_crosswalk, get_fips_codes, int_to_fips, \
+    flow_by_activity_fields, flow_by_sector_fields, fba_fill_na_dict, fbs_fill_na_dict, \
+    load_activitytosector_crosswalk
+from flowsa.dataclean import clean_df
+from flowsa.mapping import encode_flowmapping
+
+geoscales = ['national', 'state', 'county']
+
+# number of 6-digit NAICS sampled for each location, by geoscale of the location
+naics6_per_location = {'national': 800, 'state': 300, 'county': 40}
+
+
+def get_locations(geoscale):
+    """
+    FIPS codes of the locations reported by a dataset at a geoscale, where state and
+    county level datasets also report the national and state totals
+    :param geoscale: 'national', 'state', or 'county'
+    :return: df with columns 'Location' and 'geoscale'
+    """
+    locations = []
+    for g in geoscales[0:geoscales.index(geoscale) + 1]:
+        locations.append(pd.DataFrame({'Location': int_to_fips(pd.Series(get_fips_codes(g))),
+                                       'geoscale': g}))
+    return pd.concat(locations, ignore_index=True)
+
+
+def sample_sectors(geoscale, seed=0):
+    """
+    Sample NAICS for each location, with a FlowAmount for each 6-digit NAICS and
+    the sum of the 6-digit FlowAmounts for the 2- to 5-digit parents
+    :param geoscale: 'national', 'state', or 'county'
+    :param seed: int, random seed
+    :return: df with columns 'Location', 'Sector', 'FlowAmount'
+    """
+    rng = np.random.default_rng(seed)
+    cw = load_sector_length_crosswalk()
+    locations = get_locations(geoscale)
+    counts = locations['geoscale'].map(naics6_per_location).values
+    # sample 6-digit NAICS without replacement within each location
+    naics6 = [rng.choice(len(cw), n, replace=False) for n in counts]
+    df = cw.iloc[np.concatenate(naics6)].reset_index(drop=True)
+    df = df.assign(Location=np.repeat(locations['Location'].values, counts),
+                   FlowAmount=rng.lognormal(4, 2, len(df)).round(0))
+    df = df.melt(id_vars=['Location', 'FlowAmount'], value_name='Sector')
+    df = df.groupby(['Location', 'Sector'], as_index=False)['FlowAmount'].sum()
+    return df
+
+
+@lru_cache(maxsize=None)
+def _sector_like_fba(geoscale, seed):
+    df = sample_sectors(geoscale, seed)
+    df = df.rename(columns={'Sector': 'ActivityProducedBy'})
+    df = df.assign(Class='Employment', SourceName='BLS_QCEW', FlowName='Number of employees',
+                   Unit='p', FlowType='ELEMENTARY_FLOW', ActivityConsumedBy=None,
+                   Compartment=None, LocationSystem='FIPS_2015', Year=2015,
+                   DataReliability=5, DataCollection=5)
+    return clean_df(df, flow_by_activity_fields, fba_fill_na_dict)
+
+
+def synthetic_sector_like_fba(geoscale, seed=0):
+    """
+    A FlowByActivity of employment by NAICS, with the same format as BLS_QCEW
+    :param geoscale: 'national', 'state', or 'county'
+    :param seed: int, random seed
+    :return: df, FlowByActivity
+    """
+    return _sector_like_fba(geoscale, seed).copy()
+
+
+@lru_cache(maxsize=None)
+def _activity_fba(geoscale, seed):
+    rng = np.random.default_rng(seed)
+    activities = load_activitytosector_crosswalk('USGS_NWIS_WU')['Activity'].unique()
+    locations = get_locations(geoscale)['Location']
+    flows = pd.DataFrame({'FlowName': ['fresh', 'fresh', 'saline', 'total'],
+                          'Compartment': ['ground', 'surface', 'ground', 'total']})
+    df = pd.MultiIndex.from_product([locations, activities, flows.index],
+                                    names=['Location', 'Activity', 'flow'])
+    df = df.to_frame(index=False).merge(flows, left_on='flow', right_index=True).drop(columns='flow')
+    df = df.assign(ActivityProducedBy='Production',
+                   FlowAmount=rng.lognormal(2, 2, len(df)).round(2))
+    df = df.rename(columns={'Activity': 'ActivityConsumedBy'})
+    df = df.assign(Class='Water', SourceName='USGS_NWIS_WU', Unit='Mgal',
+                   FlowType='ELEMENTARY_FLOW', LocationSystem='FIPS_2015', Year=2015,
+                   DataReliability=5, DataCollection=5)
+    return clean_df(df, flow_by_activity_fields, fba_fill_na_dict)
+
+
+def synthetic_activity_fba(geoscale, seed=0):
+    """
+    A FlowByActivity of water withdrawals by non-sector-like activities, with the same
+    format and activities as USGS_NWIS_WU
+    :param geoscale: 'national', 'state', or 'county'
+    :param seed: int, random seed
+    :return: df, FlowByActivity
+    """
+    return _activity_fba(geoscale, seed).copy()
+
+
+@lru_cache(maxsize=None)
+def _fbs(geoscale, seed):
+    df = _sector_like_fba(geoscale, seed)
+    df = df.rename(columns={'ActivityProducedBy': 'SectorProducedBy',
+                            'ActivityConsumedBy': 'SectorConsumedBy',
+                            'FlowName': 'Flowable', 'Compartment': 'Context',
+                            'SourceName': 'MetaSources'})
+    df = df.assign(SectorSourceName='NAICS_2012_Code')
+    return clean_df(df, flow_by_sector_fields, fbs_fill_na_dict)
+
+
+def synthetic_fbs(geoscale, seed=0):
+    """
+    A FlowBySector of employment by NAICS
+    :param geoscale: 'national', 'state', or 'county'
+    :param seed: int, random seed
+    :return: df, FlowBySector
+    """
+    return _fbs(geoscale, seed).copy()
+
+
+def synthetic_flowmapping(fba, source_name):
+    """
+    A local stand-in for a fedelemflowlist flow mapping, mapping each FlowName and
+    Compartment in a FlowByActivity to a federal elementary flow. Returned in the
+    format of flowsa.mapping._read_flowmapping(), which it can replace
+    :param fba: df, FlowByActivity
+    :param source_name: str, name of the source list
+    :return: tuple of the flow mapping df, index of flowables, index of contexts
+    """
+    flows = fba[['FlowName', 'Compartment', 'Unit']].drop_duplicates().reset_index(drop=True)
+    flowmapping = pd.DataFrame({'SourceListName': source_name,
+                                'SourceFlowName': flows['FlowName'],
+                                'SourceFlowContext': flows['Compartment'],
+                                'SourceUnit': flows['Unit'],
+                                'ConversionFactor': 1.0,
+                                'TargetFlowName': flows['FlowName'].str.capitalize(),
+                                'TargetFlowContext': 'resource/' + flows['Compartment'],
+                                'TargetUnit': flows['Unit']})
+    return encode_flowmapping(flowmapping)
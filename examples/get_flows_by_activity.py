@@ -11,12 +11,19 @@ Examples of use of flowsa. Read parquet files as dataframes.
     :param flowclass: str, a 'Class' of the flow. Optional. E.g. 'Water'
     :param geographic_level: str, a geographic level of the data.
     Optional. E.g. 'national', 'state', 'county'.
+    :param columns: list, columns to load. Optional
+    :param activities: list, activities to load, matched to ActivityProducedBy or
+    ActivityConsumedBy. Optional
+    :param flownames: list, FlowNames to load. Optional
     :return: a pandas DataFrame in FlowByActivity format
 """
 
 import flowsa
 from flowsa.common import fbaoutputpath
 
+# print log messages and save them to flowsa.log
+flowsa.configure_logging()
+
 # Load all information for USDA Cropland
 usda_cropland_fba_2017 = flowsa.getFlowByActivity(datasource="USDA_CoA_Cropland", year=2017)
 
@@ -34,3 +41,9 @@ usgs_water_fba_2015 =\
 usgs_water_fba_2015.Location =\
     usgs_water_fba_2015.Location.apply('="{}"'.format)  # maintain leading 0s in location col
 usgs_water_fba_2015.to_csv(fbaoutputpath + ds + "_" + str(year_fba) + ".csv", index=False)
+
+# only load the columns and rows needed, the filters are applied when reading the parquet
+bls_employment_2017 = \
+    flowsa.getFlowByActivity(datasource="BLS_QCEW", year=2017, flowclass='Employment',
+                             geographic_level='national', flownames=['Number of employees'],
+                             columns=['ActivityProducedBy', 'Location', 'FlowAmount', 'Unit'])
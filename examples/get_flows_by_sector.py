@@ -12,6 +12,9 @@ Retrieves stored data in the FlowBySector format
 import flowsa
 from flowsa.datachecks import compare_FBS_results
 
+# print log messages and save them to flowsa.log
+flowsa.configure_logging()
+
 # load FBS from local directory, if does not exist, method will run
 fbs_water = flowsa.getFlowBySector('Water_national_2015_m1')
 
@@ -8,5 +8,8 @@ Writes a .bib for sources in a FlowBySector method yaml
 
 import flowsa
 
+# print log messages and save them to flowsa.log
+flowsa.configure_logging()
+
 # write bib file to local directory, FBS methods must be in list
 flowsa.writeFlowBySectorBibliography(['Land_national_2012', 'Water_national_2015_m1'])
@@ -7,58 +7,109 @@ For standard dataframe formats, see https://github.com/USEPA/flowsa/tree/master/
 """
 
 import logging as log
+import pandas as pd
 from esupy.processed_data_mgmt import load_preprocessed_output
-from flowsa.common import paths, set_fb_meta, biboutputpath, fbaoutputpath, fbsoutputpath
-from flowsa.flowbyfunctions import collapse_fbs_sectors, filter_by_geoscale
+from flowsa.common import paths, set_fb_meta, biboutputpath, fbaoutputpath, fbsoutputpath, \
+    configure_logging
+from flowsa.flowbyfunctions import collapse_fbs_sectors
+from flowsa.storage import load_fba_output, fba_filters, dataset_years, load_fba_dataset, \
+    fba_dataset_path
 from flowsa.datachecks import check_for_nonetypes_in_sector_col, check_for_negative_flowamounts
 import flowsa.flowbyactivity
 import flowsa.flowbysector
 from flowsa.bibliography import generate_fbs_bibliography
 
 
-def getFlowByActivity(datasource, year, flowclass=None, geographic_level=None):
+def fba_years(year):
+    """
+    :param year: int or str year, a range of years 'YYYY-YYYY', or a list of years
+    :return: list of str years
+    """
+    if isinstance(year, (list, tuple)):
+        return [str(y) for y in year]
+    if '-' in str(year):
+        min_year, max_year = str(year).split('-')
+        return [str(y) for y in range(int(min_year), int(max_year) + 1)]
+    return [str(year)]
+
+
+def _load_fba(datasource, years, columns, filters):
+    """
+    Load years of an FBA from the partitioned FBA dataset, or else the FBA files
+    :return: list of dfs, list of years not found
+    """
+    stored = dataset_years(datasource)
+    partitioned = [y for y in years if int(y) in stored]
+    fbas = []
+    if len(partitioned) > 0:
+        fbas.append(load_fba_dataset(datasource, partitioned, columns, filters))
+        log.info('Loaded ' + datasource + ' ' + ', '.join(partitioned) + ' from ' +
+                 fba_dataset_path)
+    missing = []
+    for y in [y for y in years if y not in partitioned]:
+        fba_meta = set_fb_meta(flowsa.flowbyactivity.set_fba_name(datasource, y),
+                               "FlowByActivity")
+        fba = load_fba_output(fba_meta, columns, filters)
+        if fba is None:
+            missing.append(y)
+        else:
+            log.info('Loaded ' + datasource + ' ' + y + ' from ' + fbaoutputpath)
+            fbas.append(fba)
+    return fbas, missing
+
+
+def getFlowByActivity(datasource, year, flowclass=None, geographic_level=None, columns=None,
+                      activities=None, flownames=None):
     """
     Retrieves stored data in the FlowByActivity format
     :param datasource: str, the code of the datasource.
-    :param year: int, a year, e.g. 2012
+    :param year: int, a year, e.g. 2012, or a range of years, e.g. '2010-2018'
     :param flowclass: str, a 'Class' of the flow. Optional. E.g. 'Water'
     :param geographic_level: str, a geographic level of the data.
     Optional. E.g. 'national', 'state', 'county'.
+    :param columns: list, columns to load. Optional, defaults to all columns
+    :param activities: list, activities to load, matched to ActivityProducedBy or
+    ActivityConsumedBy. Optional
+    :param flownames: list, FlowNames to load. Optional
     :return: a pandas DataFrame in FlowByActivity format
     """
-    # Set fba metadata
-    name = flowsa.flowbyactivity.set_fba_name(datasource, year)
-    fba_meta = set_fb_meta(name, "FlowByActivity")
-
-    # Try to load a local version of fba; generate and load if missing
-    fba = load_preprocessed_output(fba_meta, paths)
-    if fba is None:
-        log.info(datasource + ' ' + str(year) + ' not found in ' +
-                 fbaoutputpath + ', running functions to generate FBA')
-        # Generate the fba
-        flowsa.flowbyactivity.main(year=year, source=datasource)
+    # the optional parameters are applied by the parquet reader
+    filters = fba_filters(flowclass, geographic_level, activities, flownames)
+
+    # Try to load local versions of the fba; generate and load if missing
+    fbas, missing = _load_fba(datasource, fba_years(year), columns, filters)
+    if len(missing) > 0:
+        # sources saved to the partitioned FBA dataset are generated to the dataset
+        layout = 'partitioned' if len(dataset_years(datasource)) > 0 else 'file'
+        for y in missing:
+            log.info(datasource + ' ' + y + ' not found in ' + fbaoutputpath +
+                     ', running functions to generate FBA')
+            # Generate the fba
+            flowsa.flowbyactivity.main(year=y, source=datasource, layout=layout)
         # Now load the fba
-        fba = load_preprocessed_output(fba_meta, paths)
-        if fba is None:
-            log.error('getFlowByActivity failed, FBA not found')
-        else:
-            log.info('Loaded ' + datasource + ' ' + str(year) + ' from ' + fbaoutputpath)
-    else:
-        log.info('Loaded ' + datasource + ' ' + str(year) + ' from ' + fbaoutputpath)
-
-    # Address optional parameters
-    if flowclass is not None:
-        fba = fba[fba['Class'] == flowclass]
-    # if geographic level specified, only load rows in geo level
-    if geographic_level is not None:
-        fba = filter_by_geoscale(fba, geographic_level)
+        generated, missing = _load_fba(datasource, missing, columns, filters)
+        fbas = fbas + generated
+        if len(missing) > 0:
+            log.error('getFlowByActivity failed, FBA not found for ' + datasource + ' ' +
+                      ', '.join(missing))
+    if len(fbas) == 0:
+        return None
+    fba = fbas[0] if len(fbas) == 1 else pd.concat(fbas, ignore_index=True)
+
+    # if geographic level specified, only rows in geo level are loaded
+    if geographic_level is not None and len(fba) == 0:
+        log.error("No flows found in the " + " flow dataset at the " + geographic_level +
+                  " scale")
+        return None
     return fba
 
 
-def getFlowBySector(methodname):
+def getFlowBySector(methodname, validation='full'):
     """
     Loads stored FlowBySector output or generates it if it doesn't exist, then loads
     :param methodname: string, Name of an available method for the given class
+    :param validation: str, 'off', 'fast', or 'full', level of the datachecks run
+        if the FBS is generated
     :return: dataframe in flow by sector format
     """
     fbs_meta = set_fb_meta(methodname, "FlowBySector")
@@ -67,7 +118,7 @@ def getFlowBySector(methodname):
         log.info(methodname + ' not found in ' + fbsoutputpath +
                  ', running functions to generate FBS')
         # Generate the fba
-        flowsa.flowbysector.main(method=methodname)
+        flowsa.flowbysector.main(method=methodname, validation=validation)
         # Now load the fba
         fbs = load_preprocessed_output(fbs_meta,paths)
         if fbs is None:
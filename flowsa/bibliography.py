@@ -7,8 +7,6 @@ Function to generate .bib file for FlowBySector method(s)
 
 import os
 import logging as log
-from bibtexparser.bwriter import BibTexWriter
-from bibtexparser.bibdatabase import BibDatabase
 from flowsa.flowbysector import load_method
 from flowsa.common import outputpath, biboutputpath, load_sourceconfig, \
     load_values_from_literature_citations_config
@@ -20,6 +18,9 @@ def generate_fbs_bibliography(methodnames):
     :param methodname: list of methodnames to create a bibliiography
     :return: a .bib file saved in local directory
     """
+    # bibtexparser is only imported when generating a bibliography
+    from bibtexparser.bwriter import BibTexWriter
+    from bibtexparser.bibdatabase import BibDatabase
 
     fbas = []
     for m in methodnames:
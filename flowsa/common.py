@@ -5,24 +5,20 @@
 """Common variables and functions used across flowsa"""
 import sys
 import os
+import shutil
+import tempfile
 import subprocess
+from functools import lru_cache
 import logging as log
 import yaml
 from ruamel.yaml import YAML
-import requests
-import requests_ftp
 import pandas as pd
 import numpy as np
-import pycountry
-import pkg_resources
 from esupy.processed_data_mgmt import Paths, FileMeta
 
 # set version number for use in FBA and FBS output naming schemas, needs to be updated with setup.py
 pkg_version_number = '0.1.1'
 
-log.basicConfig(level=log.DEBUG, format='%(asctime)s %(levelname)-8s %(message)s',
-                datefmt='%Y-%m-%d %H:%M:%S', stream=sys.stdout)
-
 try:
     modulepath = os.path.dirname(os.path.realpath(__file__)).replace('\\', '/') + '/'
 except NameError:
@@ -41,33 +37,75 @@ outputpath = paths.local_path.replace('\\', '/') + '/'
 fbaoutputpath = outputpath + 'FlowByActivity/'
 fbsoutputpath = outputpath + 'FlowBySector/'
 biboutputpath = outputpath + 'Bibliography/'
+crosswalkoutputpath = outputpath + 'Crosswalks/'
 
 # paths to scripts
 scriptpath = os.path.dirname(os.path.dirname(os.path.abspath(__file__))).replace('\\', '/') + \
              '/scripts/'
 scriptsFBApath = scriptpath + 'FlowByActivity_Datasets/'
 
-# setup log file handler
-fh = log.FileHandler(outputpath+'flowsa.log', mode='w')
-fh.setLevel(log.DEBUG)
-formatter = log.Formatter('%(asctime)s %(levelname)-8s %(message)s',
-                          datefmt='%Y-%m-%d %H:%M:%S')
-fh.setFormatter(formatter)
-ch = log.StreamHandler(stream=sys.stdout)
-ch.setLevel(log.INFO)
-ch.setFormatter(formatter)
-for hdlr in log.getLogger('').handlers[:]:
-    log.getLogger('').removeHandler(hdlr)
-log.getLogger('').addHandler(fh)
-log.getLogger('').addHandler(ch)
-
-
-pkg = pkg_resources.get_distribution("flowsa")
-try:
-    git_hash = subprocess.check_output(['git', 'rev-parse', 'HEAD']).strip().decode(
-        'ascii')[0:7]
-except:
-    git_hash = None
+
+def configure_logging(log_file=True, level=log.INFO, mode='w'):
+    """
+    Attach handlers to the root logger, printing flowsa log messages to stdout and
+    saving them to flowsa.log in the local flowsa folder. Importing flowsa does not
+    configure logging, the command line runs of flowbyactivity.py and flowbysector.py
+    call this function, and scripts using flowsa can call it or configure logging themselves
+    :param log_file: bool, True to save log messages to flowsa.log
+    :param level: int, level of the messages printed to stdout
+    :param mode: str, 'w' to overwrite flowsa.log, 'a' to append to it, such as
+        when logging from multiple processes
+    """
+    formatter = log.Formatter('%(asctime)s %(levelname)-8s %(message)s',
+                              datefmt='%Y-%m-%d %H:%M:%S')
+    root = log.getLogger('')
+    for hdlr in root.handlers[:]:
+        root.removeHandler(hdlr)
+    root.setLevel(log.DEBUG)
+    if log_file:
+        os.makedirs(outputpath, exist_ok=True)
+        fh = log.FileHandler(outputpath + 'flowsa.log', mode=mode)
+        fh.setLevel(log.DEBUG)
+        fh.setFormatter(formatter)
+        root.addHandler(fh)
+    ch = log.StreamHandler(stream=sys.stdout)
+    ch.setLevel(level)
+    ch.setFormatter(formatter)
+    root.addHandler(ch)
+
+
+@lru_cache()
+def get_git_hash():
+    """
+    Get the short hash of the git commit of flowsa, run once on first use
+    :return: str, 7 character git hash, None if flowsa is not in a git repository
+    """
+    try:
+        git_hash = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=modulepath,
+                                           stderr=subprocess.DEVNULL)
+        return git_hash.strip().decode('ascii')[0:7]
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@lru_cache()
+def get_pkg_distribution():
+    """
+    Get the installed distribution of flowsa, loaded on first use
+    :return: pkg_resources Distribution
+    """
+    import pkg_resources
+    return pkg_resources.get_distribution("flowsa")
+
+
+def __getattr__(name):
+    # 'git_hash' and 'pkg' are resolved when first accessed rather than on import
+    if name == 'git_hash':
+        return get_git_hash()
+    if name == 'pkg':
+        return get_pkg_distribution()
+    raise AttributeError("module 'flowsa.common' has no attribute " + repr(name))
+
 
 # Common declaration of write format for package data products
 write_format = "parquet"
@@ -122,10 +160,12 @@ def make_http_request(url):
     :param url: URL to query
     :return: request Object
     """
+    import requests
     r = []
     try:
         r = requests.get(url)
     except requests.exceptions.InvalidSchema:  # if url is ftp rather than http
+        import requests_ftp
         requests_ftp.monkeypatch_session()
         r = requests.Session().get(url)
     except requests.exceptions.ConnectionError:
@@ -137,13 +177,125 @@ def make_http_request(url):
     return r
 
 
+def activitytosector_crosswalk_names():
+    """
+    List the activity-to-sector crosswalks in 'activitytosectormapping'
+    :return: dictionary of crosswalk name : csv file name
+    """
+    crosswalks = {}
+    for f in sorted(os.listdir(crosswalkpath)):
+        if f.startswith('Crosswalk_') and f.endswith('_toNAICS.csv'):
+            crosswalks[f[len('Crosswalk_'):-len('_toNAICS.csv')]] = f
+    return crosswalks
+
+
+def read_crosswalk_csvs():
+    """
+    Read the csvs of the activity-to-sector crosswalks, the NAICS year crosswalk,
+    and the NAICS length crosswalk
+    :return: dictionary of store table name : df
+    """
+    xwalks = []
+    for name, f in activitytosector_crosswalk_names().items():
+        # strip the byte order mark some csvs are saved with
+        cw = pd.read_csv(crosswalkpath + f, dtype={'Activity': 'str', 'Sector': 'str'},
+                         encoding='utf-8-sig')
+        xwalks.append(cw.assign(CrosswalkName=name))
+    return {'ActivityToSector': pd.concat(xwalks, ignore_index=True, sort=False),
+            'NAICS_Crosswalk': pd.read_csv(datapath + "NAICS_Crosswalk.csv", dtype="str"),
+            'NAICS_2012_Crosswalk': pd.read_csv(datapath + 'NAICS_2012_Crosswalk.csv', dtype='str')}
+
+
+def compile_crosswalk_store():
+    """
+    Compile the activity-to-sector crosswalks, the NAICS year crosswalk, and the
+    NAICS length crosswalk into parquet files in the local 'Crosswalks' folder.
+    The activity-to-sector crosswalks are written as one dataset partitioned by
+    crosswalk name. Rerun after modifying a crosswalk csv, although the store is
+    also recompiled automatically when it is older than a csv.
+    :return: None
+    """
+    log.info("Compiling crosswalks to " + crosswalkoutputpath)
+    os.makedirs(crosswalkoutputpath, exist_ok=True)
+    # write the store to a temporary folder and swap each table into place, so other
+    # processes never read a partially written table
+    tmp = tempfile.mkdtemp(prefix='.compile-', dir=crosswalkoutputpath)
+    try:
+        tables = read_crosswalk_csvs()
+        for name, df in tables.items():
+            if name == 'ActivityToSector':
+                df.to_parquet(os.path.join(tmp, name + '.parquet'),
+                              partition_cols=['CrosswalkName'], index=False)
+            else:
+                df.to_parquet(os.path.join(tmp, name + '.parquet'), index=False)
+        for name in tables:
+            path = crosswalkoutputpath + name + '.parquet'
+            if os.path.isdir(path):
+                # a folder can only replace an empty folder, move the previous table aside
+                os.replace(path, os.path.join(tmp, name + '.old'))
+            os.replace(os.path.join(tmp, name + '.parquet'), path)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def crosswalk_store_is_current():
+    """
+    Check that the compiled crosswalk store exists and is newer than all crosswalk csvs
+    :return: boolean
+    """
+    paths = [crosswalkoutputpath + name + '.parquet'
+             for name in ['ActivityToSector', 'NAICS_Crosswalk', 'NAICS_2012_Crosswalk']]
+    if not all(os.path.exists(p) for p in paths):
+        return False
+    csvs = [crosswalkpath + f for f in activitytosector_crosswalk_names().values()] + \
+        [datapath + "NAICS_Crosswalk.csv", datapath + 'NAICS_2012_Crosswalk.csv']
+    return min(os.path.getmtime(p) for p in paths) >= max(os.path.getmtime(f) for f in csvs)
+
+
+@lru_cache(maxsize=None)
+def _read_crosswalk_store(name, crosswalk_name=None):
+    """
+    Read a table of the compiled crosswalk store a single time per session. The store is
+    compiled when missing or out of date, and the csvs are read if it cannot be written.
+    :param name: str, 'ActivityToSector', 'NAICS_Crosswalk', or 'NAICS_2012_Crosswalk'
+    :param crosswalk_name: str, name of an activity-to-sector crosswalk to read
+    :return: df
+    """
+    try:
+        if not crosswalk_store_is_current():
+            compile_crosswalk_store()
+        if crosswalk_name is None:
+            df = pd.read_parquet(crosswalkoutputpath + name + '.parquet')
+        else:
+            df = pd.read_parquet(crosswalkoutputpath + name + '.parquet',
+                                 filters=[('CrosswalkName', '=', crosswalk_name)])
+            df = df.drop(columns='CrosswalkName')
+    except (OSError, ImportError) as e:
+        log.debug("Reading crosswalk csvs, unable to use compiled crosswalks: %s", e)
+        df = read_crosswalk_csvs()[name]
+        if crosswalk_name is not None:
+            df = df[df['CrosswalkName'] == crosswalk_name].drop(columns='CrosswalkName')
+    # missing values are read from csv as nan rather than None
+    df = df.reset_index(drop=True)
+    df = df.where(df.notnull(), np.nan)
+    return df
+
+
+def load_activitytosector_crosswalk(crosswalk_name):
+    """
+    Load an activity-to-sector crosswalk from the compiled crosswalk store
+    :param crosswalk_name: str, crosswalk file name without 'Crosswalk_' and '_toNAICS.csv'
+    :return: df, activity-to-sector crosswalk
+    """
+    return _read_crosswalk_store('ActivityToSector', crosswalk_name).copy()
+
+
 def load_sector_crosswalk():
     """
     Load NAICS crosswalk between the years 2007, 2012, 2017
     :return: df, NAICS crosswalk over the years
     """
-    cw = pd.read_csv(datapath + "NAICS_Crosswalk.csv", dtype="str")
-    return cw
+    return _read_crosswalk_store('NAICS_Crosswalk').copy()
 
 
 def load_sector_length_crosswalk():
@@ -151,8 +303,7 @@ def load_sector_length_crosswalk():
     Load the 2-digit to 6-digit NAICS crosswalk for 2012
     :return: df, NAICS 2012 crosswalk by sector length
     """
-    cw = pd.read_csv(datapath + 'NAICS_2012_Crosswalk.csv', dtype='str')
-    return cw
+    return _read_crosswalk_store('NAICS_2012_Crosswalk').copy()
 
 
 def load_household_sector_codes():
@@ -403,6 +554,15 @@ fbs_collapsed_default_grouping_fields = get_flow_by_groupby_cols(flow_by_sector_
 fba_mapped_default_grouping_fields = get_flow_by_groupby_cols(flow_by_activity_wsec_mapped_fields)
 
 
+@lru_cache(maxsize=None)
+def _read_FIPS_crosswalk():
+    """
+    Read 'FIPS_Crosswalk.csv' a single time per session
+    :return: df, FIPS crosswalk for all years
+    """
+    return pd.read_csv(datapath + "FIPS_Crosswalk.csv", header=0, dtype=str)
+
+
 def read_stored_FIPS(year='2015'):
     """
     Read fips based on year specified, year defaults to 2015
@@ -410,7 +570,7 @@ def read_stored_FIPS(year='2015'):
     :return:
     """
 
-    FIPS_df = pd.read_csv(datapath + "FIPS_Crosswalk.csv", header=0, dtype=str)
+    FIPS_df = _read_FIPS_crosswalk()
     # subset columns by specified year
     df = FIPS_df[["State", "FIPS_" + year, "County_" + year]]
     # rename columns
@@ -480,14 +640,71 @@ def apply_county_FIPS(df, year='2015', source_state_abbrev=True):
     return df
 
 
+def fips_to_int(location):
+    """
+    Convert FIPS Location strings to integer codes (state * 1000 + county),
+    used internally for geoscale arithmetic
+    :param location: series of 5 digit FIPS strings
+    :return: series of FIPS codes, NaN where a Location is not numeric
+    """
+    return pd.to_numeric(location, errors='coerce')
+
+
+def int_to_fips(codes):
+    """
+    Convert integer FIPS codes back to zero-padded 5 digit Location strings
+    :param codes: series of integer FIPS codes
+    :return: series of 5 digit FIPS strings, None where a code is missing
+    """
+    fips = codes.astype('Int64').astype(str).str.zfill(5)
+    return fips.where(codes.notnull(), None)
+
+
+def fips_to_state_int(location):
+    """
+    Integer state code (first two digits of FIPS) for each Location
+    :param location: series of 5 digit FIPS strings
+    :return: series of integer state codes
+    """
+    return fips_to_int(location) // 1000
+
+
+def get_fips_level(location):
+    """
+    Determine the geoscale of each FIPS Location without using the FIPS crosswalk
+    :param location: series of 5 digit FIPS strings
+    :return: array of 'national', 'state', 'county', or None if not a FIPS code
+    """
+    codes = fips_to_int(location).values
+    return np.select([codes == 0, codes % 1000 == 0, ~np.isnan(codes)],
+                     ['national', 'state', 'county'], None)
+
+
+@lru_cache(maxsize=None)
+def get_fips_codes(geoscale, year='2015'):
+    """
+    Integer FIPS codes in the FIPS crosswalk at a geoscale
+    :param geoscale: 'national', 'state', or 'county'
+    :param year: '2010', '2013', or '2015'
+    :return: numpy array of integer FIPS codes
+    """
+    if geoscale == 'national':
+        fips = pd.Series([US_FIPS])
+    elif geoscale == 'state':
+        fips = get_state_FIPS(year)['FIPS']
+    elif geoscale == 'county':
+        fips = get_county_FIPS(year)['FIPS']
+    else:
+        fips = pd.Series([], dtype=str)
+    return fips_to_int(fips).dropna().astype(int).unique()
+
+
 def update_geoscale(df, to_scale):
     """Updates df['Location'] based on specified to_scale"""
     # code for when the "Location" is a FIPS based system
     if to_scale == 'state':
-        df.loc[:, 'Location'] = df['Location'].apply(lambda x: str(x[0:2]))
-        # pad zeros
-        df.loc[:, 'Location'] = df['Location'].apply(lambda x:
-                                                     x.ljust(3 + len(x), '0') if len(x) < 5 else x)
+        # roll county FIPS up to the state FIPS by integer division
+        df.loc[:, 'Location'] = int_to_fips(fips_to_state_int(df['Location']) * 1000)
     elif to_scale == 'national':
         df.loc[:, 'Location'] = US_FIPS
     return df
@@ -541,7 +758,7 @@ def get_all_state_FIPS_2(year='2015'):
     """
 
     state_fips = get_state_FIPS(year)
-    state_fips.loc[:, 'FIPS_2'] = state_fips['FIPS'].apply(lambda x: x[0:2])
+    state_fips = state_fips.assign(FIPS_2=state_fips['FIPS'].str[0:2])
     state_fips = state_fips[['State', 'FIPS_2']]
     return state_fips
 
@@ -648,6 +865,8 @@ def assign_census_regions(df_load):
 
 def call_country_code(country):
     """use pycountry to call on 3 digit iso country code"""
+    # imported on use, to keep importing flowsa fast
+    import pycountry
     country_info = pycountry.countries.get(name=country)
     country_numeric_iso = country_info.numeric
     return country_numeric_iso
@@ -659,53 +878,89 @@ def convert_fba_unit(df):
     :param df: Either flowbyactivity
     :return: Df with standarized units
     """
-    # Convert Water units 'Bgal/d' and 'Mgal/d' to Mgal
-    days_in_year = 365
-    df.loc[:, 'FlowAmount'] = np.where(df['Unit'] == 'Bgal/d',
-                                       df['FlowAmount'] * 1000 * days_in_year, df['FlowAmount'])
-    df.loc[:, 'Unit'] = np.where(df['Unit'] == 'Bgal/d', 'Mgal', df['Unit'])
-
-    df.loc[:, 'FlowAmount'] = np.where(df['Unit'] == 'Mgal/d',
-                                       df['FlowAmount'] * days_in_year, df['FlowAmount'])
-    df.loc[:, 'Unit'] = np.where(df['Unit'] == 'Mgal/d', 'Mgal', df['Unit'])
-
-    # Convert Land unit 'Thousand Acres' to 'Acres
-    acres_in_thousand_acres = 1000
-    df.loc[:, 'FlowAmount'] = np.where(df['Unit'] == 'Thousand Acres',
-                                       df['FlowAmount'] * acres_in_thousand_acres,
-                                       df['FlowAmount'])
-    df.loc[:, 'Unit'] = np.where(df['Unit'] == 'Thousand Acres', 'Acres', df['Unit'])
-
-    # Convert Energy unit "Quadrillion Btu" to MJ
-    mj_in_btu = .0010550559
-    # 1 Quad = .0010550559 x 10^15
-    df.loc[:, 'FlowAmount'] = np.where(df['Unit'] == 'Quadrillion Btu',
-                                       df['FlowAmount'] * mj_in_btu * (10 ** 15),
-                                       df['FlowAmount'])
-    df.loc[:, 'Unit'] = np.where(df['Unit'] == 'Quadrillion Btu', 'MJ', df['Unit'])
-
-    # Convert Energy unit "Trillion Btu" to MJ
-    # 1 Tril = .0010550559 x 10^14
-    df.loc[:, 'FlowAmount'] = np.where(df['Unit'] == 'Trillion Btu',
-                                       df['FlowAmount'] * mj_in_btu * (10 ** 14),
-                                       df['FlowAmount'])
-    df.loc[:, 'Unit'] = np.where(df['Unit'] == 'Trillion Btu', 'MJ', df['Unit'])
-
-    df.loc[:, 'FlowAmount'] = np.where(df['Unit'] == 'million Cubic metres/year',
-                                       df['FlowAmount'] * 264.172, df['FlowAmount'])
-    df.loc[:, 'Unit'] = np.where(df['Unit'] == 'million Cubic metres/year', 'Mgal', df['Unit'])
-
-    # Convert mass units (LB or TON) to kg
-    ton_to_kg = 907.185
-    lb_to_kg = 0.45359
-    df.loc[:, 'FlowAmount'] = np.where(df['Unit'] == 'TON',
-                                       df['FlowAmount'] * ton_to_kg,
-                                       df['FlowAmount'])
-    df.loc[:, 'FlowAmount'] = np.where(df['Unit'] == 'LB',
-                                       df['FlowAmount'] * lb_to_kg,
-                                       df['FlowAmount'])
-    df.loc[:, 'Unit'] = np.where((df['Unit'] == 'TON') | (df['Unit'] == 'LB'),
-                                 'kg', df['Unit'])
+    # Convert Water units 'Bgal/d' and 'Mgal/d' to Mgal, Land unit 'Thousand Acres'
+    # to 'Acres', Energy units 'Quadrillion Btu' and 'Trillion Btu' to MJ,
+    # and mass units (LB or TON) to kg
+    return convert_units(df, 'FlowByActivity')
+
+
+@lru_cache(maxsize=None)
+def _read_unit_conversion_table():
+    """
+    Read 'Unit_Conversion.csv' a single time per session
+    :return: df, unit conversion table
+    """
+    cw = pd.read_csv(datapath + 'Unit_Conversion.csv',
+                     dtype={'ConversionSet': 'str', 'Class': 'str', 'SourceUnit': 'str',
+                            'TargetUnit': 'str', 'ConversionFactor': 'float'})
+    return cw
+
+
+def load_unit_conversion_table():
+    """
+    Load the unit conversions used to standardize FBA and FBS units. Conversions
+    are defined in 'Unit_Conversion.csv' and can be extended by adding rows to the csv.
+    A blank 'Class' applies the conversion to all classes, a conversion with a
+    'Class' value takes precedence for that class.
+    :return: df, unit conversion table
+    """
+    return _read_unit_conversion_table().copy()
+
+
+def convert_units(df, conversion_set, conversion_table=None):
+    """
+    Convert 'FlowAmount' and 'Unit' using a set of conversions from the unit
+    conversion table. Conversion factors are determined once for each unique
+    Class/Unit combination and applied to the df with a single multiplication.
+    :param df: flowbyactivity or flowbysector df
+    :param conversion_set: str, 'FlowByActivity' or 'Harmonized', the
+        'ConversionSet' in the table to apply
+    :param conversion_table: df, optional table in the 'Unit_Conversion.csv'
+        format, defaults to the table stored in flowsa
+    :return: df with converted units
+    """
+    if conversion_table is None:
+        conversion_table = load_unit_conversion_table()
+    conversions = conversion_table[conversion_table['ConversionSet'] == conversion_set]
+    if len(df) == 0 or len(conversions) == 0:
+        return df
+
+    # assign each row a code for its Class/Unit combination
+    if 'Class' in df.columns:
+        keys = df[['Class', 'Unit']]
+    else:
+        keys = pd.DataFrame({'Class': None, 'Unit': df['Unit']}, index=df.index)
+    grouped = keys.groupby(['Class', 'Unit'], sort=False, dropna=False)
+    codes = grouped.ngroup().values
+    unique_keys = grouped.size().reset_index()[['Class', 'Unit']]
+
+    # conversions specific to a class take precedence over conversions for all classes
+    conv_cols = ['SourceUnit', 'TargetUnit', 'ConversionFactor']
+    class_conv = conversions[conversions['Class'].notnull()]
+    all_conv = conversions[conversions['Class'].isnull()].drop_duplicates('SourceUnit')
+    unique_keys = unique_keys.merge(
+        class_conv[['Class'] + conv_cols].drop_duplicates(['Class', 'SourceUnit']),
+        how='left', left_on=['Class', 'Unit'], right_on=['Class', 'SourceUnit'])
+    unique_keys = unique_keys.merge(all_conv[conv_cols], how='left', left_on='Unit',
+                                    right_on='SourceUnit', suffixes=('', '_all'))
+    for c in ['TargetUnit', 'ConversionFactor']:
+        unique_keys[c] = unique_keys[c].fillna(unique_keys[c + '_all'])
+    converted = unique_keys['ConversionFactor'].notnull()
+
+    # report the units converted and the units not found in the conversion table
+    for u, t in unique_keys.loc[converted, ['Unit', 'TargetUnit']].drop_duplicates().values:
+        log.debug('Converting ' + str(u) + ' to ' + str(t))
+    known_units = set(conversions['SourceUnit']) | set(conversions['TargetUnit'])
+    unrecognized = [str(u) for u in unique_keys['Unit'].drop_duplicates()
+                    if u not in known_units and pd.notnull(u)]
+    if len(unrecognized) > 0:
+        log.debug('Units not in the ' + conversion_set + ' unit conversions, left unchanged: ' +
+                  ', '.join(unrecognized))
+
+    # apply the conversions to the full df
+    factor = unique_keys['ConversionFactor'].fillna(1).values[codes]
+    target = unique_keys['TargetUnit'].where(converted, unique_keys['Unit']).values[codes]
+    df = df.assign(FlowAmount=df['FlowAmount'] * factor, Unit=target)
 
     return df
 
@@ -719,9 +974,9 @@ def set_fb_meta(name_data, category):
     """
     fb_meta = FileMeta()
     fb_meta.name_data = name_data
-    fb_meta.tool = pkg.project_name
+    fb_meta.tool = get_pkg_distribution().project_name
     fb_meta.tool_version = pkg_version_number
     fb_meta.category = category
     fb_meta.ext = write_format
-    fb_meta.git_hash = git_hash
+    fb_meta.git_hash = get_git_hash()
     return fb_meta
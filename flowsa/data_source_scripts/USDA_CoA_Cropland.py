@@ -286,7 +286,7 @@ def disaggregate_pastureland(fba_w_sector, attr, method, year, sector_column):
     p = fba_w_sector.loc[fba_w_sector[sector_column].apply(lambda x: x[0:3]) == '112'].reset_index(drop=True)
     if len(p) != 0:
         # add temp loc column for state fips
-        p = p.assign(Location_tmp=p['Location'].apply(lambda x: x[0:2]))
+        p = p.assign(Location_tmp=fips_to_state_int(p['Location']))
         df_sourcename = pd.unique(p['SourceName'])[0]
 
         # load usda coa cropland naics
@@ -316,7 +316,7 @@ def disaggregate_pastureland(fba_w_sector, attr, method, year, sector_column):
         # drop naics = '11
         df_f = df_f[df_f[sector_column] != '11']
         # drop 000 in location
-        df_f = df_f.assign(Location=df_f['Location'].apply(lambda x: x[0:2]))
+        df_f = df_f.assign(Location=fips_to_state_int(df_f['Location']))
 
         # merge the coa pastureland data with land in farm data
         df = p.merge(df_f[[sector_column, 'Location', 'FlowAmountRatio']], how='left',
@@ -372,7 +372,7 @@ def disaggregate_cropland(fba_w_sector, attr, method, year, sector_column):
     # drop sectors < 4 digits
     crop = crop[crop[sector_column].apply(lambda x: len(x) > 3)].reset_index(drop=True)
     # create tmp location
-    crop = crop.assign(Location_tmp=crop['Location'].apply(lambda x: x[0:2])) \
+    crop = crop.assign(Location_tmp=fips_to_state_int(crop['Location']))
 
     # load the relevant state level harvested cropland by naics
     naics_load = flowsa.getFlowByActivity(datasource="USDA_CoA_Cropland_NAICS", year=year,
@@ -407,7 +407,7 @@ def disaggregate_cropland(fba_w_sector, attr, method, year, sector_column):
     # create ratios
     naics4 = sector_ratios(naics3, sector_column)
     # create temporary sector column to match the two dfs on
-    naics4 = naics4.assign(Location_tmp=naics4['Location'].apply(lambda x: x[0:2]))
+    naics4 = naics4.assign(Location_tmp=fips_to_state_int(naics4['Location']))
     # tmp drop Nonetypes
     naics4 = replace_NoneType_with_empty_cells(naics4)
 
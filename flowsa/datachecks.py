@@ -5,7 +5,7 @@
 Functions to check data is loaded and transformed correctly
 """
 
-import os
+from functools import lru_cache
 import pandas as pd
 import numpy as np
 from flowsa.flowbyfunctions import aggregator, create_geoscale_list,\
@@ -14,7 +14,7 @@ from flowsa.dataclean import clean_df, replace_strings_with_NoneType, \
     replace_NoneType_with_empty_cells
 from flowsa.common import US_FIPS, sector_level_key, flow_by_sector_fields,\
     load_sector_length_crosswalk, load_source_catalog, \
-    load_sector_crosswalk, sector_source_name, log, outputpath, fba_activity_fields, \
+    load_sector_crosswalk, sector_source_name, log, fba_activity_fields, \
     fbs_activity_fields, fbs_fill_na_dict
 
 
@@ -192,6 +192,119 @@ def check_if_data_exists_for_same_geoscales(fba_wsec_walloc, source,
     return None
 
 
+@lru_cache(maxsize=None)
+def _sector_length_hierarchy(target_sector_level):
+    """
+    Create a table of each sector shorter than the target sector level, the target level
+    sectors within it, and the number of target level sectors, for all sector lengths at once
+    :param target_sector_level: str, 'NAICS_3' to 'NAICS_6'
+    :return: df with columns 'Sector', 'SectorLength', 'TargetSector', 'sector_count'
+    """
+    cw_load = load_sector_length_crosswalk()
+    hierarchy = []
+    for nlength, i in sector_level_key.items():
+        if i < sector_level_key[target_sector_level]:
+            cw = cw_load[[nlength, target_sector_level]].drop_duplicates()
+            # add column with counts
+            cw = cw.assign(sector_count=cw.groupby(nlength)[nlength].transform('count'))
+            hierarchy.append(cw.rename(columns={nlength: 'Sector',
+                                                target_sector_level: 'TargetSector'}
+                                       ).assign(SectorLength=i))
+    return pd.concat(hierarchy, ignore_index=True)
+
+
+def find_rows_losing_sector_data(df, target_sector_level, group_cols=None):
+    """
+    Determine rows of data that will be lost if subset data at target sector level,
+    because there is no data at the next sector length
+    :param df: df, FBS with empty cells in place of NoneType sectors
+    :param target_sector_level: str, 'NAICS_3' to 'NAICS_6'
+    :param group_cols: list, optional columns partitioning the df (such as 'FBA_Activity'),
+           rows are only compared to rows within the same partition
+    :return: df, rows not represented at the next sector length, with column 'SectorLength'
+    """
+    target_length = sector_level_key[target_sector_level]
+    merge_cols = ['Class', 'Context', 'FlowType', 'Flowable', 'Location', 'LocationSystem',
+                  'Unit', 'Year'] + (group_cols or [])
+    spb = df[fbs_activity_fields[0]]
+    scb = df[fbs_activity_fields[1]]
+    spb_len = spb.str.len()
+    scb_len = scb.str.len()
+
+    # the sector length of each row, where one sector column is empty or both are the same length
+    # order rows by sector length, then by which sector columns are filled
+    sector_length = np.select([scb == '', spb == '', spb_len == scb_len], [spb_len, scb_len, spb_len], 0)
+    sector_cols_filled = np.select([scb == '', spb == ''], [0, 1], 2)
+    parents = df.assign(SectorLength=sector_length, sector_cols_filled=sector_cols_filled)
+    parents = parents[(parents['SectorLength'] >= 2) & (parents['SectorLength'] < target_length)]
+    parents = parents.sort_values(['SectorLength', 'sector_cols_filled'], kind='stable')
+    parents = parents.drop(columns='sector_cols_filled')
+
+    # the sectors of each row shortened to one digit less than their length, which are
+    # the sectors that have data at the next sector length
+    children = []
+    for i in range(2, target_length):
+        next_length = ((spb_len == i + 1) | (scb_len == i + 1)).values
+        df_y = df.loc[next_length, merge_cols]
+        df_y = df_y.assign(SectorProducedBy=spb[next_length].str[0:i].values,
+                           SectorConsumedBy=scb[next_length].str[0:i].values,
+                           SectorLength=i)
+        children.append(df_y)
+    children = pd.concat(children, ignore_index=True)
+    # don't modify household sector lengths
+    children = children.replace({'F0': 'F010', 'F01': 'F010'}).drop_duplicates()
+
+    # extract the rows that are not disaggregated to more specific naics
+    rl = parents.merge(children.assign(has_child=True), how='left',
+                       on=merge_cols + fbs_activity_fields + ['SectorLength'])
+    rl = rl[rl['has_child'].isnull()].drop(columns='has_child')
+
+    return rl
+
+
+def allocate_lost_sector_data(rl, target_sector_level):
+    """
+    Allocate the rows that would be lost at the target sector level equally to
+    the target sector level sectors associated with the sectors of each row
+    :param rl: df, output of find_rows_losing_sector_data()
+    :param target_sector_level: str, 'NAICS_3' to 'NAICS_6'
+    :return: df, FBS rows at the target sector level, empty df if no rows are lost
+    """
+    # clean df
+    rl_length = rl['SectorLength'].values
+    rl = clean_df(rl, flow_by_sector_fields, fbs_fill_na_dict)
+    rl = rl.assign(SectorLength=rl_length)
+
+    # match sectors with target sector length sectors, allocating equally to the new sector length codes
+    cw = _sector_length_hierarchy(target_sector_level)
+    rl_m = pd.merge(rl, cw, how='left', left_on=[fbs_activity_fields[0], 'SectorLength'],
+                    right_on=['Sector', 'SectorLength'])
+    rl_m.loc[rl_m[fbs_activity_fields[0]] != '', fbs_activity_fields[0]] = rl_m['TargetSector']
+    rl_m = rl_m.drop(columns=['Sector', 'TargetSector'])
+    rl_m2 = pd.merge(rl_m, cw, how='left', left_on=[fbs_activity_fields[1], 'SectorLength'],
+                     right_on=['Sector', 'SectorLength'])
+    rl_m2.loc[rl_m2[fbs_activity_fields[1]] != '', fbs_activity_fields[1]] = rl_m2['TargetSector']
+    rl_m2 = rl_m2.drop(columns=['Sector', 'TargetSector'])
+    # create one sector count column
+    sector_count = rl_m2['sector_count_x'].fillna(rl_m2['sector_count_y'])
+    rows_lost = rl_m2.assign(FlowAmount=rl_m2['FlowAmount'] / sector_count)
+    rows_lost = rows_lost.drop(columns=['sector_count_x', 'sector_count_y', 'SectorLength'])
+
+    for i, rl_i in rl.groupby('SectorLength'):
+        rl_list = rl_i[['SectorProducedBy', 'SectorConsumedBy']].drop_duplicates().values.tolist()
+        log.warning('Data found at ' + str(i) + ' digit NAICS not represented in current '
+                    'data subset: {}'.format(' '.join(map(str, rl_list))))
+
+    if len(rows_lost) == 0:
+        log.debug('Data exists at ' + target_sector_level)
+        rows_lost = pd.DataFrame()
+    else:
+        log.info('Allocating FlowAmounts equally to each ' + target_sector_level +
+                 ' associated with the sectors previously dropped')
+
+    return rows_lost
+
+
 def check_if_losing_sector_data(df, target_sector_level):
     """
     Determine rows of data that will be lost if subset data at target sector level
@@ -203,91 +316,8 @@ def check_if_losing_sector_data(df, target_sector_level):
     # exclude nonsectors
     df = replace_NoneType_with_empty_cells(df)
 
-    rows_lost = pd.DataFrame()
-    for i in range(2, sector_level_key[target_sector_level]):
-        # create df of i length
-        df_x1 = df.loc[(df[fbs_activity_fields[0]].apply(lambda x: len(x) == i)) &
-                       (df[fbs_activity_fields[1]] == '')]
-        df_x2 = df.loc[(df[fbs_activity_fields[0]] == '') &
-                       (df[fbs_activity_fields[1]].apply(lambda x: len(x) == i))]
-        df_x3 = df.loc[(df[fbs_activity_fields[0]].apply(lambda x: len(x) == i)) &
-                       (df[fbs_activity_fields[1]].apply(lambda x: len(x) == i))]
-        df_x = pd.concat([df_x1, df_x2, df_x3], ignore_index=True, sort=False)
-
-        # create df of i + 1 length
-        df_y1 = df.loc[df[fbs_activity_fields[0]].apply(lambda x: len(x) == i + 1) |
-                       df[fbs_activity_fields[1]].apply(lambda x: len(x) == i + 1)]
-        df_y2 = df.loc[df[fbs_activity_fields[0]].apply(lambda x: len(x) == i + 1) &
-                       df[fbs_activity_fields[1]].apply(lambda x: len(x) == i + 1)]
-        df_y = pd.concat([df_y1, df_y2], ignore_index=True, sort=False)
-
-        # create temp sector columns in df y, that are i digits in length
-        df_y.loc[:, 'spb_tmp'] = df_y[fbs_activity_fields[0]].apply(lambda x: x[0:i])
-        df_y.loc[:, 'scb_tmp'] = df_y[fbs_activity_fields[1]].apply(lambda x: x[0:i])
-        # don't modify household sector lengths
-        df_y = df_y.replace({'F0': 'F010',
-                             'F01': 'F010'})
-
-        # merge the two dfs
-        df_m = pd.merge(df_x,
-                        df_y[['Class', 'Context', 'FlowType', 'Flowable',
-                              'Location', 'LocationSystem', 'Unit',
-                              'Year', 'spb_tmp', 'scb_tmp']],
-                        how='left',
-                        left_on=['Class', 'Context', 'FlowType', 'Flowable',
-                                 'Location', 'LocationSystem', 'Unit',
-                                 'Year', 'SectorProducedBy', 'SectorConsumedBy'],
-                        right_on=['Class', 'Context', 'FlowType', 'Flowable',
-                                  'Location', 'LocationSystem', 'Unit',
-                                  'Year', 'spb_tmp', 'scb_tmp'])
-
-        # extract the rows that are not disaggregated to more specific naics
-        rl = df_m[(df_m['scb_tmp'].isnull()) & (df_m['spb_tmp'].isnull())]
-        # clean df
-        rl = clean_df(rl, flow_by_sector_fields, fbs_fill_na_dict)
-        rl_list = rl[['SectorProducedBy', 'SectorConsumedBy']].drop_duplicates().values.tolist()
-
-        # match sectors with target sector length sectors
-
-        # import cw and subset to current sector length and target sector length
-        cw_load = load_sector_length_crosswalk()
-        nlength = list(sector_level_key.keys())[list(sector_level_key.values()).index(i)]
-        cw = cw_load[[nlength, target_sector_level]].drop_duplicates()
-        # add column with counts
-        cw['sector_count'] = cw.groupby(nlength)[nlength].transform('count')
-
-        # merge df & conditionally replace sector produced/consumed columns
-        rl_m = pd.merge(rl, cw, how='left', left_on=[fbs_activity_fields[0]], right_on=[nlength])
-        rl_m.loc[rl_m[fbs_activity_fields[0]] != '',
-                 fbs_activity_fields[0]] = rl_m[target_sector_level]
-        rl_m = rl_m.drop(columns=[nlength, target_sector_level])
-
-        rl_m2 = pd.merge(rl_m, cw, how='left', left_on=[fbs_activity_fields[1]], right_on=[nlength])
-        rl_m2.loc[rl_m2[fbs_activity_fields[1]] != '',
-                  fbs_activity_fields[1]] = rl_m2[target_sector_level]
-        rl_m2 = rl_m2.drop(columns=[nlength, target_sector_level])
-
-        # create one sector count column
-        rl_m2['sector_count_x'] = rl_m2['sector_count_x'].fillna(rl_m2['sector_count_y'])
-        rl_m3 = rl_m2.rename(columns={'sector_count_x': 'sector_count'})
-        rl_m3 = rl_m3.drop(columns=['sector_count_y'])
-
-        # calculate new flow amounts, based on sector count,
-        # allocating equally to the new sector length codes
-        rl_m3['FlowAmount'] = rl_m3['FlowAmount'] / rl_m3['sector_count']
-        rl_m3 = rl_m3.drop(columns=['sector_count'])
-
-        # append to df
-        if len(rl) != 0:
-            log.warning('Data found at ' + str(i) + ' digit NAICS not represented in current '
-                        'data subset: {}'.format(' '.join(map(str, rl_list))))
-            rows_lost = rows_lost.append(rl_m3, ignore_index=True, sort=True)
-
-    if len(rows_lost) == 0:
-        log.debug('Data exists at ' + target_sector_level)
-    else:
-        log.info('Allocating FlowAmounts equally to each ' + target_sector_level +
-                 ' associated with the sectors previously dropped')
+    rl = find_rows_losing_sector_data(df, target_sector_level)
+    rows_lost = allocate_lost_sector_data(rl, target_sector_level)
 
     # add rows of missing data to the fbs sector subset
     df_w_lost_data = pd.concat([df, rows_lost], ignore_index=True, sort=True)
@@ -296,11 +326,34 @@ def check_if_losing_sector_data(df, target_sector_level):
     return df_w_lost_data
 
 
+def log_worst_offenders(df, value_col, key_cols, description, n=3):
+    """
+    Log the rows of a datacheck comparison furthest from the expected value
+    :param df: df, rows flagged by a datacheck
+    :param value_col: str, column of the distance from the expected value
+    :param key_cols: list, columns identifying a row in the log
+    :param description: str, description of the rows
+    :param n: int, number of rows to log
+    :return: None
+    """
+    if len(df) == 0:
+        return
+    worst = df.loc[df[value_col].abs().sort_values(ascending=False, na_position='first')
+                   .index[0:n]]
+    rows = ['/'.join(str(v) for v in r[1:] if v not in (None, '')) + ': ' + '%.4g' % r[0]
+            for r in worst[[value_col] + key_cols].itertuples(index=False)]
+    log.info('Largest ' + description + ': ' + '; '.join(rows))
+
+
 def check_allocation_ratios(flow_alloc_df_load, activity_set, source_name, method_name):
     """
-    Check for issues with the flow allocation ratios
-    :param df:
-    :return:
+    Check for issues with the flow allocation ratios, flagging ratios summed by
+    activity, location, and sector length of 6 or less outside of 0.99 to 1.01
+    :param flow_alloc_df_load: df, allocation ratios of an activity set
+    :param activity_set: str, activity set name
+    :param source_name: str, datasource name
+    :param method_name: str, FBS method name
+    :return: df, summed allocation ratios at each sector length
     """
 
     # create column of sector lengths
@@ -312,40 +365,21 @@ def check_allocation_ratios(flow_alloc_df_load, activity_set, source_name, metho
     flow_alloc_df3 = flow_alloc_df2.groupby(['FBA_Activity', 'Location', 'slength'],
                                             as_index=False)[["FlowAmountRatio"]].agg("sum")
     # not interested in sector length > 6
-    flow_alloc_df4 = flow_alloc_df3[flow_alloc_df3['slength'] <= 6]
-
-    ua_count1 = len(flow_alloc_df4[flow_alloc_df4['FlowAmountRatio'] < 1])
-    if ua_count1 > 0:
-        log.info('There are ' + str(ua_count1) +
-                 ' instances at a sector length of 6 or less where the allocation ratio '
-                 'for a location and sector length is < 1')
-    ua_count2 = len(flow_alloc_df4[flow_alloc_df4['FlowAmountRatio'] < 0.99])
-    if ua_count2 > 0:
-        log.debug('There are ' + str(ua_count2) +
-                 ' instances at a sector length of 6 or less where the allocation ratio '
-                 'for a location and sector length is < 0.99')
-    ua_count3 = len(flow_alloc_df4[flow_alloc_df4['FlowAmountRatio'] > 1])
-    if ua_count3 > 0:
-        log.debug('There are ' + str(ua_count3) +
-                 ' instances at a sector length of 6 or less where the allocation ratio '
-                 'for a location and sector length is > 1')
-    ua_count4 = len(flow_alloc_df4[flow_alloc_df4['FlowAmountRatio'] > 1.01])
-    if ua_count4 > 0:
-        log.info('There are ' + str(ua_count4) +
-                 ' instances at a sector length of 6 or less where the allocation'
-                 ' ratio for a location and sector length is > 1.01')
-
-    # save csv to output folder
-    log.info('Save the summary table of flow allocation ratios for each sector length for ' +
-             activity_set + ' in output folder')
-    # create directory if missing
-    os.makedirs(outputpath + '/FlowBySectorMethodAnalysis', exist_ok=True)
-    # output data for all sector lengths
-    flow_alloc_df3.to_csv(outputpath + "/FlowBySectorMethodAnalysis/" +
-                          method_name + '_' + source_name +
-                          "_allocation_ratios_" + activity_set + ".csv", index=False)
+    flow_alloc_df3['Flag'] = (flow_alloc_df3['slength'] <= 6) & \
+        ((flow_alloc_df3['FlowAmountRatio'] - 1).abs() > 0.01)
 
-    return None
+    flagged = flow_alloc_df3[flow_alloc_df3['Flag']]
+    if len(flagged) > 0:
+        log.info('There are ' + str(len(flagged)) + ' instances for ' + source_name + ' ' +
+                 activity_set + ' at a sector length of 6 or less where the allocation ratio '
+                 'for a location and sector length is < 0.99 (' +
+                 str((flagged['FlowAmountRatio'] < 1).sum()) + ') or > 1.01 (' +
+                 str((flagged['FlowAmountRatio'] > 1).sum()) + ')')
+        log_worst_offenders(flagged.assign(Distance=flagged['FlowAmountRatio'] - 1), 'Distance',
+                            ['FBA_Activity', 'Location', 'slength'],
+                            'allocation ratio differences from 1')
+
+    return flow_alloc_df3
 
 
 def check_for_differences_between_fba_load_and_fbs_output(fba_load, fbs_load,
@@ -354,7 +388,8 @@ def check_for_differences_between_fba_load_and_fbs_output(fba_load, fbs_load,
     Function to compare the loaded flowbyactivity with the final flowbysector
     output, checking for data loss
     :param df:
-    :return:
+    :return: df, ratios of FBS to FBA FlowAmounts at each sector length, flagging
+        ratios < 0.95 or > 1.01 at sector lengths of 6 or less
     """
 
     # from flowsa.flowbyfunctions import replace_NoneType_with_empty_cells
@@ -405,40 +440,21 @@ def check_for_differences_between_fba_load_and_fbs_output(fba_load, fbs_load,
                          'SectorLength', 'FBA_amount', 'FBS_amount', 'Ratio']]
 
     # only report difference at sector length <= 6
-    comparison = df_merge[df_merge['SectorLength'] <= 6]
-
     # todo: address the duplicated rows/data that occur for non-naics household sector length
+    df_merge['Flag'] = (df_merge['SectorLength'] <= 6) & \
+        ((df_merge['Ratio'] < 0.95) | (df_merge['Ratio'] > 1.01))
 
-    ua_count1 = len(comparison[comparison['Ratio'] < 0.95])
-    if ua_count1 > 0:
-        log.info('There are ' + str(ua_count1) +
-                 ' combinations of flowable/context/sector length where the '
-                 'flowbyactivity to flowbysector ratio is < 0.95')
-    ua_count2 = len(comparison[comparison['Ratio'] < 0.99])
-    if ua_count2 > 0:
-        log.debug('There are ' + str(ua_count2) +
-                 ' combinations of flowable/context/sector length where the '
-                 'flowbyactivity to flowbysector ratio is < 0.99')
-    oa_count1 = len(comparison[comparison['Ratio'] > 1])
-    if oa_count1 > 0:
-        log.debug('There are ' + str(oa_count1) +
-                 ' combinations of flowable/context/sector length where the flowbyactivity '
-                 'to flowbysector ratio is > 1.0')
-    oa_count2 = len(comparison[comparison['Ratio'] > 1.01])
-    if oa_count2 > 0:
-        log.info('There are ' + str(oa_count2) +
-                 ' combinations of flowable/context/sector length where the '
-                 'flowbyactivity to flowbysector ratio is > 1.01')
-
-    # save csv to output folder
-    log.info('Save the comparison of FlowByActivity load to FlowBySector ratios for ' +
-              activity_set + ' in output folder')
-    # create directory if missing
-    os.makedirs(outputpath + '/FlowBySectorMethodAnalysis', exist_ok=True)
-    # output data at all sector lengths
-    df_merge.to_csv(outputpath + "/FlowBySectorMethodAnalysis/" + method_name + '_' +
-                    source_name + "_FBA_load_to_FBS_comparision_" +
-                    activity_set + ".csv", index=False)
+    flagged = df_merge[df_merge['Flag']]
+    if len(flagged) > 0:
+        log.info('There are ' + str(len(flagged)) + ' combinations of flowable/context/sector '
+                 'length for ' + source_name + ' ' + activity_set + ' where the flowbyactivity '
+                 'to flowbysector ratio is < 0.95 (' + str((flagged['Ratio'] < 1).sum()) +
+                 ') or > 1.01 (' + str((flagged['Ratio'] > 1).sum()) + ')')
+        log_worst_offenders(flagged.assign(Distance=flagged['Ratio'] - 1), 'Distance',
+                            ['Flowable', 'Context', 'SectorLength'],
+                            'flowbyactivity to flowbysector ratio differences from 1')
+
+    return df_merge
 
 
 def compare_fba_load_and_fbs_output_totals(fba_load, fbs_load, activity_set,
@@ -446,7 +462,8 @@ def compare_fba_load_and_fbs_output_totals(fba_load, fbs_load, activity_set,
     """
     Function to compare the loaded flowbyactivity total with the final flowbysector output total
     :param df:
-    :return:
+    :return: df, differences between FBA and FBS totals by context, flagging
+        differences of more than 0.001% or that can not be calculated
     """
 
     from flowsa.mapping import map_elementary_flows
@@ -493,60 +510,32 @@ def compare_fba_load_and_fbs_output_totals(fba_load, fbs_load, activity_set,
     fbs_agg.rename(columns={'FlowAmount': 'FBS_amount',
                             'Unit': 'FBS_unit'}, inplace=True)
 
-    try:
-        # merge FBA and FBS totals
-        df_merge = fba_agg.merge(fbs_agg, how='left')
-        df_merge['FlowAmount_difference'] = df_merge['FBA_amount'] - df_merge['FBS_amount']
-        df_merge['Percent_difference'] =\
-            (df_merge['FlowAmount_difference']/df_merge['FBA_amount']) * 100
-
-        # reorder
-        df_merge = df_merge[['Class', 'Context', 'Location', 'LocationSystem',
-                             'FBA_amount', 'FBA_unit', 'FBS_amount', 'FBS_unit',
-                             'FlowAmount_difference', 'Percent_difference']]
-        df_merge = replace_NoneType_with_empty_cells(df_merge)
-
-        # list of contexts
-        context_list = df_merge['Context'].to_list()
-
-        # loop through the contexts and print results of comparison
-        for i in context_list:
-            df_merge_subset = df_merge[df_merge['Context'] == i].reset_index(drop=True)
-            diff_per = df_merge_subset['Percent_difference'][0]
-            if np.isnan(diff_per):
-                log.info('The total FlowBySector FlowAmount for ' + source_name +
-                         ' ' + activity_set + ' ' + i + ' can not be calculated.')
-                continue
-            # make reporting more manageable
-            if abs(diff_per) > 0.001:
-                diff_per = round(diff_per, 2)
-            else:
-                diff_per = round(diff_per, 6)
+    # merge FBA and FBS totals
+    df_merge = fba_agg.merge(fbs_agg, how='left')
+    df_merge['FlowAmount_difference'] = df_merge['FBA_amount'] - df_merge['FBS_amount']
+    df_merge['Percent_difference'] =\
+        (df_merge['FlowAmount_difference']/df_merge['FBA_amount']) * 100
 
-            # diff_units = df_merge_subset['FBS_unit'][0]
-            if diff_per > 0:
-                log.info('The total FlowBySector FlowAmount for ' + source_name + ' '
-                         + activity_set + ' ' + i + ' is ' + str(abs(diff_per)) +
-                         '% less than the total FlowByActivity FlowAmount')
-            else:
-                log.info('The total FlowBySector FlowAmount for ' + source_name +
-                         ' ' + activity_set + ' ' + i + ' is ' + str(abs(diff_per)) +
-                         '% more than the total FlowByActivity FlowAmount')
-
-        # save csv to output folder
-        log.info('Save the comparison of FlowByActivity load to FlowBySector'
-                 'total FlowAmounts for ' + activity_set + ' in output folder')
-        # output data at all sector lengths
-        df_merge.to_csv(outputpath + "FlowBySectorMethodAnalysis/" +
-                        method_name + '_' + source_name +
-                        "_FBA_total_to_FBS_total_FlowAmount_comparison_" +
-                        activity_set + ".csv", index=False)
-
-    except:
-        log.info('Error occured when comparing total FlowAmounts'
-                 'for FlowByActivity and FlowBySector')
-
-    return None
+    # reorder
+    df_merge = df_merge[['Class', 'Context', 'Location', 'LocationSystem',
+                         'FBA_amount', 'FBA_unit', 'FBS_amount', 'FBS_unit',
+                         'FlowAmount_difference', 'Percent_difference']]
+    df_merge = replace_NoneType_with_empty_cells(df_merge)
+    df_merge['Flag'] = df_merge['Percent_difference'].isnull() | \
+        (df_merge['Percent_difference'].abs() > 0.001)
+
+    # summarize the comparison of the contexts
+    diff = df_merge['Percent_difference']
+    log.info('The total FlowBySector FlowAmount for ' + source_name + ' ' + activity_set +
+             ' is within 0.001% of the total FlowByActivity FlowAmount for ' +
+             str((~df_merge['Flag']).sum()) + ' of ' + str(len(df_merge)) + ' contexts, less for ' +
+             str((diff > 0.001).sum()) + ', more for ' + str((diff < -0.001).sum()) +
+             ', and can not be calculated for ' + str(diff.isnull().sum()))
+    log_worst_offenders(df_merge[df_merge['Flag']], 'Percent_difference', ['Context'],
+                        'percent differences of the FlowBySector total from the '
+                        'FlowByActivity total')
+
+    return df_merge
 
 
 def check_summation_at_sector_lengths(df):
@@ -651,10 +640,11 @@ def check_if_sectors_are_naics(df_load, crosswalk_list, column_headers):
     return non_sectors
 
 
-def melt_naics_crosswalk():
+@lru_cache(maxsize=None)
+def _melt_naics_crosswalk():
     """
-    Create a melt version of the naics 07 to 17 crosswalk to map naics to naics 2012
-    :return:
+    Create the melted naics 07 to 17 crosswalk a single time per session
+    :return: df, melted crosswalk
     """
 
     # load the mastercroswalk and subset by sectorsourcename, save values to list
@@ -668,8 +658,7 @@ def melt_naics_crosswalk():
     # drop rows where contents are equal
     cw_replacement = cw_replacement[cw_replacement['NAICS_2012_Code'] != cw_replacement['NAICS']]
     # drop rows where length > 6
-    cw_replacement = cw_replacement[cw_replacement['NAICS_2012_Code'].apply(
-        lambda x: len(x) < 7)].reset_index(drop=True)
+    cw_replacement = cw_replacement[cw_replacement['NAICS_2012_Code'].str.len() < 7].reset_index(drop=True)
     # order by naics 2012
     cw_replacement = cw_replacement.sort_values(['NAICS', 'NAICS_2012_Code']).reset_index(drop=True)
 
@@ -682,72 +671,101 @@ def melt_naics_crosswalk():
     return cw_replacement_2
 
 
+def melt_naics_crosswalk():
+    """
+    Create a melt version of the naics 07 to 17 crosswalk to map naics to naics 2012
+    :return:
+    """
+    return _melt_naics_crosswalk().copy()
+
+
+@lru_cache(maxsize=None)
+def _naics_year_conversion(sectorsourcename):
+    """
+    Precompute the conversion of sector codes from other NAICS years to sectorsourcename
+    :param sectorsourcename: str, column of the NAICS crosswalk (ex. NAICS_2012_Code)
+    :return: frozenset of sectorsourcename codes, df of codes not in sectorsourcename
+             with columns 'NAICS', sectorsourcename, and 'allocation_ratio'
+    """
+    naics_codes = frozenset(load_sector_crosswalk()[sectorsourcename].dropna())
+    conversion = _melt_naics_crosswalk()
+    conversion = conversion.loc[~conversion['NAICS'].isin(naics_codes),
+                                ['NAICS', 'NAICS_2012_Code', 'allocation_ratio']]
+    conversion = conversion.rename(columns={'NAICS_2012_Code': sectorsourcename})
+    return naics_codes, conversion.reset_index(drop=True)
+
+
 def replace_naics_w_naics_from_another_year(df_load, sectorsourcename):
     """
     Check if activity-like sectors are in fact sectors. Also works for the Sector column
     :return:
     """
-    # from flowsa.flowbyfunctions import aggregator
-
     # drop NoneType
     df = replace_NoneType_with_empty_cells(df_load).reset_index(drop=True)
 
-    # load the mastercroswalk and subset by sectorsourcename, save values to list
-    cw_load = load_sector_crosswalk()
-    cw = cw_load[sectorsourcename].drop_duplicates().tolist()
-
-    # load melted crosswalk
-    cw_melt = melt_naics_crosswalk()
-    # drop the count column
-    cw_melt = cw_melt.drop(columns='naics_count')
+    # load the precomputed conversion of codes from other NAICS years
+    naics_codes, conversion = _naics_year_conversion(sectorsourcename)
 
     # determine which headers are in the df
     if 'SectorConsumedBy' in df:
         column_headers = ['SectorProducedBy', 'SectorConsumedBy']
     else:
         column_headers = ['ActivityProducedBy', 'ActivityConsumedBy']
-    # # list of column headers that do exist in the df being aggregated
-    # column_headers = [e for e in possible_column_headers if e in df.columns.values.tolist()]
 
     # check if there are any sectors that are not in the naics 2012 crosswalk
-    non_naics = check_if_sectors_are_naics(df, cw, column_headers)
+    non_naics = [e for e in pd.unique(df[column_headers].values.ravel('F'))
+                 if e != '' and e not in naics_codes]
 
-    # loop through the df headers and determine if value is not in crosswalk list
     if len(non_naics) != 0:
+        log.debug('There are sectors that are not NAICS 2012 Codes')
+        log.debug(non_naics)
         log.debug('Checking if sectors represent a different'
                   'NAICS year, if so, replace with ' + sectorsourcename)
+        # only the rows with codes from another NAICS year are converted
+        convertible = set(conversion['NAICS'])
+        convert_rows = df[column_headers].isin(convertible).any(axis=1)
+        df_convert = df[convert_rows]
+        df = df[~convert_rows]
         for c in column_headers:
-            # merge df with the melted sector crosswalk
-            df = df.merge(cw_melt, left_on=c, right_on='NAICS', how='left')
-            # if there is a value in the sectorsourcename column,
-            # use that value to replace sector in column c if value in
-            # column c is in the non_naics list
-            df[c] = np.where((df[c] == df['NAICS']) &
-                             (df[c].isin(non_naics)), df[sectorsourcename], df[c])
-            # multiply the FlowAmount col by allocation_ratio
-            df.loc[df[c] == df[sectorsourcename],
-                   'FlowAmount'] = df['FlowAmount'] * df['allocation_ratio']
+            # merge df with the conversion, replace the sector and multiply
+            # the FlowAmount col by allocation_ratio
+            df_convert = df_convert.merge(conversion, left_on=c, right_on='NAICS', how='left')
+            converted = df_convert['NAICS'].notnull()
+            df_convert = df_convert.assign(
+                **{c: df_convert[sectorsourcename].where(converted, df_convert[c]),
+                   'FlowAmount': (df_convert['FlowAmount'] *
+                                  df_convert['allocation_ratio']).where(converted,
+                                                                        df_convert['FlowAmount'])})
             # drop columns
-            df = df.drop(columns=[sectorsourcename, 'NAICS', 'allocation_ratio'])
+            df_convert = df_convert.drop(columns=[sectorsourcename, 'NAICS', 'allocation_ratio'])
         log.debug('Replaced NAICS with ' + sectorsourcename)
 
-        # check if there are any sectors that are not in the naics 2012 crosswalk
-        log.debug('Check again for non NAICS 2012 Codes')
-        nonsectors = check_if_sectors_are_naics(df, cw, column_headers)
+        # drop the sectors that are not NAICS 2012 Codes and are not from another NAICS year
+        nonsectors = [e for e in non_naics if e not in convertible]
         if len(nonsectors) != 0:
             log.debug('Dropping non-NAICS from dataframe')
-            for c in column_headers:
-                # drop rows where column value is in the nonnaics list
-                df = df[~df[c].isin(nonsectors)]
-        # aggregate data
+            df = df[~df[column_headers].isin(nonsectors).any(axis=1)]
+            df_convert = df_convert[~df_convert[column_headers].isin(nonsectors).any(axis=1)]
+
+        # aggregate the converted rows with any rows that now share the same grouping values
         possible_column_headers = ('FlowAmount', 'Spread', 'Min', 'Max',
                                    'DataReliability', 'TemporalCorrelation',
                                    'GeographicalCorrelation', 'TechnologicalCorrelation',
                                    'DataCollection', 'Description')
         # list of column headers to group aggregation by
         groupby_cols = [e for e in df.columns.values.tolist() if e not in possible_column_headers]
-        # groupby_cols = list(df.select_dtypes(include=['object']).columns)
-        df = aggregator(df, groupby_cols)
+        # rows in a group with converted rows or with other unconverted rows are aggregated
+        affected = df[groupby_cols].merge(
+            df_convert[groupby_cols].drop_duplicates().assign(affected_group=True),
+            how='left')['affected_group'].notnull().values
+        affected = affected | df.duplicated(subset=groupby_cols, keep=False).values
+        df_agg = aggregator(pd.concat([df[affected], df_convert], ignore_index=True), groupby_cols)
+        # the remaining rows are each their own group, so only drop the zero FlowAmounts
+        # and the columns that are not kept by the aggregator
+        df_pass = df[~affected]
+        df_pass = df_pass.loc[df_pass['FlowAmount'] != 0, list(df_agg.columns)]
+        df = pd.concat([df_pass, df_agg], ignore_index=True, sort=False)
+        df = replace_strings_with_NoneType(df)
 
     # drop rows where both SectorConsumedBy and SectorProducedBy NoneType
     if 'SectorConsumedBy' in df:
@@ -811,7 +829,8 @@ def compare_geographic_totals(df_subset, df_load, sourcename, method_name, activ
     :param df_subset:
     :param df_load:
     :param sourcename:
-    :return:
+    :return: df, differences between the national and subset totals, None if
+        df_load has no national data
     """
 
     # subset df_load to national level
@@ -835,12 +854,16 @@ def compare_geographic_totals(df_subset, df_load, sourcename, method_name, activ
         df_m = df_m.assign(Percent_Diff=(df_m['FlowAmount_diff'] / df_m['FlowAmount_nat']) * 100)
         df_m = df_m[df_m['FlowAmount_diff'] != 0].reset_index(drop=True)
 
+        df_m['Flag'] = True
+
         if len(df_m) == 0:
             log.info('No data loss between national level data and df subset')
         else:
-            log.info('There are data differences between published national values'
-                     'and dataframe subset, saving as csv')
-            # save as csv
-            df_m.to_csv(outputpath + "FlowBySectorMethodAnalysis/" +
-                        method_name + '_' + sourcename +
-                        "_geographic_comparison_" + activity_set + ".csv", index=False)
+            log.info('There are ' + str(len(df_m)) + ' data differences between published '
+                     'national values and the dataframe subset for ' + sourcename + ' ' +
+                     activity_set)
+            log_worst_offenders(df_m, 'Percent_Diff', ['FlowName', 'ActivityProducedBy',
+                                                       'ActivityConsumedBy', 'Compartment'],
+                                'percent differences from national values')
+        return df_m
+    return None
@@ -7,6 +7,8 @@ Common functions to clean and harmonize dataframes
 
 import logging as log
 import numpy as np
+import pandas as pd
+from flowsa.common import convert_units
 
 
 def clean_df(df, flowbyfields, fill_na_dict, drop_description=True):
@@ -91,55 +93,13 @@ def harmonize_units(df):
     :param df: Either flowbyactivity or flowbysector
     :return: Df with standarized units
     """
-
-    days_in_year = 365
-    sq_ft_to_sq_m_multiplier = 0.092903
-    gallon_water_to_kg = 3.79  # rounded to match USGS_NWIS_WU mapping file on FEDEFL
-    ac_ft_water_to_kg = 1233481.84
-    acre_to_m2 = 4046.8564224
-
     # class = employment, unit = 'p'
     # class = energy, unit = MJ
     # class = land, unit = m2
-    df.loc[:, 'FlowAmount'] = np.where(df['Unit'] == 'ACRES', df['FlowAmount'] * acre_to_m2,
-                                       df['FlowAmount'])
-    df.loc[:, 'Unit'] = np.where(df['Unit'] == 'ACRES', 'm2', df['Unit'])
-    df.loc[:, 'FlowAmount'] = np.where(df['Unit'] == 'Acres', df['FlowAmount'] * acre_to_m2,
-                                       df['FlowAmount'])
-    df.loc[:, 'Unit'] = np.where(df['Unit'] == 'Acres', 'm2', df['Unit'])
-
-    df.loc[:, 'FlowAmount'] = np.where(df['Unit'].isin(['million sq ft', 'million square feet']),
-                                       df['FlowAmount'] * sq_ft_to_sq_m_multiplier * 1000000,
-                                       df['FlowAmount'])
-    df.loc[:, 'Unit'] = np.where(df['Unit'].isin(['million sq ft', 'million square feet']),
-                                 'm2', df['Unit'])
-
-    df.loc[:, 'FlowAmount'] = np.where(df['Unit'].isin(['square feet']),
-                                       df['FlowAmount'] * sq_ft_to_sq_m_multiplier,
-                                       df['FlowAmount'])
-    df.loc[:, 'Unit'] = np.where(df['Unit'].isin(['square feet']), 'm2', df['Unit'])
-
     # class = money, unit = USD
-
     # class = water, unit = kg
-    df.loc[:, 'FlowAmount'] = np.where(df['Unit'] == 'gallons/animal/day',
-                                       (df['FlowAmount'] * gallon_water_to_kg) * days_in_year,
-                                       df['FlowAmount'])
-    df.loc[:, 'Unit'] = np.where(df['Unit'] == 'gallons/animal/day', 'kg', df['Unit'])
-
-    df.loc[:, 'FlowAmount'] = np.where(df['Unit'] == 'ACRE FEET / ACRE',
-                                       (df['FlowAmount'] / acre_to_m2) * ac_ft_water_to_kg,
-                                       df['FlowAmount'])
-    df.loc[:, 'Unit'] = np.where(df['Unit'] == 'ACRE FEET / ACRE', 'kg/m2', df['Unit'])
-
-    df.loc[:, 'FlowAmount'] = np.where(df['Unit'] == 'Mgal',
-                                       df['FlowAmount'] * 1000000 * gallon_water_to_kg,
-                                       df['FlowAmount'])
-    df.loc[:, 'Unit'] = np.where(df['Unit'] == 'Mgal', 'kg', df['Unit'])
-
     # class = other, unit varies
-
-    return df
+    return convert_units(df, 'Harmonized')
 
 
 def harmonize_FBS_columns(df):
@@ -170,26 +130,37 @@ def harmonize_FBS_columns(df):
 
     # harmonize metasources
     log.info('Harmonize MetaSources')
+    # an FBS without rows has no MetaSources to combine
+    if len(df) == 0:
+        return df.drop(columns='MetaSources').assign(MetaSources=df['MetaSources'])
     df = replace_NoneType_with_empty_cells(df)
 
-    # subset all string cols of the df and drop duplicates
     string_cols = ['Flowable', 'Class', 'SectorProducedBy', 'SectorConsumedBy',
                    'SectorSourceName', 'Context', 'Location', 'LocationSystem',
                    'Unit', 'FlowType', 'Year', 'MeasureofSpread', 'MetaSources']
-    df_sub = df[string_cols].drop_duplicates().reset_index(drop=True)
-    # sort df
-    df_sub = df_sub.sort_values(['MetaSources', 'SectorProducedBy',
-                                 'SectorConsumedBy']).reset_index(drop=True)
-
     # new group cols
     group_no_meta = [e for e in string_cols if e not in 'MetaSources']
 
-    # combine/sum columns that share the same data other than Metasources,
-    # combining MetaSources string in process
-    df_sub = df_sub.groupby(group_no_meta)['MetaSources'].apply(', '.join).reset_index()
-    # drop the MetaSources col in original df and replace with the MetaSources col in df_sub
-    df = df.drop('MetaSources', 1)
-    harmonized_df = df.merge(df_sub, how='left')
+    # combine MetaSources strings, in alphabetical order, for rows that share the same data
+    # other than MetaSources. Factorize the groups and MetaSources once, then create the
+    # combined string once per unique combination of MetaSources rather than once per group
+    group_code = df.groupby(group_no_meta, sort=False).ngroup()
+    valid = group_code.notna().values
+    group_code = group_code.values[valid].astype(int)
+    meta_code, meta_names = pd.factorize(df['MetaSources'].values[valid], sort=True)
+    meta_pairs = pd.DataFrame({'group': group_code, 'meta': meta_code}).drop_duplicates()
+    meta_pairs = meta_pairs.sort_values(['group', 'meta'])
+    # table of the MetaSources codes of each group, one row per group
+    position = meta_pairs.groupby('group').cumcount().values
+    meta_table = np.full((group_code.max() + 1, position.max() + 1), -1)
+    meta_table[meta_pairs['group'].values, position] = meta_pairs['meta'].values
+    combinations, combination_code = np.unique(meta_table, axis=0, return_inverse=True)
+    combination_names = np.array([', '.join(meta_names[c[c >= 0]]) for c in combinations],
+                                 dtype=object)
+    # replace the MetaSources col in original df with the combined MetaSources of each group
+    meta_sources = np.full(len(df), np.nan, dtype=object)
+    meta_sources[valid] = combination_names[combination_code[group_code]]
+    harmonized_df = df.drop(columns='MetaSources').assign(MetaSources=meta_sources)
     harmonized_df = replace_strings_with_NoneType(harmonized_df)
 
     return harmonized_df
@@ -5,47 +5,24 @@
 Functions to allocate data using additional data sources
 """
 
-import sys
 import logging as log
-import numpy as np
 import pandas as pd
 import flowsa
 from flowsa.common import load_source_catalog, activity_fields, US_FIPS, \
-    fba_activity_fields, fbs_activity_fields, \
+    fips_to_state_int, fba_activity_fields, fbs_activity_fields, \
     fba_mapped_default_grouping_fields, flow_by_activity_fields, fba_fill_na_dict
-from flowsa.datachecks import check_if_losing_sector_data, check_allocation_ratios, \
-    check_if_location_systems_match
+from flowsa.datachecks import check_allocation_ratios, \
+    check_if_location_systems_match, find_rows_losing_sector_data, allocate_lost_sector_data
 from flowsa.flowbyfunctions import collapse_activity_fields, \
     sector_aggregation, sector_disaggregation, allocate_by_sector, \
-    proportional_allocation_by_location_and_activity, subset_df_by_geoscale
-from flowsa.mapping import get_fba_allocation_subset, add_sectors_to_flowbyactivity
-from flowsa.dataclean import replace_strings_with_NoneType, clean_df, harmonize_units
+    proportional_allocation_by_location_and_activity, subset_df_by_geoscale, allocate_by_ratio_matrix
+from flowsa.mapping import get_fba_allocation_subset, get_fba_allocation_subset_by_activity, \
+    add_sectors_to_flowbyactivity
+from flowsa.dataclean import replace_strings_with_NoneType, replace_NoneType_with_empty_cells, \
+    clean_df, harmonize_units
 from flowsa.datachecks import check_if_data_exists_at_geoscale
-
-# import specific functions
-from flowsa.data_source_scripts.BEA import subset_BEA_Use
-from flowsa.data_source_scripts.Blackhurst_IO import convert_blackhurst_data_to_gal_per_year, \
-    convert_blackhurst_data_to_gal_per_employee, scale_blackhurst_results_to_usgs_values
-from flowsa.data_source_scripts.BLS_QCEW import clean_bls_qcew_fba, \
-    clean_bls_qcew_fba_for_employment_sat_table, \
-    bls_clean_allocation_fba_w_sec
-from flowsa.data_source_scripts.EIA_CBECS_Land import cbecs_land_fba_cleanup
-from flowsa.data_source_scripts.EIA_MECS import mecs_energy_fba_cleanup, \
-    eia_mecs_energy_clean_allocation_fba_w_sec, \
-    mecs_land_fba_cleanup, mecs_land_fba_cleanup_for_land_2012_fbs, \
-    mecs_land_clean_allocation_mapped_fba_w_sec
-from flowsa.data_source_scripts.EPA_NEI import clean_NEI_fba, clean_NEI_fba_no_pesticides
-from flowsa.data_source_scripts.StatCan_IWS_MI import convert_statcan_data_to_US_water_use
-from flowsa.data_source_scripts.stewiFBS import stewicombo_to_sector, stewi_to_sector
-from flowsa.data_source_scripts.USDA_CoA_Cropland import disaggregate_coa_cropland_to_6_digit_naics, \
-    coa_irrigated_cropland_fba_cleanup, coa_nonirrigated_cropland_fba_cleanup
-from flowsa.data_source_scripts.USDA_CoA_Cropland_NAICS import coa_cropland_naics_fba_wsec_cleanup
-from flowsa.data_source_scripts.USDA_ERS_MLU import allocate_usda_ers_mlu_land_in_urban_areas,\
-    allocate_usda_ers_mlu_other_land,\
-    allocate_usda_ers_mlu_land_in_rural_transportation_areas
-from flowsa.data_source_scripts.USDA_IWMS import disaggregate_iwms_to_6_digit_naics
-from flowsa.data_source_scripts.USGS_NWIS_WU import usgs_fba_data_cleanup,\
-    usgs_fba_w_sectors_data_cleanup
+from flowsa.instrumentation import traced
+from flowsa.registry import get_function
 
 
 def direct_allocation_method(flow_subset_mapped, k, names, method):
@@ -61,16 +38,24 @@ def direct_allocation_method(flow_subset_mapped, k, names, method):
     fbs = flow_subset_mapped.copy()
     # for each activity, if activities are not sector like, check that there is no data loss
     if load_source_catalog()[k]['sector-like_activities'] is False:
-        activity_list = []
-        for n in names:
-            log.debug('Checking for ' + n + ' at ' + method['target_sector_level'])
-            fbs_subset = fbs[((fbs[fba_activity_fields[0]] == n) &
-                              (fbs[fba_activity_fields[1]] == n)) |
-                             (fbs[fba_activity_fields[0]] == n) |
-                             (fbs[fba_activity_fields[1]] == n)].reset_index(drop=True)
-            fbs_subset = check_if_losing_sector_data(fbs_subset, method['target_sector_level'])
-            activity_list.append(fbs_subset)
-        fbs = pd.concat(activity_list, ignore_index=True)
+        log.debug('Checking for ' + ', '.join(map(str, names)) + ' at ' +
+                  method['target_sector_level'])
+        fbs = replace_NoneType_with_empty_cells(fbs.reset_index(drop=True))
+        fbs = fbs.assign(Row_tmp=fbs.index)
+        # pair each row with the activity names it is assigned to, once per name
+        fbs_activity = pd.concat([fbs.assign(FBA_Activity=fbs[f]) for f in fba_activity_fields],
+                                 ignore_index=True)
+        fbs_activity = fbs_activity[fbs_activity['FBA_Activity'].isin(names)]
+        fbs_activity = fbs_activity.drop_duplicates(subset=['Row_tmp', 'FBA_Activity'])
+        # check for data loss within each activity at once, allocating a row that
+        # is lost for multiple activities once
+        rl = find_rows_losing_sector_data(fbs_activity, method['target_sector_level'],
+                                          group_cols=['FBA_Activity'])
+        rl = rl.drop_duplicates(subset='Row_tmp').drop(columns=['Row_tmp', 'FBA_Activity'])
+        rows_lost = allocate_lost_sector_data(rl, method['target_sector_level'])
+        fbs = fbs[fbs['Row_tmp'].isin(fbs_activity['Row_tmp'])].drop(columns='Row_tmp')
+        fbs = pd.concat([fbs, rows_lost], ignore_index=True, sort=True)
+        fbs = replace_strings_with_NoneType(fbs)
     return fbs
 
 
@@ -85,13 +70,12 @@ def function_allocation_method(flow_subset_mapped, names, attr, fbs_list):
     """
     log.info('Calling on function specified in method yaml to allocate ' +
              ', '.join(map(str, names)) + ' to sectors')
-    fbs = getattr(sys.modules[__name__],
-                  attr['allocation_source'])(flow_subset_mapped, attr, fbs_list)
+    fbs = get_function(attr['allocation_source'])(flow_subset_mapped, attr, fbs_list)
     return fbs
 
 
 def dataset_allocation_method(flow_subset_mapped, attr, names, method,
-                              k, v, aset, method_name, aset_names):
+                              k, v, aset, method_name, aset_names, validator=None):
     """
     Method of allocation using a specified data source
     :param flow_subset_mapped: FBA subset mapped using federal elementary flow list
@@ -103,6 +87,8 @@ def dataset_allocation_method(flow_subset_mapped, attr, names, method,
     :param aset:
     :param method_name:
     :param aset_names:
+    :param validator: Validator collecting the datacheck results of the FBS method,
+        if None the allocation ratios are checked without saving the results
     :return:
     """
     # add parameters to dictionary if exist in method yaml
@@ -134,33 +120,30 @@ def dataset_allocation_method(flow_subset_mapped, attr, names, method,
         log.info("Using the specified allocation help for subset of " + attr['allocation_source'])
         fba_allocation_subset = allocation_helper(fba_allocation_subset, attr, method, v)
 
-    # create flow allocation ratios for each activity
-    # if load_source_catalog()[k]['sector-like_activities']
-    flow_alloc_list = []
+    # create flow allocation ratios for all activities at once, where allocation ratios
+    # are calculated within each activity in column 'FBA_Activity'
     group_cols = fba_mapped_default_grouping_fields
     group_cols = [e for e in group_cols if e not in ('ActivityProducedBy', 'ActivityConsumedBy')]
-    for n in names:
-        log.debug("Creating allocation ratios for " + n)
-        fba_allocation_subset_2 = get_fba_allocation_subset(fba_allocation_subset, k, [n],
-                                                            flowSubsetMapped=flow_subset_mapped,
-                                                            allocMethod=attr['allocation_method'],
-                                                            activity_set_names=aset_names)
-        if len(fba_allocation_subset_2) == 0:
-            log.info("No data found to allocate " + n)
-        else:
-            flow_alloc = allocate_by_sector(fba_allocation_subset_2, k, attr['allocation_source'],
-                                            attr['allocation_method'], group_cols,
-                                            flowSubsetMapped=flow_subset_mapped)
-            flow_alloc = flow_alloc.assign(FBA_Activity=n)
-            flow_alloc_list.append(flow_alloc)
-    flow_allocation = pd.concat(flow_alloc_list, ignore_index=True)
+    group_cols = group_cols + ['FBA_Activity']
+    log.debug("Creating allocation ratios for " + ', '.join(names))
+    fba_allocation_subset_2 = get_fba_allocation_subset_by_activity(
+        fba_allocation_subset, k, names, flowSubsetMapped=flow_subset_mapped,
+        allocMethod=attr['allocation_method'], activity_set_names=aset_names)
+    for n in [e for e in names if e not in set(fba_allocation_subset_2['FBA_Activity'])]:
+        log.info("No data found to allocate " + n)
+    flow_allocation = allocate_by_sector(fba_allocation_subset_2, k, attr['allocation_source'],
+                                         attr['allocation_method'], group_cols,
+                                         flowSubsetMapped=flow_subset_mapped)
 
     # generalize activity field names to enable link to main fba source
     log.info("Generalizing activity columns in subset of " + attr['allocation_source'])
     flow_allocation = collapse_activity_fields(flow_allocation)
 
     # check for issues with allocation ratios
-    check_allocation_ratios(flow_allocation, aset, k, method_name)
+    if validator is None:
+        check_allocation_ratios(flow_allocation, aset, k, method_name)
+    else:
+        validator.submit(check_allocation_ratios, k, aset, flow_allocation, aset, k, method_name)
 
     # create list of sectors in the flow allocation df, drop any rows of data in the flow df that \
     # aren't in list
@@ -175,6 +158,11 @@ def dataset_allocation_method(flow_subset_mapped, attr, names, method,
     log.info("Checking if flowbyactivity and allocation dataframes use the same location systems")
     check_if_location_systems_match(flow_subset_mapped, flow_allocation)
 
+    # the sparse allocation engine stores ratios in a (Location, FBA_Activity) x Sector matrix
+    if attr.get('allocation_engine') == 'sparse':
+        log.info("Allocate " + k + " using sparse matrix of " + attr['allocation_source'] + " ratios")
+        return allocate_by_ratio_matrix(flow_subset_mapped, flow_allocation)
+
     # merge fba df w/flow allocation dataset
     log.info("Merge " + k + " and subset of " + attr['allocation_source'])
     for i, j in activity_fields.items():
@@ -209,6 +197,95 @@ def dataset_allocation_method(flow_subset_mapped, attr, names, method,
     return fbs
 
 
+# helper allocation tables of the FBS method being run, keyed on the activity set
+# parameters used to load them
+_helper_allocation_tables = {}
+
+
+def clear_helper_allocation_tables():
+    """
+    Drop the helper allocation tables stored by load_helper_allocation(), called at the
+    start and end of each FBS method run
+    """
+    _helper_allocation_tables.clear()
+
+
+def helper_allocation_key(attr, method, v):
+    """
+    Key of the helper allocation table of an activity set, from the helper parameters
+    and, when helper clean functions are named, the attr and method passed to them
+    :param attr: activity set attributes
+    :param method: method yaml
+    :param v: source attributes
+    :return: tuple
+    """
+    key = tuple((k, str(val)) for k, val in sorted(attr.items()) if 'helper' in k) + \
+        (method['target_sector_source'], v['geoscale_to_use'])
+    if 'clean_helper_fba' in attr or 'clean_helper_fba_wsec' in attr:
+        key = key + (str(attr),)
+    if 'clean_helper_fba_wsec' in attr:
+        key = key + (str(method),)
+    return key
+
+
+def load_helper_allocation(attr, method, v):
+    """
+    Load the helper allocation table of an activity set, with sectors and state FIPS
+    codes ready to join on. Tables are stored, so activity sets with the same helper
+    parameters only load, map, and clean the helper dataset once per FBS method run.
+    :param attr: activity set attributes
+    :param method: method yaml
+    :param v: source attributes
+    :return: df of helper flows with columns 'Location', 'Location_tmp', 'Sector' and
+             'HelperFlow', df of national helper flows by sector ('ReplacementValue')
+    """
+    key = helper_allocation_key(attr, method, v)
+    if key not in _helper_allocation_tables:
+        # add parameters to dictionary if exist in method yaml
+        fba_dict = {}
+        if 'helper_flow' in attr:
+            fba_dict['flowname_subset'] = attr['helper_flow']
+        if 'clean_helper_fba' in attr:
+            fba_dict['clean_fba'] = attr['clean_helper_fba']
+        if 'clean_helper_fba_wsec' in attr:
+            fba_dict['clean_fba_w_sec'] = attr['clean_helper_fba_wsec']
+
+        # load the allocation FBA
+        helper_allocation = load_map_clean_fba(method, attr, fba_sourcename=attr['helper_source'],
+                                               df_year=attr['helper_source_year'],
+                                               flowclass=attr['helper_source_class'],
+                                               geoscale_from=attr['helper_from_scale'],
+                                               geoscale_to=v['geoscale_to_use'], **fba_dict)
+
+        # run sector disagg to capture any missing lower level naics
+        helper_allocation = sector_disaggregation(helper_allocation, fba_mapped_default_grouping_fields)
+
+        # generalize activity field names to enable link to water withdrawal table
+        helper_allocation = collapse_activity_fields(helper_allocation)
+        # drop any rows not mapped
+        helper_allocation = helper_allocation[helper_allocation['Sector'].notnull()]
+        # drop columns
+        helper_allocation = helper_allocation.drop(columns=['Activity', 'Min', 'Max'])
+
+        # rename column, add state FIPS codes to join county level data on
+        helper_allocation = helper_allocation.rename(columns={"FlowAmount": 'HelperFlow'})
+        helper_allocation = helper_allocation.assign(
+            Location_tmp=fips_to_state_int(helper_allocation['Location'])).reset_index(drop=True)
+
+        # national level values, used to replace missing values (na or 0) when multiplying
+        replacement_values = helper_allocation.loc[helper_allocation['Location'] == US_FIPS,
+                                                   ['Sector', 'HelperFlow']]
+        replacement_values = replacement_values.rename(
+            columns={"HelperFlow": 'ReplacementValue'}).reset_index(drop=True)
+
+        _helper_allocation_tables[key] = (helper_allocation, replacement_values)
+
+    helper_allocation, replacement_values = _helper_allocation_tables[key]
+
+    return helper_allocation.copy(), replacement_values.copy()
+
+
+@traced()
 def allocation_helper(df_w_sector, attr, method, v):
     """
     Used when two df required to create allocation ratio
@@ -218,70 +295,35 @@ def allocation_helper(df_w_sector, attr, method, v):
     :return:
     """
 
-    # add parameters to dictionary if exist in method yaml
-    fba_dict = {}
-    if 'helper_flow' in attr:
-        fba_dict['flowname_subset'] = attr['helper_flow']
-    if 'clean_helper_fba' in attr:
-        fba_dict['clean_fba'] = attr['clean_helper_fba']
-    if 'clean_helper_fba_wsec' in attr:
-        fba_dict['clean_fba_w_sec'] = attr['clean_helper_fba_wsec']
-
-    # load the allocation FBA
-    helper_allocation = load_map_clean_fba(method, attr, fba_sourcename=attr['helper_source'],
-                                           df_year=attr['helper_source_year'],
-                                           flowclass=attr['helper_source_class'],
-                                           geoscale_from=attr['helper_from_scale'],
-                                           geoscale_to=v['geoscale_to_use'], **fba_dict)
-
-    # run sector disagg to capture any missing lower level naics
-    helper_allocation = sector_disaggregation(helper_allocation, fba_mapped_default_grouping_fields)
-
-    # generalize activity field names to enable link to water withdrawal table
-    helper_allocation = collapse_activity_fields(helper_allocation)
-    # drop any rows not mapped
-    helper_allocation = helper_allocation[helper_allocation['Sector'].notnull()]
-    # drop columns
-    helper_allocation = helper_allocation.drop(columns=['Activity', 'Min', 'Max'])
-
-    # rename column
-    helper_allocation = helper_allocation.rename(columns={"FlowAmount": 'HelperFlow'})
+    helper_allocation, replacement_values = load_helper_allocation(attr, method, v)
 
     # determine the df_w_sector column to merge on
     df_w_sector = replace_strings_with_NoneType(df_w_sector)
-    sec_consumed_list = df_w_sector['SectorConsumedBy'].drop_duplicates().values.tolist()
-    sec_produced_list = df_w_sector['SectorProducedBy'].drop_duplicates().values.tolist()
     # if a sector field column is not all 'none', that is the column to merge
-    if all(v is None for v in sec_consumed_list):
+    if df_w_sector['SectorConsumedBy'].isnull().all():
         sector_col_to_merge = 'SectorProducedBy'
-    elif all(v is None for v in sec_produced_list):
+    elif df_w_sector['SectorProducedBy'].isnull().all():
         sector_col_to_merge = 'SectorConsumedBy'
     else:
         log.error('There is not a clear sector column to base merge with helper allocation dataset')
 
     # merge allocation df with helper df based on sectors, depending on geo scales of dfs
     if (attr['helper_from_scale'] == 'state') and (attr['allocation_from_scale'] == 'county'):
-        helper_allocation.loc[:, 'Location_tmp'] = \
-            helper_allocation['Location'].apply(lambda x: x[0:2])
-        df_w_sector.loc[:, 'Location_tmp'] = df_w_sector['Location'].apply(lambda x: x[0:2])
-        # merge_columns.append('Location_tmp')
-        modified_fba_allocation =\
-            df_w_sector.merge(helper_allocation[['Location_tmp', 'Sector', 'HelperFlow']],
-                              how='left',
-                              left_on=['Location_tmp', sector_col_to_merge],
-                              right_on=['Location_tmp', 'Sector'])
-        modified_fba_allocation = modified_fba_allocation.drop(columns=['Location_tmp'])
+        df_w_sector = df_w_sector.assign(Location_tmp=fips_to_state_int(df_w_sector['Location']))
+        merge_cols = ['Location_tmp']
+        how = 'left'
     elif (attr['helper_from_scale'] == 'national') and \
             (attr['allocation_from_scale'] != 'national'):
-        modified_fba_allocation = df_w_sector.merge(helper_allocation[['Sector', 'HelperFlow']],
-                                                    how='left',
-                                                    left_on=[sector_col_to_merge],
-                                                    right_on=['Sector'])
+        merge_cols = []
+        how = 'left'
     else:
-        modified_fba_allocation =\
-            df_w_sector.merge(helper_allocation[['Location', 'Sector', 'HelperFlow']],
-                              left_on=['Location', sector_col_to_merge],
-                              right_on=['Location', 'Sector'])
+        merge_cols = ['Location']
+        how = 'inner'
+    modified_fba_allocation = \
+        df_w_sector.merge(helper_allocation[merge_cols + ['Sector', 'HelperFlow']], how=how,
+                          left_on=merge_cols + [sector_col_to_merge],
+                          right_on=merge_cols + ['Sector'])
+    modified_fba_allocation = modified_fba_allocation.drop(columns=['Location_tmp'], errors='ignore')
 
     # modify flow amounts using helper data
     if 'multiplication' in attr['helper_method']:
@@ -289,25 +331,14 @@ def allocation_helper(df_w_sector, attr, method, v):
         #  value from one geoscale up instead of national
         # todo: modify year after merge if necessary
         # if missing values (na or 0), replace with national level values
-        replacement_values =\
-            helper_allocation[helper_allocation['Location'] ==
-                              US_FIPS].reset_index(drop=True)
-        replacement_values = replacement_values.rename(columns={"HelperFlow": 'ReplacementValue'})
-        modified_fba_allocation = modified_fba_allocation.merge(
-            replacement_values[['Sector', 'ReplacementValue']], how='left')
-        modified_fba_allocation.loc[:, 'HelperFlow'] = modified_fba_allocation['HelperFlow'].fillna(
-            modified_fba_allocation['ReplacementValue'])
-        modified_fba_allocation.loc[:, 'HelperFlow'] =\
-            np.where(modified_fba_allocation['HelperFlow'] == 0,
-                     modified_fba_allocation['ReplacementValue'],
-                     modified_fba_allocation['HelperFlow'])
-
+        modified_fba_allocation = modified_fba_allocation.merge(replacement_values, how='left')
+        replacement = modified_fba_allocation['ReplacementValue']
+        helper_flow = modified_fba_allocation['HelperFlow'].fillna(replacement)
+        helper_flow = helper_flow.mask(helper_flow == 0, replacement)
         # replace non-existent helper flow values with a 0, so after multiplying,
         # don't have incorrect value associated with new unit
-        modified_fba_allocation['HelperFlow'] =\
-            modified_fba_allocation['HelperFlow'].fillna(value=0)
-        modified_fba_allocation.loc[:, 'FlowAmount'] = modified_fba_allocation['FlowAmount'] * \
-                                                       modified_fba_allocation['HelperFlow']
+        modified_fba_allocation = modified_fba_allocation.assign(
+            FlowAmount=modified_fba_allocation['FlowAmount'] * helper_flow.fillna(0))
         # drop columns
         modified_fba_allocation =\
             modified_fba_allocation.drop(columns=["HelperFlow", 'ReplacementValue', 'Sector'])
@@ -356,14 +387,15 @@ def allocation_helper(df_w_sector, attr, method, v):
         log.info("Scaling " + attr['helper_source'] + ' to FBA values')
         # tmp hard coded - need to generalize
         if attr['helper_source'] == 'BLS_QCEW':
-            modified_fba_allocation =\
-                scale_blackhurst_results_to_usgs_values(modified_fba_allocation, attr)
-            # modified_fba_allocation = getattr(sys.modules[__name__],
+            modified_fba_allocation = get_function(
+                'scale_blackhurst_results_to_usgs_values')(modified_fba_allocation, attr)
+            # modified_fba_allocation = get_function(
             # attr["scale_helper_results"])(modified_fba_allocation, attr)
 
     return modified_fba_allocation
 
 
+@traced()
 def load_map_clean_fba(method, attr, fba_sourcename, df_year, flowclass,
                        geoscale_from, geoscale_to, **kwargs):
     """
@@ -406,7 +438,7 @@ def load_map_clean_fba(method, attr, fba_sourcename, df_year, flowclass,
     # cleanup the fba allocation df, if necessary
     if 'clean_fba' in kwargs:
         log.info("Cleaning " + fba_sourcename)
-        fba = getattr(sys.modules[__name__], kwargs["clean_fba"])(fba, attr=attr)
+        fba = get_function(kwargs["clean_fba"])(fba, attr=attr)
     # reset index
     fba = fba.reset_index(drop=True)
 
@@ -417,6 +449,6 @@ def load_map_clean_fba(method, attr, fba_sourcename, df_year, flowclass,
     # call on fxn to further clean up/disaggregate the fba allocation data, if exists
     if 'clean_fba_w_sec' in kwargs:
         log.info("Further disaggregating sectors in " + fba_sourcename)
-        fba_wsec = getattr(sys.modules[__name__], kwargs['clean_fba_w_sec'])(fba_wsec, attr=attr, method=method)
+        fba_wsec = get_function(kwargs['clean_fba_w_sec'])(fba_wsec, attr=attr, method=method)
 
     return fba_wsec
\ No newline at end of file
@@ -9,36 +9,10 @@ EX: --year 2015 --source USGS_NWIS_WU
 
 import argparse
 from flowsa.common import *
-from esupy.processed_data_mgmt import write_df_to_file
 from flowsa.dataclean import clean_df
-from flowsa.data_source_scripts.BEA import *
-from flowsa.data_source_scripts.Blackhurst_IO import *
-from flowsa.data_source_scripts.BLS_QCEW import *
-from flowsa.data_source_scripts.CalRecycle_WasteCharacterization import *
-from flowsa.data_source_scripts.Census_CBP import *
-from flowsa.data_source_scripts.Census_AHS import *
-from flowsa.data_source_scripts.Census_PEP_Population import *
-from flowsa.data_source_scripts.EIA_CBECS_Water import *
-from flowsa.data_source_scripts.EPA_NEI import *
-from flowsa.data_source_scripts.NOAA_FisheryLandings import *
-from flowsa.data_source_scripts.StatCan_GDP import *
-from flowsa.data_source_scripts.StatCan_IWS_MI import *
-from flowsa.data_source_scripts.StatCan_LFS import *
-from flowsa.data_source_scripts.USDA_CoA_Cropland import *
-from flowsa.data_source_scripts.USDA_CoA_Cropland_NAICS import *
-from flowsa.data_source_scripts.USDA_CoA_Livestock import *
-from flowsa.data_source_scripts.USDA_ERS_FIWS import *
-from flowsa.data_source_scripts.USDA_IWMS import *
-from flowsa.data_source_scripts.USGS_NWIS_WU import *
-from flowsa.data_source_scripts.USDA_ERS_MLU import *
-from flowsa.data_source_scripts.EIA_CBECS_Land import *
-from flowsa.data_source_scripts.EIA_CBECS_Water import *
-from flowsa.data_source_scripts.EIA_MECS import *
-from flowsa.data_source_scripts.BLM_PLS import *
-from flowsa.data_source_scripts.EIA_MER import *
-from flowsa.data_source_scripts.EPA_GHGI import *
-from flowsa.data_source_scripts.USGS_MYB_SodaAsh import *
-from flowsa.data_source_scripts.USGS_WU_Coef import *
+from flowsa.instrumentation import span, emit
+from flowsa.registry import get_function
+from flowsa.storage import sort_fba, write_fba_file, write_fba_dataset, fba_layouts
 
 
 def parse_args():
@@ -46,6 +20,8 @@ def parse_args():
     ap = argparse.ArgumentParser()
     ap.add_argument("-y", "--year", required=True, help="Year for data pull and save")
     ap.add_argument("-s", "--source", required=True, help="Data source code to pull and save")
+    ap.add_argument("-l", "--layout", default='file', choices=fba_layouts,
+                    help="Save a parquet file per year, or save to the partitioned FBA dataset")
     args = vars(ap.parse_args())
     return args
 
@@ -85,8 +61,7 @@ def build_url_for_query(config,args):
 def assemble_urls_for_query(build_url, config, args):
     """Calls on helper functions defined in source.py files to replace parts of the url string"""
     if "url_replace_fxn" in config:
-        if hasattr(sys.modules[__name__], config["url_replace_fxn"]):
-            urls = getattr(sys.modules[__name__], config["url_replace_fxn"])(build_url, config, args)
+        urls = get_function(config["url_replace_fxn"])(build_url, config, args)
     else:
         urls = []
         urls.append(build_url)
@@ -101,9 +76,10 @@ def call_urls(url_list, args, config):
     if url_list[0] is not None:
         for url in url_list:
             log.info("Calling " + url)
-            r = make_http_request(url)
-            if hasattr(sys.modules[__name__], config["call_response_fxn"]):
-                df = getattr(sys.modules[__name__], config["call_response_fxn"])(url, r, args)
+            with span('fetch', url=url):
+                r = make_http_request(url)
+            with span('call_response_fxn', url=url, fxn=config["call_response_fxn"]):
+                df = get_function(config["call_response_fxn"])(url, r, args)
             if isinstance(df, pd.DataFrame):
                 data_frames_list.append(df)
             elif isinstance(df, list):
@@ -114,17 +90,18 @@ def call_urls(url_list, args, config):
 
 def parse_data(dataframe_list, args, config):
     """Calls on functions defined in source.py files, as parsing rules are specific to the data source."""
-    if hasattr(sys.modules[__name__], config["parse_response_fxn"]):
-        df = getattr(sys.modules[__name__], config["parse_response_fxn"])(dataframe_list, args)
-        return df
+    df = get_function(config["parse_response_fxn"])(dataframe_list, args)
+    return df
 
 
-def process_data_frame(df, source, year):
+def process_data_frame(df, source, year, layout='file'):
     """
     Process the given dataframe, cleaning, converting data, and writing the final parquet.
 
     This method was written to move code into a shared method, which was necessary to support
     the processing of a list of dataframes instead of a single dataframe.
+    :param layout: str, 'file' to save a parquet file, 'partitioned' to save to the
+        partitioned FBA dataset
     """
     # log that data was retrieved
     log.info("Retrieved data for " + source + ' ' + year)
@@ -133,14 +110,18 @@ def process_data_frame(df, source, year):
     flow_df = clean_df(df, flow_by_activity_fields, fba_fill_na_dict, drop_description=False)
     # modify flow units
     flow_df = convert_fba_unit(flow_df)
-    # sort df and reset index
-    flow_df = flow_df.sort_values(['Class', 'Location', 'ActivityProducedBy', 'ActivityConsumedBy',
-                                   'FlowName', 'Compartment']).reset_index(drop=True)
+    # sort df by the columns filtered when loading the FBA and reset index
+    flow_df = sort_fba(flow_df)
     # save as parquet file
     name_data = set_fba_name(source, year)
-    meta = set_fb_meta(name_data, "FlowByActivity")
-    write_df_to_file(flow_df,paths,meta)
-    log.info("FBA generated and saved for " + name_data)
+    if layout == 'partitioned':
+        folder = write_fba_dataset(flow_df, source, year)
+        log.info("FBA generated and saved for " + name_data + " to " + folder)
+    else:
+        meta = set_fb_meta(name_data, "FlowByActivity")
+        write_fba_file(flow_df, paths, meta)
+        log.info("FBA generated and saved for " + name_data)
+    emit('fba_saved', name=name_data, rows=len(flow_df))
 
 
 def main(**kwargs):
@@ -148,6 +129,10 @@ def main(**kwargs):
     if len(kwargs)==0:
         kwargs = parse_args()
 
+    layout = kwargs.get('layout') or 'file'
+    if layout not in fba_layouts:
+        raise ValueError('FBA layout must be one of ' + ', '.join(fba_layouts))
+
     # assign yaml parameters (common.py fxn)
     config = load_sourceconfig(kwargs['source'])
     # update the local config with today's date
@@ -168,26 +153,33 @@ def main(**kwargs):
 
     for p_year in year_iter:
         kwargs['year'] = str(p_year)
-        # build the base url with strings that will be replaced
-        build_url = build_url_for_query(config, kwargs)
-        # replace parts of urls with specific instructions from source.py
-        urls = assemble_urls_for_query(build_url, config, kwargs)
-        # create a list with data from all source urls
-        dataframe_list = call_urls(urls, kwargs, config)
-        # concat the dataframes and parse data with specific instructions from source.py
-        log.info("Concat dataframe list and parse data")
-        df = parse_data(dataframe_list, kwargs, config)
-        if isinstance(df, list):
-            for frame in df:
-                if not len(frame.index) == 0:
-                    try:
-                        source_names = frame['SourceName']
-                        source_name = source_names.iloc[0]
-                    except KeyError as err:
-                        source_name = kwargs['source']
-                    process_data_frame(frame, source_name, kwargs['year'])
-        else:
-            process_data_frame(df, kwargs['source'], kwargs['year'])
+        with span('flowbyactivity', source=kwargs['source'], year=kwargs['year']):
+            with span('build_url', source=kwargs['source'], year=kwargs['year']):
+                # build the base url with strings that will be replaced
+                build_url = build_url_for_query(config, kwargs)
+                # replace parts of urls with specific instructions from source.py
+                urls = assemble_urls_for_query(build_url, config, kwargs)
+            # create a list with data from all source urls
+            dataframe_list = call_urls(urls, kwargs, config)
+            # concat the dataframes and parse data with specific instructions from source.py
+            log.info("Concat dataframe list and parse data")
+            with span('parse', source=kwargs['source'], year=kwargs['year']):
+                df = parse_data(dataframe_list, kwargs, config)
+            if isinstance(df, list):
+                for frame in df:
+                    if not len(frame.index) == 0:
+                        try:
+                            source_names = frame['SourceName']
+                            source_name = source_names.iloc[0]
+                        except KeyError as err:
+                            source_name = kwargs['source']
+                        with span('process_data_frame', source=source_name,
+                                  year=kwargs['year']):
+                            process_data_frame(frame, source_name, kwargs['year'], layout)
+            else:
+                with span('process_data_frame', source=kwargs['source'], year=kwargs['year']):
+                    process_data_frame(df, kwargs['source'], kwargs['year'], layout)
 
 if __name__ == '__main__':
+    configure_logging()
     main()
@@ -43,9 +43,12 @@ def filter_by_geoscale(df, geoscale):
     :return: filtered flowbyactivity or flowbysector
     """
 
-    fips = create_geoscale_list(df, geoscale)
-
-    df = df[df['Location'].isin(fips)].reset_index(drop=True)
+    # compare integer FIPS codes rather than Location strings
+    if geoscale == 'national' or df['LocationSystem'].str.contains('FIPS').any():
+        fips = get_fips_codes(geoscale)
+    else:
+        fips = []
+    df = df[fips_to_int(df['Location']).isin(fips)].reset_index(drop=True)
 
     if len(df) == 0:
         log.error("No flows found in the " + " flow dataset at the " + geoscale + " scale")
@@ -209,6 +212,10 @@ def sector_aggregation(df_load, group_cols):
         df_cols = [e for e in df.columns if e not in ('ActivityProducedBy', 'ActivityConsumedBy')]
         df = df[df_cols]
 
+    # sector combinations are compared within a location and, if allocation ratios
+    # are created for multiple activities at once, within an 'FBA_Activity'
+    loc_cols = [e for e in ['Location', 'FBA_Activity'] if e in df.columns]
+
     # find the longest length sector
     length = df[[fbs_activity_fields[0], fbs_activity_fields[1]]].apply(
         lambda x: x.str.len()).max().max()
@@ -216,52 +223,35 @@ def sector_aggregation(df_load, group_cols):
     # for loop in reverse order longest length naics minus 1 to 2
     # appends missing naics levels to df
     for i in range(length - 1, 1, -1):
+        spb_len = df[fbs_activity_fields[0]].str.len()
+        scb_len = df[fbs_activity_fields[1]].str.len()
         # subset df to sectors with length = i and length = i + 1
-        df_subset = df.loc[df[fbs_activity_fields[0]].apply(lambda x: i + 1 >= len(x) >= i) |
-                           df[fbs_activity_fields[1]].apply(lambda x: i + 1 >= len(x) >= i)]
-        # create a list of i digit sectors in df subset
-        sector_subset = df_subset[
-            ['Location', fbs_activity_fields[0], fbs_activity_fields[1]]].drop_duplicates().reset_index(
-            drop=True)
-        df_sectors = sector_subset.copy()
-        df_sectors.loc[:, 'SectorProducedBy'] = df_sectors['SectorProducedBy'].apply(lambda x: x[0:i])
-        df_sectors.loc[:, 'SectorConsumedBy'] = df_sectors['SectorConsumedBy'].apply(lambda x: x[0:i])
-        sector_list = df_sectors.drop_duplicates().values.tolist()
+        df_subset = df.loc[spb_len.between(i, i + 1) | scb_len.between(i, i + 1)]
+        df_subset = df_subset.assign(spb_tmp=df_subset[fbs_activity_fields[0]].str[0:i],
+                                     scb_tmp=df_subset[fbs_activity_fields[1]].str[0:i])
         # create a list of sectors that are exactly i digits long
         # where either sector column is i digits in length
-        df_existing_1 = sector_subset.loc[(sector_subset['SectorProducedBy'].apply(lambda x: len(x) == i)) |
-                                          (sector_subset['SectorConsumedBy'].apply(lambda x: len(x) == i))]
-        # where both sector columns are i digits in length
-        df_existing_2 = sector_subset.loc[(sector_subset['SectorProducedBy'].apply(lambda x: len(x) == i)) &
-                                          (sector_subset['SectorConsumedBy'].apply(lambda x: len(x) == i))]
-        # concat existing dfs
-        df_existing = pd.concat([df_existing_1, df_existing_2], sort=False)
-        existing_sectors = df_existing.drop_duplicates().dropna().values.tolist()
-        # list of sectors of length i that are not in sector list
-        missing_sectors = [e for e in sector_list if e not in existing_sectors]
-        if len(missing_sectors) != 0:
-            # new df of sectors that start with missing sectors. drop last digit of the sector and sum flows
-            # set conditions
-            agg_sectors_list = []
-            for q, r, s in missing_sectors:
-                c1 = df_subset['Location'] == q
-                c2 = df_subset[fbs_activity_fields[0]].apply(lambda x: x[0:i] == r)     #.str.startswith(y)
-                c3 = df_subset[fbs_activity_fields[1]].apply(lambda x: x[0:i] == s)   #.str.startswith(z)
-                # subset data
-                agg_sectors_list.append(df_subset.loc[c1 & c2 & c3])
-            agg_sectors = pd.concat(agg_sectors_list, sort=False)
+        df_existing = df_subset.loc[(df_subset[fbs_activity_fields[0]].str.len() == i) |
+                                    (df_subset[fbs_activity_fields[1]].str.len() == i),
+                                    loc_cols + fbs_activity_fields].drop_duplicates()
+        df_existing = df_existing.rename(columns={fbs_activity_fields[0]: 'spb_tmp',
+                                                  fbs_activity_fields[1]: 'scb_tmp'})
+        # rows of sectors, that when shortened to i digits, are missing from the df
+        agg_sectors = df_subset.merge(df_existing, how='left', indicator=True)
+        agg_sectors = agg_sectors[agg_sectors['_merge'] == 'left_only']
+        if len(agg_sectors) != 0:
+            # drop last digit of the sector and sum flows
             agg_sectors = agg_sectors.loc[
-                (agg_sectors[fbs_activity_fields[0]].apply(lambda x: len(x) > i)) |
-                (agg_sectors[fbs_activity_fields[1]].apply(lambda x: len(x) > i))]
-            agg_sectors.loc[:, fbs_activity_fields[0]] = agg_sectors[fbs_activity_fields[0]].apply(
-                lambda x: x[0:i])
-            agg_sectors.loc[:, fbs_activity_fields[1]] = agg_sectors[fbs_activity_fields[1]].apply(
-                lambda x: x[0:i])
+                (agg_sectors[fbs_activity_fields[0]].str.len() > i) |
+                (agg_sectors[fbs_activity_fields[1]].str.len() > i)]
+            agg_sectors = agg_sectors.assign(SectorProducedBy=agg_sectors['spb_tmp'],
+                                             SectorConsumedBy=agg_sectors['scb_tmp'])
+            agg_sectors = agg_sectors.drop(columns=['spb_tmp', 'scb_tmp', '_merge'])
             # aggregate the new sector flow amounts
             agg_sectors = aggregator(agg_sectors, group_cols)
             # append to df
             agg_sectors = replace_NoneType_with_empty_cells(agg_sectors)
-            df = df.append(agg_sectors, sort=False).reset_index(drop=True)
+            df = pd.concat([df, agg_sectors], sort=False).reset_index(drop=True)
 
     # manually modify non-NAICS codes that might exist in sector
     df.loc[:, 'SectorConsumedBy'] = np.where(df['SectorConsumedBy'].isin(['F0', 'F01']),
@@ -331,7 +321,7 @@ def sector_disaggregation(df, group_cols):
         # drop all rows with duplicate temp values, as a less aggregated naics exists
         # list of column headers, that if exist in df, should be aggregated using the weighted avg fxn
         possible_column_headers = ('Flowable', 'FlowName', 'Unit', 'Context', 'Compartment', 'Location', 'Year',
-                                   'SectorProduced_tmp', 'SectorConsumed_tmp')
+                                   'SectorProduced_tmp', 'SectorConsumed_tmp', 'FBA_Activity')
         # list of column headers that do exist in the df being subset
         cols_to_drop = [e for e in possible_column_headers if e in df_subset.columns.values.tolist()]
 
@@ -414,64 +404,35 @@ def collapse_fbs_sectors(fbs):
     return fbs_collapsed
 
 
-def return_activity_from_scale(df, provided_from_scale):
+def assign_geoscale_rank(df, year='2015'):
     """
-    Determine the 'from scale' used for aggregation/df subsetting for each activity combo in a df
-    :param df: flowbyactivity df
-    :param activity_df: a df with the activityproducedby, activityconsumedby columns and
-    a column 'exists' denoting if data is available at specified geoscale
-    :param provided_from_scale: The scale to use specified in method yaml
-    :return:
+    Tag each row of a FIPS based df with the geoscale of its Location, using the
+    fips_number_key values (national = 0, state = 2, county = 5)
+    :param df: flowbyactivity or flowbysector df with FIPS Locations
+    :param year: FIPS crosswalk year
+    :return: series of geoscale ranks, NaN where Location is not in the FIPS crosswalk
     """
+    codes = fips_to_int(df['Location'])
+    rank = np.select([codes.isin(get_fips_codes(g, year)) for g in fips_number_key],
+                     list(fips_number_key.values()), np.nan)
+    return pd.Series(rank, index=df.index)
 
-    # determine the unique combinations of activityproduced/consumedby
-    unique_activities = unique_activity_names(df)
-    # filter by geoscale
-    fips = create_geoscale_list(df, provided_from_scale)
-    df_sub = df[df['Location'].isin(fips)]
-    # determine unique activities after subsetting by geoscale
-    unique_activities_sub = unique_activity_names(df_sub)
-
-    # return df of the difference between unique_activities and unique_activities2
-    df_missing = dataframe_difference(unique_activities, unique_activities_sub, which='left_only')
-    # return df of the similarities between unique_activities and unique_activities2
-    df_existing = dataframe_difference(unique_activities, unique_activities_sub, which='both')
-    df_existing = df_existing.drop(columns='_merge')
-    df_existing['activity_from_scale'] = provided_from_scale
-
-    # for loop through geoscales until find data for each activity combo
-    if provided_from_scale == 'national':
-        geoscales = ['state', 'county']
-    elif provided_from_scale == 'state':
-        geoscales = ['county']
-    elif provided_from_scale == 'county':
-        log.info('No data - skipping')
-
-    if len(df_missing) > 0:
-        for i in geoscales:
-            # filter by geoscale
-            fips_i = create_geoscale_list(df, i)
-            df_i = df[df['Location'].isin(fips_i)]
-
-            # determine unique activities after subsetting by geoscale
-            unique_activities_i = unique_activity_names(df_i)
-
-            # return df of the difference between unique_activities subset and unique_activities for geoscale
-            df_missing_i = dataframe_difference(unique_activities_sub, unique_activities_i, which='right_only')
-            df_missing_i = df_missing_i.drop(columns='_merge')
-            df_missing_i['activity_from_scale'] = i
-            # return df of the similarities between unique_activities and unique_activities2
-            df_existing_i = dataframe_difference(unique_activities_sub, unique_activities_i, which='both')
-
-            # append unique activities and df with defined activity_from_scale
-            unique_activities_sub = unique_activities_sub.append(df_missing_i[[fba_activity_fields[0],
-                                                                               fba_activity_fields[1]]])
-            df_existing = df_existing.append(df_missing_i)
-            df_missing = dataframe_difference(df_missing[[fba_activity_fields[0], fba_activity_fields[1]]],
-                                              df_existing_i[[fba_activity_fields[0], fba_activity_fields[1]]],
-                                              which=None)
-
-    return df_existing
+
+def activity_from_scale_rank(df, provided_from_scale):
+    """
+    For each row, the geoscale rank used for the row's activity combination: the
+    first geoscale, starting at the provided scale and moving to less aggregated
+    scales, at which the activity combination has data
+    :param df: flowbyactivity df with a 'geoscale_rank' column
+    :param provided_from_scale: The scale to use specified in method yaml
+    :return: series of geoscale ranks for the activity combination of each row
+    """
+    eligible = df['geoscale_rank'].where(df['geoscale_rank'] >=
+                                         fips_number_key[provided_from_scale])
+    # fill NoneType activities so the activity combinations are grouped
+    activity_keys = [df[fba_activity_fields[0]].fillna(''),
+                     df[fba_activity_fields[1]].fillna('')]
+    return eligible.groupby(activity_keys).transform('min')
 
 
 def subset_df_by_geoscale(df, activity_from_scale, activity_to_scale):
@@ -486,13 +447,17 @@ def subset_df_by_geoscale(df, activity_from_scale, activity_to_scale):
     # method of subset dependent on LocationSystem
     if df['LocationSystem'].str.contains('FIPS').any():
         df = df[df['LocationSystem'].str.contains('FIPS')].reset_index(drop=True)
-        # determine 'activity_from_scale' for use in df geoscale subset, by activity
-        modified_from_scale = return_activity_from_scale(df, activity_from_scale)
-        # add 'activity_from_scale' column to df
-        df2 = pd.merge(df, modified_from_scale)
+        # tag each row with its geoscale and determine 'activity_from_scale'
+        # for each activity combination in a single pass
+        df = df.assign(geoscale_rank=assign_geoscale_rank(df))
+        from_rank = activity_from_scale_rank(df, activity_from_scale)
+        # only keep the rows at the 'from' geoscale of their activity combination
+        df = df[df['geoscale_rank'] == from_rank]
 
         # list of unique 'from' geoscales
-        unique_geoscales = modified_from_scale['activity_from_scale'].drop_duplicates().values.tolist()
+        rank_to_scale = {v: k for k, v in fips_number_key.items()}
+        unique_ranks = sorted(df['geoscale_rank'].unique())
+        unique_geoscales = [rank_to_scale[r] for r in unique_ranks]
         if len(unique_geoscales) > 1:
             log.info('Dataframe has a mix of geographic levels: ' + ', '.join(unique_geoscales))
 
@@ -502,20 +467,18 @@ def subset_df_by_geoscale(df, activity_from_scale, activity_to_scale):
         else:
             to_scale = activity_from_scale
 
-        df_subset_list = []
-        # subset df based on activity 'from' scale
-        for i in unique_geoscales:
-            df3 = df2[df2['activity_from_scale'] == i]
-            # if desired geoscale doesn't exist, aggregate existing data
-            # if df is less aggregated than allocation df, aggregate fba activity to allocation geoscale
-            if fips_number_key[i] > fips_number_key[to_scale]:
-                log.info("Aggregating subset from " + i + " to " + to_scale)
-                df_sub = agg_by_geoscale(df3, i, to_scale, fba_default_grouping_fields)
-            # else filter relevant rows
-            else:
-                log.info("Subsetting " + i + " data")
-                df_sub = filter_by_geoscale(df3, i)
-            df_subset_list.append(df_sub)
+        # if desired geoscale doesn't exist, aggregate existing data
+        # if df is less aggregated than allocation df, aggregate fba activity to allocation geoscale
+        to_agg = df['geoscale_rank'] > fips_number_key[to_scale]
+        agg_geoscales = [i for i in unique_geoscales if fips_number_key[i] > fips_number_key[to_scale]]
+        subset_geoscales = [i for i in unique_geoscales if i not in agg_geoscales]
+        df_subset_list = [df[~to_agg]]
+        if subset_geoscales:
+            log.info("Subsetting " + ', '.join(subset_geoscales) + " data")
+        if to_agg.any():
+            log.info("Aggregating subset from " + ', '.join(agg_geoscales) + " to " + to_scale)
+            df_agg = update_geoscale(df[to_agg].drop(columns='geoscale_rank'), to_scale)
+            df_subset_list.append(aggregator(df_agg, fba_default_grouping_fields))
         df_subset = pd.concat(df_subset_list, ignore_index=True)
 
         # only keep cols associated with FBA
@@ -541,6 +504,39 @@ def unique_activity_names(fba_df):
     return unique_activities
 
 
+def create_activity_index(df):
+    """
+    Create an index of the row positions in a df where each activity name appears
+    in either the ActivityProducedBy or ActivityConsumedBy columns
+    :param df: flowbyactivity df
+    :return: dictionary, activity name: array of row positions
+    """
+    activity_index = {}
+    for f in fba_activity_fields:
+        for k, v in df.groupby(f, sort=False).indices.items():
+            activity_index.setdefault(k, []).append(v)
+    activity_index = {k: np.unique(np.concatenate(v)) for k, v in activity_index.items()}
+
+    return activity_index
+
+
+def subset_df_by_activity_index(df, activity_index, names):
+    """
+    Subset a df to the rows where either activity column is in a list of activity names,
+    using the row positions in an activity index created for the df
+    :param df: flowbyactivity df used to create the activity index
+    :param activity_index: dictionary created by create_activity_index()
+    :param names: list of activity names
+    :return: df subset to the activity names, in original row order
+    """
+    positions = [activity_index[n] for n in names if n in activity_index]
+    if len(positions) == 0:
+        return df.iloc[0:0].reset_index(drop=True)
+    positions = np.unique(np.concatenate(positions))
+
+    return df.iloc[positions].reset_index(drop=True)
+
+
 def dataframe_difference(df1, df2, which=None):
     """
     Find rows which are different between two DataFrames
@@ -572,63 +568,51 @@ def estimate_suppressed_data(df, sector_column, naics_level):
     # exclude nonsectors
     df = replace_NoneType_with_empty_cells(df)
 
+    merge_cols = ['Class', 'Compartment', 'FlowType', 'FlowName', 'Location', 'LocationSystem',
+                  'Unit', 'Year']
     # find the longest length sector
-    max_length = max(df[sector_column].apply(lambda x: len(str(x))).unique())
+    max_length = df[sector_column].str.len().max()
     # loop through starting at naics_level, use most detailed level possible to save time
     for i in range(naics_level, max_length):
+        sector_length = df[sector_column].str.len()
         # create df of i length
-        df_x = df.loc[df[sector_column].apply(lambda x: len(x) == i)]
-        # create df of i + 1 length
-        df_y = df.loc[df[sector_column].apply(lambda x: len(x) == i + 1)]
-        # create temp sector columns in df y, that are i digits in length
-        df_y = df_y.assign(s_tmp=df_y[sector_column].apply(lambda x: x[0:i]))
-
-        # create list of location and temp activity combos that contain a 0
-        missing_sectors_df = df_y[df_y['FlowAmount'] == 0]
-        missing_sectors_list = missing_sectors_df[['Location', 's_tmp']].drop_duplicates().values.tolist()
-        # subset the y df
-        if len(missing_sectors_list) != 0:
-            # new df of sectors that start with missing sectors. drop last digit of the sector and sum flows
-            # set conditions
-            suppressed_list = []
-            for q, r, in missing_sectors_list:
-                c1 = df_y['Location'] == q
-                c2 = df_y['s_tmp'] == r
-                # subset data
-                suppressed_list.append(df_y.loc[c1 & c2])
-            suppressed_sectors = pd.concat(suppressed_list, sort=False, ignore_index=True)
-            # add column of existing allocated data for length of i
-            suppressed_sectors['alloc_flow'] = suppressed_sectors.groupby(['Location', 's_tmp'])['FlowAmount'].transform('sum')
-            # subset further so only keep rows of 0 value
-            suppressed_sectors_sub = suppressed_sectors[suppressed_sectors['FlowAmount'] == 0]
-            # add count
-            suppressed_sectors_sub = \
-                suppressed_sectors_sub.assign(sector_count=
-                                              suppressed_sectors_sub.groupby(['Location',
-                                                                              's_tmp'])['s_tmp'].transform('count'))
-
-            # merge suppressed sector subset with df x
-            df_m = pd.merge(df_x,
-                            suppressed_sectors_sub[['Class', 'Compartment', 'FlowType', 'FlowName', 'Location', 'LocationSystem', 'Unit',
-                                                    'Year', sector_column, 's_tmp', 'alloc_flow', 'sector_count']],
-                            left_on=['Class', 'Compartment', 'FlowType', 'FlowName', 'Location', 'LocationSystem', 'Unit',
-                                     'Year', sector_column],
-                            right_on=['Class', 'Compartment', 'FlowType', 'FlowName', 'Location', 'LocationSystem', 'Unit',
-                                      'Year', 's_tmp'],
-                            how='right')
-            # calculate estimated flows by subtracting the flow amount already allocated from total flow of \
-            # sector one level up and divide by number of sectors with suppresed data
-            df_m.loc[:, 'FlowAmount'] = (df_m['FlowAmount'] - df_m['alloc_flow']) / df_m['sector_count']
-            # only keep the suppressed sector subset activity columns
-            df_m = df_m.drop(columns=[sector_column + '_x', 's_tmp', 'alloc_flow', 'sector_count'])
-            df_m = df_m.rename(columns={sector_column + '_y': sector_column})
-            # reset activity columns #todo: modify so next 2 lines only run if activities are sector-like
-            df_m = df_m.assign(ActivityProducedBy=df_m['SectorProducedBy'])
-            df_m = df_m.assign(ActivityConsumedBy=df_m['SectorConsumedBy'])
-
-            # drop the existing rows with suppressed data and append the new estimates from fba df
-            modified_df = pd.merge(df, df_m[['FlowName', 'Location', sector_column]], indicator=True, how='outer').query('_merge=="left_only"').drop('_merge', axis=1)
-            df = pd.concat([modified_df, df_m], ignore_index=True)
+        df_x = df.loc[sector_length == i]
+        # create df of i + 1 length, with temp sector column that is i digits in length
+        df_y = df.loc[sector_length == i + 1]
+        df_y = df_y.assign(s_tmp=df_y[sector_column].str[0:i])
+
+        # for each location and parent sector, the existing allocated data and the number
+        # of child sectors with suppressed data (a flow amount of 0)
+        suppressed = df_y['FlowAmount'] == 0
+        if not suppressed.any():
+            continue
+        group_keys = [df_y['Location'], df_y['s_tmp']]
+        df_y = df_y.assign(alloc_flow=df_y['FlowAmount'].groupby(group_keys).transform('sum'),
+                           sector_count=suppressed.groupby(group_keys).transform('sum'))
+        suppressed_sectors_sub = df_y[suppressed]
+
+        # merge suppressed sector subset with df x
+        df_m = pd.merge(df_x,
+                        suppressed_sectors_sub[merge_cols + [sector_column, 's_tmp', 'alloc_flow',
+                                                             'sector_count']],
+                        left_on=merge_cols + [sector_column],
+                        right_on=merge_cols + ['s_tmp'],
+                        how='right')
+        # calculate estimated flows by subtracting the flow amount already allocated from total flow of \
+        # sector one level up and divide by number of sectors with suppresed data
+        df_m.loc[:, 'FlowAmount'] = (df_m['FlowAmount'] - df_m['alloc_flow']) / df_m['sector_count']
+        # only keep the suppressed sector subset activity columns
+        df_m = df_m.drop(columns=[sector_column + '_x', 's_tmp', 'alloc_flow', 'sector_count'])
+        df_m = df_m.rename(columns={sector_column + '_y': sector_column})
+        # reset activity columns #todo: modify so next 2 lines only run if activities are sector-like
+        df_m = df_m.assign(ActivityProducedBy=df_m['SectorProducedBy'])
+        df_m = df_m.assign(ActivityConsumedBy=df_m['SectorConsumedBy'])
+
+        # replace the existing rows with suppressed data with the new estimates from fba df
+        key_cols = ['FlowName', 'Location', sector_column]
+        replaced = pd.MultiIndex.from_frame(df[key_cols]).isin(
+            pd.MultiIndex.from_frame(df_m[key_cols]))
+        df = pd.concat([df[~replaced], df_m], ignore_index=True)
     df_w_estimated_data = replace_strings_with_NoneType(df)
 
     return df_w_estimated_data
@@ -750,9 +734,10 @@ def proportional_allocation_by_location(df):
 
     denom_df = df.loc[(df['SectorProducedBy'].apply(lambda x: len(x) == 2)) |
                       (df['SectorConsumedBy'].apply(lambda x: len(x) == 2))]
-    denom_df = denom_df.assign(Denominator=denom_df['FlowAmount'].groupby(
-        denom_df['Location']).transform('sum'))
-    denom_df_2 = denom_df[['Location', 'LocationSystem', 'Year', 'Denominator']].drop_duplicates()
+    # if ratios are created for multiple activities at once, denominators are by activity
+    denom_cols = [e for e in ['Location', 'FBA_Activity'] if e in df.columns]
+    denom_df = denom_df.assign(Denominator=denom_df.groupby(denom_cols)['FlowAmount'].transform('sum'))
+    denom_df_2 = denom_df[denom_cols + ['LocationSystem', 'Year', 'Denominator']].drop_duplicates()
     # merge the denominator column with fba_w_sector df
     allocation_df = df.merge(denom_df_2, how='left')
     # calculate ratio
@@ -766,6 +751,94 @@ def proportional_allocation_by_location(df):
     return allocation_df
 
 
+def create_allocation_ratio_matrix(flow_allocation):
+    """
+    Store allocation ratios as a sparse matrix, where rows are (Location, FBA_Activity)
+    pairs and columns are sectors
+    :param flow_allocation: df of allocation ratios with columns 'Location', 'FBA_Activity',
+                            'Sector', and 'FlowAmountRatio'
+    :return: sparse matrix of ratios, index of matrix rows, index of matrix columns
+    """
+    from scipy import sparse
+
+    df = flow_allocation[flow_allocation['Sector'].notnull()]
+    # the merge engine allocates a flow once for each repeated ratio, so repeated
+    # ratios are summed to allocate the same total flow
+    ratio_keys = ['Location', 'FBA_Activity', 'Sector']
+    duplicated = df.duplicated(subset=ratio_keys)
+    if duplicated.any():
+        log.warning('Summing ' + str(duplicated.sum()) + ' repeated allocation ratios of ' +
+                    ', '.join(pd.unique(df.loc[duplicated, 'FBA_Activity'].astype(str))))
+        df = df.groupby(ratio_keys, sort=False)['FlowAmountRatio'].sum(min_count=1).reset_index()
+    keys = pd.MultiIndex.from_frame(df[['Location', 'FBA_Activity']])
+    row_index = keys.unique()
+    col_index = pd.Index(df['Sector'].unique())
+    # ratios of 0 are stored explicitly, so they can be told apart from missing ratios
+    ratio_matrix = sparse.csr_matrix((df['FlowAmountRatio'].values.astype(float),
+                                      (row_index.get_indexer(keys),
+                                       col_index.get_indexer(df['Sector']))),
+                                     shape=(len(row_index), len(col_index)))
+    ratio_matrix.sort_indices()
+
+    return ratio_matrix, row_index, col_index
+
+
+def lookup_allocation_ratios(ratio_matrix, row_index, col_index, location, activity, sector):
+    """
+    Look up the allocation ratio of each (location, activity, sector) combination
+    in a sparse ratio matrix created with create_allocation_ratio_matrix()
+    :param ratio_matrix: sparse matrix of ratios
+    :param row_index: index of matrix rows
+    :param col_index: index of matrix columns
+    :param location: series of locations
+    :param activity: series of activities
+    :param sector: series of sectors
+    :return: array of ratios, array of booleans where a ratio exists in the matrix
+    """
+    rows = row_index.get_indexer(pd.MultiIndex.from_arrays([location, activity]))
+    cols = col_index.get_indexer(sector)
+    # the stored entries of a sorted csr matrix are ordered by their position
+    # in the flattened matrix, so all entries are searched at once
+    n_cols = max(len(col_index), 1)
+    stored = np.repeat(np.arange(ratio_matrix.shape[0]), np.diff(ratio_matrix.indptr)) * n_cols + \
+        ratio_matrix.indices
+    wanted = rows.astype(np.int64) * n_cols + cols
+    pos = np.minimum(np.searchsorted(stored, wanted), max(len(stored) - 1, 0))
+    found = (rows >= 0) & (cols >= 0) & (len(stored) > 0)
+    found[found] = stored[pos[found]] == wanted[found]
+    ratios = np.where(found, ratio_matrix.data[pos] if len(stored) > 0 else np.nan, np.nan)
+
+    return ratios, found
+
+
+def allocate_by_ratio_matrix(df, flow_allocation):
+    """
+    Allocate flows to sectors with allocation ratios stored in a sparse matrix. Gives the
+    same results as merging the allocation ratios to the flows on both activity/sector pairs,
+    except that a flow with repeated ratios is allocated once with the summed ratios.
+    :param df: df with sectors, flows to allocate
+    :param flow_allocation: df of allocation ratios with columns 'Location', 'FBA_Activity',
+                            'Sector', and 'FlowAmountRatio'
+    :return: df of allocated flows
+    """
+    ratio_matrix, row_index, col_index = create_allocation_ratio_matrix(flow_allocation)
+
+    # ratios are first matched on the produced by columns, then the consumed by columns
+    ratios = np.full(len(df), np.nan)
+    found = np.zeros(len(df), dtype=bool)
+    for a, s in zip(fba_activity_fields, fbs_activity_fields):
+        r, f = lookup_allocation_ratios(ratio_matrix, row_index, col_index,
+                                        df['Location'], df[a], df[s])
+        ratios = np.where(np.isnan(ratios), r, ratios)
+        found = found | f
+
+    # drop rows where there is no allocation data, fill null ratios with 0
+    fbs = df.reset_index(drop=True)[found].reset_index()
+    fbs.loc[:, 'FlowAmount'] = fbs['FlowAmount'] * np.nan_to_num(ratios[found], nan=0)
+
+    return fbs
+
+
 def proportional_allocation_by_location_and_activity(df, sectorcolumn):
     """
     Creates a proportional allocation within each aggregated sector within a location
@@ -778,9 +851,10 @@ def proportional_allocation_by_location_and_activity(df, sectorcolumn):
     df = replace_NoneType_with_empty_cells(df)
 
     # denominator summed from highest level of sector grouped by location
-    short_length = min(df[sectorcolumn].apply(lambda x: len(str(x))).unique())
+    sector_length = df[sectorcolumn].astype(str).str.len()
+    short_length = sector_length.min()
     # want to create denominator based on short_length
-    denom_df = df.loc[df[sectorcolumn].apply(lambda x: len(x) == short_length)].reset_index(drop=True)
+    denom_df = df.loc[sector_length == short_length].reset_index(drop=True)
     grouping_cols = [e for e in ['FlowName', 'Location', 'Activity', 'ActivityConsumedBy', 'ActivityProducedBy']
                      if e in denom_df.columns.values.tolist()]
     denom_df.loc[:, 'Denominator'] = denom_df.groupby(grouping_cols)['HelperFlow'].transform('sum')
@@ -20,7 +20,6 @@ you need functions to clean up the FBA
 
 """
 
-import sys
 import argparse
 import yaml
 import pandas as pd
@@ -29,45 +28,24 @@ import flowsa
 from flowsa.common import log, flowbysectormethodpath, flow_by_sector_fields, \
     fips_number_key, flow_by_activity_fields, load_source_catalog, \
     flowbysectoractivitysetspath, flow_by_sector_fields_w_activity,\
-    set_fb_meta, paths, fba_activity_fields, \
+    set_fb_meta, paths, \
     fbs_activity_fields, fba_fill_na_dict, fbs_fill_na_dict, fbs_default_grouping_fields, \
-    fbs_grouping_fields_w_activities
+    fbs_grouping_fields_w_activities, configure_logging
 from flowsa.fbs_allocation import direct_allocation_method, function_allocation_method, \
-    dataset_allocation_method
+    dataset_allocation_method, clear_helper_allocation_tables
 from flowsa.mapping import add_sectors_to_flowbyactivity, map_elementary_flows, \
     get_sector_list
 from flowsa.flowbyfunctions import agg_by_geoscale, sector_aggregation, \
-    aggregator, subset_df_by_geoscale, sector_disaggregation
+    aggregator, subset_df_by_geoscale, sector_disaggregation, create_activity_index, \
+    subset_df_by_activity_index
 from flowsa.dataclean import clean_df, harmonize_FBS_columns, reset_fbs_dq_scores
 from flowsa.datachecks import check_if_losing_sector_data,\
     check_for_differences_between_fba_load_and_fbs_output, \
     compare_fba_load_and_fbs_output_totals, compare_geographic_totals,\
     replace_naics_w_naics_from_another_year
-
-# import specific functions
-from flowsa.data_source_scripts.BEA import subset_BEA_Use
-from flowsa.data_source_scripts.Blackhurst_IO import convert_blackhurst_data_to_gal_per_year,\
-    convert_blackhurst_data_to_gal_per_employee
-from flowsa.data_source_scripts.BLS_QCEW import clean_bls_qcew_fba,\
-    clean_bls_qcew_fba_for_employment_sat_table, \
-    bls_clean_allocation_fba_w_sec
-from flowsa.data_source_scripts.EIA_CBECS_Land import cbecs_land_fba_cleanup
-from flowsa.data_source_scripts.EIA_MECS import mecs_energy_fba_cleanup,\
-    eia_mecs_energy_clean_allocation_fba_w_sec, \
-    mecs_land_fba_cleanup, mecs_land_fba_cleanup_for_land_2012_fbs,\
-    mecs_land_clean_allocation_mapped_fba_w_sec
-from flowsa.data_source_scripts.EPA_NEI import clean_NEI_fba, clean_NEI_fba_no_pesticides
-from flowsa.data_source_scripts.StatCan_IWS_MI import convert_statcan_data_to_US_water_use
-from flowsa.data_source_scripts.stewiFBS import stewicombo_to_sector, stewi_to_sector
-from flowsa.data_source_scripts.USDA_CoA_Cropland import \
-    disaggregate_coa_cropland_to_6_digit_naics,\
-    coa_irrigated_cropland_fba_cleanup, coa_nonirrigated_cropland_fba_cleanup
-from flowsa.data_source_scripts.USDA_ERS_MLU import allocate_usda_ers_mlu_land_in_urban_areas,\
-    allocate_usda_ers_mlu_other_land,\
-    allocate_usda_ers_mlu_land_in_rural_transportation_areas
-from flowsa.data_source_scripts.USDA_IWMS import disaggregate_iwms_to_6_digit_naics
-from flowsa.data_source_scripts.USGS_NWIS_WU import usgs_fba_data_cleanup,\
-    usgs_fba_w_sectors_data_cleanup
+from flowsa.instrumentation import RunReport, emit
+from flowsa.validation import Validator, validation_levels
+from flowsa.registry import get_function
 
 
 def parse_args():
@@ -76,6 +54,8 @@ def parse_args():
     ap.add_argument("-m", "--method",
                     required=True, help="Method for flow by sector file. "
                                         "A valid method config file must exist with this name.")
+    ap.add_argument("-v", "--validation", choices=validation_levels, default='full',
+                    help="Level of the datachecks run on each activity set")
     args = vars(ap.parse_args())
     return args
 
@@ -118,7 +98,7 @@ def load_source_dataframe(k, v):
         flows_df = flowsa.getFlowBySector(k)
     elif v['data_format'] == 'FBS_outside_flowsa':
         log.info("Retrieving flowbysector for datasource " + k)
-        flows_df = getattr(sys.modules[__name__], v["FBS_datapull_fxn"])(v)
+        flows_df = get_function(v["FBS_datapull_fxn"])(v)
     else:
         log.error("Data format not specified in method file for datasource " + k)
 
@@ -129,40 +109,61 @@ def main(**kwargs):
     """
     Creates a flowbysector dataset
     :param method_name: Name of method corresponding to flowbysector method yaml name
+    :param validation: str, 'off', 'fast', or 'full' (default), level of the datachecks
+        run on each activity set, see flowsa.validation
     :return: flowbysector
     """
     if len(kwargs) == 0:
         kwargs = parse_args()
 
     method_name = kwargs['method']
+    validation = kwargs.get('validation') or 'full'
     # assign arguments
     log.info("Initiating flowbysector creation for " + method_name)
     # call on method
     method = load_method(method_name)
+    # record the time, rows and memory of each stage of the run
+    report = RunReport(method_name)
+    # run the datachecks at the validation level, in the background at the 'full' level
+    validator = Validator(method_name, validation)
+    # helper allocation tables are only shared by the activity sets of a run
+    clear_helper_allocation_tables()
     # create dictionary of data and allocation datasets
     fb = method['source_names']
     # Create empty list for storing fbs files
     fbs_list = []
     for k, v in fb.items():
         # pull fba data for allocation
-        flows = load_source_dataframe(k, v)
+        with report.stage('load', k) as s:
+            s['df_out'] = flows = load_source_dataframe(k, v)
 
         if v['data_format'] == 'FBA':
-            # ensure correct datatypes and that all fields exist
-            flows = clean_df(flows, flow_by_activity_fields,
-                             fba_fill_na_dict, drop_description=False)
-
-            # clean up fba, if specified in yaml
-            if v["clean_fba_df_fxn"] != 'None':
-                log.info("Cleaning up " + k + " FlowByActivity")
-                flows = getattr(sys.modules[__name__], v["clean_fba_df_fxn"])(flows)
-
-            # if activity_sets are specified in a file, call them here
-            if 'activity_set_file' in v:
-                aset_names = pd.read_csv(flowbysectoractivitysetspath +
-                                         v['activity_set_file'], dtype=str)
-            else:
-                aset_names = None
+            with report.stage('clean', k, df_in=flows) as s:
+                # ensure correct datatypes and that all fields exist
+                flows = clean_df(flows, flow_by_activity_fields,
+                                 fba_fill_na_dict, drop_description=False)
+
+                # clean up fba, if specified in yaml
+                if v["clean_fba_df_fxn"] != 'None':
+                    log.info("Cleaning up " + k + " FlowByActivity")
+                    flows = get_function(v["clean_fba_df_fxn"])(flows)
+
+                # if activity_sets are specified in a file, call them here
+                if 'activity_set_file' in v:
+                    aset_names = pd.read_csv(flowbysectoractivitysetspath +
+                                             v['activity_set_file'], dtype=str)
+                else:
+                    aset_names = None
+
+                # if activities are sector-like, check sectors are valid, replacing
+                # NAICS from other years once for the source
+                if load_source_catalog()[k]['sector-like_activities']:
+                    flows = replace_naics_w_naics_from_another_year(flows,
+                                                                    method['target_sector_source'])
+                # index the rows associated with each activity name so each activity
+                # set subset is a lookup rather than a scan of the full df
+                activity_index = create_activity_index(flows)
+                s['df_out'] = flows
 
             # create dictionary of allocation datasets for different activities
             activities = v['activity_sets']
@@ -177,171 +178,206 @@ def main(**kwargs):
                 log.info("Preparing to handle " + aset + " in " + k)
                 log.debug("Preparing to handle subset of activities: " + ', '.join(map(str, names)))
                 # subset fba data by activity
-                # if activities are sector-like, check sectors are valid
-                if load_source_catalog()[k]['sector-like_activities']:
-                    flows = replace_naics_w_naics_from_another_year(flows,
-                                                                    method['target_sector_source'])
-                flows_subset =\
-                    flows[(flows[fba_activity_fields[0]].isin(names)) |
-                          (flows[fba_activity_fields[1]].isin(names))].reset_index(drop=True)
+                with report.stage('activity_subset', k, aset, df_in=flows) as s:
+                    s['df_out'] = flows_subset = \
+                        subset_df_by_activity_index(flows, activity_index, names)
 
                 # extract relevant geoscale data or aggregate existing data
-                flows_subset_geo = subset_df_by_geoscale(flows_subset, v['geoscale_to_use'],
-                                                         attr['allocation_from_scale'])
+                with report.stage('geoscale_subset', k, aset, df_in=flows_subset) as s:
+                    s['df_out'] = flows_subset_geo = \
+                        subset_df_by_geoscale(flows_subset, v['geoscale_to_use'],
+                                              attr['allocation_from_scale'])
                 # if loading data subnational geoscale, check for data loss
                 if attr['allocation_from_scale'] != 'national':
-                    compare_geographic_totals(flows_subset_geo, flows_subset, k, method_name, aset)
-
-                # Add sectors to df activity, depending on level of specified sector aggregation
-                log.info("Adding sectors to " + k)
-                flow_subset_wsec =\
-                    add_sectors_to_flowbyactivity(flows_subset_geo,
-                                                  sectorsourcename=method['target_sector_source'],
-                                                  allocationmethod=attr['allocation_method'])
-                # clean up fba with sectors, if specified in yaml
-                if v["clean_fba_w_sec_df_fxn"] != 'None':
-                    log.info("Cleaning up " + k + " FlowByActivity with sectors")
-                    flow_subset_wsec = getattr(sys.modules[__name__],
-                                               v["clean_fba_w_sec_df_fxn"])(flow_subset_wsec,
-                                                                            attr=attr)
-
-                # map df to elementary flows
-                log.info("Mapping flows in " + k + ' to federal elementary flow list')
-                if 'fedefl_mapping' in v:
-                    mapping_files = v['fedefl_mapping']
-                else:
-                    mapping_files = k
-
-                flow_subset_mapped = map_elementary_flows(flow_subset_wsec, mapping_files)
-
-                # clean up mapped fba with sectors, if specified in yaml
-                if "clean_mapped_fba_w_sec_df_fxn" in v:
-                    log.info("Cleaning up " + k + " FlowByActivity with sectors")
-                    flow_subset_mapped =\
-                        getattr(sys.modules[__name__],
-                                v["clean_mapped_fba_w_sec_df_fxn"])\
-                            (flow_subset_mapped, attr, method)
-                # rename SourceName to MetaSources
-                flow_subset_mapped = flow_subset_mapped.\
-                    rename(columns={'SourceName': 'MetaSources'})
-
-                # if allocation method is "direct", then no need to create alloc ratios,
-                # else need to use allocation
-                # dataframe to create sector allocation ratios
-                if attr['allocation_method'] == 'direct':
-                    fbs = direct_allocation_method(flow_subset_mapped, k, names, method)
-                # if allocation method for an activity set requires a specific
-                # function due to the complicated nature
-                # of the allocation, call on function here
-                elif attr['allocation_method'] == 'allocation_function':
-                    fbs = function_allocation_method(flow_subset_mapped, names, attr, fbs_list)
-                else:
-                    fbs =\
-                        dataset_allocation_method(flow_subset_mapped, attr,
-                                                  names, method, k, v, aset,
-                                                  method_name, aset_names)
-
-                # drop rows where flowamount = 0 (although this includes dropping suppressed data)
-                fbs = fbs[fbs['FlowAmount'] != 0].reset_index(drop=True)
-
-                # define grouping columns dependent on sectors being activity-like or not
-                if load_source_catalog()[k]['sector-like_activities'] is False:
-                    groupingcols = fbs_grouping_fields_w_activities
-                    groupingdict = flow_by_sector_fields_w_activity
-                else:
-                    groupingcols = fbs_default_grouping_fields
-                    groupingdict = flow_by_sector_fields
-
-                # clean df
-                fbs = clean_df(fbs, groupingdict, fbs_fill_na_dict)
-
-                # aggregate df geographically, if necessary
-                log.info("Aggregating flowbysector to " + method['target_geoscale'] + " level")
-                # determine from scale
-                if fips_number_key[v['geoscale_to_use']] <\
-                        fips_number_key[attr['allocation_from_scale']]:
-                    from_scale = v['geoscale_to_use']
-                else:
-                    from_scale = attr['allocation_from_scale']
-
-                fbs_geo_agg = agg_by_geoscale(fbs, from_scale,
-                                              method['target_geoscale'], groupingcols)
-
-                # aggregate data to every sector level
-                log.info("Aggregating flowbysector to all sector levels")
-                fbs_sec_agg = sector_aggregation(fbs_geo_agg, groupingcols)
-                # add missing naics5/6 when only one naics5/6 associated with a naics4
-                fbs_agg = sector_disaggregation(fbs_sec_agg, groupingdict)
-
-                # check if any sector information is lost before reaching
-                # the target sector length, if so,
-                # allocate values equally to disaggregated sectors
-                log.debug('Checking for data at ' + method['target_sector_level'])
-                fbs_agg_2 = check_if_losing_sector_data(fbs_agg, method['target_sector_level'])
+                    with report.stage('datachecks_submit', k, aset, df_in=flows_subset_geo):
+                        validator.submit(compare_geographic_totals, k, aset, flows_subset_geo,
+                                         flows_subset, k, method_name, aset)
+
+                with report.stage('sector_mapping', k, aset, df_in=flows_subset_geo) as s:
+                    # Add sectors to df activity, depending on level of specified sector
+                    # aggregation
+                    log.info("Adding sectors to " + k)
+                    flow_subset_wsec =\
+                        add_sectors_to_flowbyactivity(flows_subset_geo,
+                                                      sectorsourcename=method['target_sector_source'],
+                                                      allocationmethod=attr['allocation_method'])
+                    # clean up fba with sectors, if specified in yaml
+                    if v["clean_fba_w_sec_df_fxn"] != 'None':
+                        log.info("Cleaning up " + k + " FlowByActivity with sectors")
+                        flow_subset_wsec = get_function(v["clean_fba_w_sec_df_fxn"])(
+                            flow_subset_wsec, attr=attr)
+                    s['df_out'] = flow_subset_wsec
+
+                with report.stage('flow_mapping', k, aset, df_in=flow_subset_wsec) as s:
+                    # map df to elementary flows
+                    log.info("Mapping flows in " + k + ' to federal elementary flow list')
+                    if 'fedefl_mapping' in v:
+                        mapping_files = v['fedefl_mapping']
+                    else:
+                        mapping_files = k
+
+                    flow_subset_mapped = map_elementary_flows(flow_subset_wsec, mapping_files)
+
+                    # clean up mapped fba with sectors, if specified in yaml
+                    if "clean_mapped_fba_w_sec_df_fxn" in v:
+                        log.info("Cleaning up " + k + " FlowByActivity with sectors")
+                        flow_subset_mapped = get_function(
+                            v["clean_mapped_fba_w_sec_df_fxn"])(flow_subset_mapped, attr, method)
+                    # rename SourceName to MetaSources
+                    flow_subset_mapped = flow_subset_mapped.\
+                        rename(columns={'SourceName': 'MetaSources'})
+                    s['df_out'] = flow_subset_mapped
+
+                with report.stage('allocation', k, aset, df_in=flow_subset_mapped) as s:
+                    # if allocation method is "direct", then no need to create alloc ratios,
+                    # else need to use allocation
+                    # dataframe to create sector allocation ratios
+                    if attr['allocation_method'] == 'direct':
+                        fbs = direct_allocation_method(flow_subset_mapped, k, names, method)
+                    # if allocation method for an activity set requires a specific
+                    # function due to the complicated nature
+                    # of the allocation, call on function here
+                    elif attr['allocation_method'] == 'allocation_function':
+                        fbs = function_allocation_method(flow_subset_mapped, names, attr,
+                                                         fbs_list)
+                    else:
+                        fbs =\
+                            dataset_allocation_method(flow_subset_mapped, attr,
+                                                      names, method, k, v, aset,
+                                                      method_name, aset_names, validator)
+                    s['df_out'] = fbs
+
+                with report.stage('aggregation', k, aset, df_in=fbs) as s:
+                    # drop rows where flowamount = 0 (although this includes dropping
+                    # suppressed data)
+                    fbs = fbs[fbs['FlowAmount'] != 0].reset_index(drop=True)
+
+                    # define grouping columns dependent on sectors being activity-like or not
+                    if load_source_catalog()[k]['sector-like_activities'] is False:
+                        groupingcols = fbs_grouping_fields_w_activities
+                        groupingdict = flow_by_sector_fields_w_activity
+                    else:
+                        groupingcols = fbs_default_grouping_fields
+                        groupingdict = flow_by_sector_fields
+
+                    # clean df
+                    fbs = clean_df(fbs, groupingdict, fbs_fill_na_dict)
+
+                    # aggregate df geographically, if necessary
+                    log.info("Aggregating flowbysector to " + method['target_geoscale'] +
+                             " level")
+                    # determine from scale
+                    if fips_number_key[v['geoscale_to_use']] <\
+                            fips_number_key[attr['allocation_from_scale']]:
+                        from_scale = v['geoscale_to_use']
+                    else:
+                        from_scale = attr['allocation_from_scale']
+
+                    fbs_geo_agg = agg_by_geoscale(fbs, from_scale,
+                                                  method['target_geoscale'], groupingcols)
+
+                    # aggregate data to every sector level
+                    log.info("Aggregating flowbysector to all sector levels")
+                    fbs_sec_agg = sector_aggregation(fbs_geo_agg, groupingcols)
+                    # add missing naics5/6 when only one naics5/6 associated with a naics4
+                    fbs_agg = sector_disaggregation(fbs_sec_agg, groupingdict)
+                    s['df_out'] = fbs_agg
+
+                with report.stage('sector_loss_check', k, aset, df_in=fbs_agg) as s:
+                    # check if any sector information is lost before reaching
+                    # the target sector length, if so,
+                    # allocate values equally to disaggregated sectors
+                    log.debug('Checking for data at ' + method['target_sector_level'])
+                    s['df_out'] = fbs_agg_2 = \
+                        check_if_losing_sector_data(fbs_agg, method['target_sector_level'])
 
                 # compare flowbysector with flowbyactivity
                 # todo: modify fxn to work if activities are sector like in df being allocated
                 if load_source_catalog()[k]['sector-like_activities'] is False:
-                    check_for_differences_between_fba_load_and_fbs_output(
-                        flow_subset_mapped, fbs_agg_2, aset, k, method_name)
-
-                # return sector level specified in method yaml
-                # load the crosswalk linking sector lengths
-                sector_list = get_sector_list(method['target_sector_level'])
-
-                # subset df, necessary because not all of the sectors are
-                # NAICS and can get duplicate rows
-                fbs_1 = fbs_agg_2.loc[(fbs_agg_2[fbs_activity_fields[0]].isin(sector_list)) &
-                                      (fbs_agg_2[fbs_activity_fields[1]].isin(sector_list))].\
-                    reset_index(drop=True)
-                fbs_2 = fbs_agg_2.loc[(fbs_agg_2[fbs_activity_fields[0]].isin(sector_list)) &
-                                      (fbs_agg_2[fbs_activity_fields[1]].isnull())].\
-                    reset_index(drop=True)
-                fbs_3 = fbs_agg_2.loc[(fbs_agg_2[fbs_activity_fields[0]].isnull()) &
-                                      (fbs_agg_2[fbs_activity_fields[1]].isin(sector_list))].\
-                    reset_index(drop=True)
-                fbs_sector_subset = pd.concat([fbs_1, fbs_2, fbs_3])
-
-                # drop activity columns
-                fbs_sector_subset = fbs_sector_subset.drop(['ActivityProducedBy',
-                                                            'ActivityConsumedBy'],
-                                                           axis=1, errors='ignore')
+                    with report.stage('datachecks_submit', k, aset, df_in=fbs_agg_2):
+                        validator.submit(check_for_differences_between_fba_load_and_fbs_output,
+                                         k, aset, flow_subset_mapped, fbs_agg_2, aset, k,
+                                         method_name)
+
+                with report.stage('sector_subset', k, aset, df_in=fbs_agg_2) as s:
+                    # return sector level specified in method yaml
+                    # load the crosswalk linking sector lengths
+                    sector_list = get_sector_list(method['target_sector_level'])
+
+                    # subset df, necessary because not all of the sectors are
+                    # NAICS and can get duplicate rows
+                    fbs_1 = fbs_agg_2.loc[(fbs_agg_2[fbs_activity_fields[0]].isin(sector_list)) &
+                                          (fbs_agg_2[fbs_activity_fields[1]].isin(sector_list))].\
+                        reset_index(drop=True)
+                    fbs_2 = fbs_agg_2.loc[(fbs_agg_2[fbs_activity_fields[0]].isin(sector_list)) &
+                                          (fbs_agg_2[fbs_activity_fields[1]].isnull())].\
+                        reset_index(drop=True)
+                    fbs_3 = fbs_agg_2.loc[(fbs_agg_2[fbs_activity_fields[0]].isnull()) &
+                                          (fbs_agg_2[fbs_activity_fields[1]].isin(sector_list))].\
+                        reset_index(drop=True)
+                    fbs_sector_subset = pd.concat([fbs_1, fbs_2, fbs_3])
+
+                    # drop activity columns
+                    fbs_sector_subset = fbs_sector_subset.drop(['ActivityProducedBy',
+                                                                'ActivityConsumedBy'],
+                                                               axis=1, errors='ignore')
+                    s['df_out'] = fbs_sector_subset
 
                 # save comparison of FBA total to FBS total for an activity set
-                compare_fba_load_and_fbs_output_totals(flows_subset_geo, fbs_sector_subset, aset, k,
-                                                       method_name, attr, method, mapping_files)
+                with report.stage('datachecks_submit', k, aset, df_in=fbs_sector_subset):
+                    validator.submit(compare_fba_load_and_fbs_output_totals, k, aset,
+                                     flows_subset_geo, fbs_sector_subset, aset, k, method_name,
+                                     attr, method, mapping_files)
 
                 log.info("Completed flowbysector for " + aset)
+                emit('activity_set_complete', method=method_name, source=k, activity_set=aset,
+                     rows=len(fbs_sector_subset))
                 fbs_list.append(fbs_sector_subset)
         else:
             # if the loaded flow dt is already in FBS format, append directly to list of FBS
             log.info("Append " + k + " to FBS list")
             # ensure correct field datatypes and add any missing fields
-            flows = clean_df(flows, flow_by_sector_fields, fbs_fill_na_dict)
+            with report.stage('clean', k, df_in=flows) as s:
+                s['df_out'] = flows = clean_df(flows, flow_by_sector_fields, fbs_fill_na_dict)
             fbs_list.append(flows)
-    # create single df of all activities
-    log.info("Concat data for all activities")
-    fbss = pd.concat(fbs_list, ignore_index=True, sort=False)
-    log.info("Clean final dataframe")
-    # add missing fields, ensure correct data type, add missing columns, reorder columns
-    fbss = clean_df(fbss, flow_by_sector_fields, fbs_fill_na_dict)
-    # prior to aggregating, replace MetaSources string with all sources
-    # that share context/flowable/sector values
-    fbss = harmonize_FBS_columns(fbss)
-    # aggregate df as activities might have data for the same specified sector length
-    fbss = aggregator(fbss, fbs_default_grouping_fields)
-    # sort df
-    log.info("Sort and store dataframe")
-    # ensure correct data types/order of columns
-    fbss = clean_df(fbss, flow_by_sector_fields, fbs_fill_na_dict)
-    fbss = fbss.sort_values(
-        ['SectorProducedBy', 'SectorConsumedBy', 'Flowable', 'Context']).reset_index(drop=True)
-    # tmp reset data quality scores
-    fbss = reset_fbs_dq_scores(fbss)
+    clear_helper_allocation_tables()
+    with report.stage('finalize') as s:
+        # create single df of all activities
+        log.info("Concat data for all activities")
+        fbss = pd.concat(fbs_list, ignore_index=True, sort=False)
+        log.info("Clean final dataframe")
+        # add missing fields, ensure correct data type, add missing columns, reorder columns
+        fbss = clean_df(fbss, flow_by_sector_fields, fbs_fill_na_dict)
+        # prior to aggregating, replace MetaSources string with all sources
+        # that share context/flowable/sector values
+        fbss = harmonize_FBS_columns(fbss)
+        # aggregate df as activities might have data for the same specified sector length
+        fbss = aggregator(fbss, fbs_default_grouping_fields)
+        # sort df
+        log.info("Sort and store dataframe")
+        # ensure correct data types/order of columns
+        fbss = clean_df(fbss, flow_by_sector_fields, fbs_fill_na_dict)
+        fbss = fbss.sort_values(
+            ['SectorProducedBy', 'SectorConsumedBy', 'Flowable', 'Context']).reset_index(drop=True)
+        # tmp reset data quality scores
+        fbss = reset_fbs_dq_scores(fbss)
+        s['df_out'] = fbss
     # save parquet file
-    meta = set_fb_meta(method_name, "FlowBySector")
-    write_df_to_file(fbss,paths,meta)
-
+    with report.stage('write', df_in=fbss):
+        meta = set_fb_meta(method_name, "FlowBySector")
+        write_df_to_file(fbss,paths,meta)
+    emit('fbs_saved', method=method_name, rows=len(fbss))
+    # wait for datachecks running in the background and save the validation report
+    with report.stage('validation'):
+        validator.write()
+    # time spent running each datacheck, which at the 'full' level runs in the background
+    for r in validator.records:
+        report.add_stage('datachecks', r['Source'], r['ActivitySet'], r['WallTime'], r['Rows'],
+                         r['CPUTime'])
+    # save the run report next to the parquet and log the time spent in each stage
+    report.write()
+    report.log_summary()
 
 if __name__ == '__main__':
+    configure_logging()
     main()
@@ -0,0 +1,437 @@
+# instrumentation.py (flowsa)
+# !/usr/bin/env python3
+# coding=utf-8
+"""
+Record the wall time, CPU time, row counts and peak memory of each stage of a
+FlowBySector run, to identify the stages responsible for long run times, and
+call on registered profiling hooks for the spans and events of the FBA and FBS pipelines
+
+Profiling hooks subclass Hook, overriding any of start_span(), end_span() and on_event(),
+and are attached with register_hook():
+    hook = register_hook(CProfileHook(span_names=['allocation'], path='profiles/'))
+    flowsa.flowbysector.main(method='Water_national_2015_m1')
+    unregister_hook(hook)
+Spans are opened with span() or the traced() decorator, and events are sent with emit().
+When no hooks are registered, spans and events return immediately.
+"""
+
+import os
+import sys
+import json
+import time
+import itertools
+import threading
+import functools
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+import pandas as pd
+from flowsa.common import log, fbsoutputpath
+
+try:
+    import resource
+except ImportError:
+    # resource is not available on windows, where memory is not recorded
+    resource = None
+
+
+def get_peak_rss():
+    """
+    Get the peak resident set size of the current process
+    :return: float, peak RSS in MB, None if it cannot be determined on the platform
+    """
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kilobytes on linux
+    if sys.platform == 'darwin':
+        return peak_rss / 1024 ** 2
+    return peak_rss / 1024
+
+
+# hooks called on for each span and event, in order of registration
+_hooks = []
+# spans currently open in each thread, to assign the parent of new spans
+_local = threading.local()
+_span_ids = itertools.count(1)
+# returned by span() when no hooks are registered
+_null_span = nullcontext()
+
+
+def _open_spans():
+    """
+    :return: list of the spans open in the current thread, innermost last
+    """
+    if not hasattr(_local, 'spans'):
+        _local.spans = []
+    return _local.spans
+
+
+class Hook:
+    """
+    Base class of profiling hooks, methods are no-ops so hooks only override the
+    callbacks they use
+    """
+
+    def start_span(self, span):
+        """
+        Called when a span opens
+        :param span: Span
+        """
+
+    def end_span(self, span):
+        """
+        Called when a span closes, including when the span raised an exception
+        :param span: Span, with 'end', 'duration', and 'error' assigned
+        """
+
+    def on_event(self, event, data):
+        """
+        Called for events sent with emit()
+        :param event: str, name of the event
+        :param data: dictionary, event data
+        """
+
+
+class Span:
+    """
+    A named, timed section of a pipeline
+    """
+    __slots__ = ['span_id', 'parent_id', 'name', 'attributes', 'start', 'end', 'duration',
+                 'error']
+
+    def __init__(self, name, attributes):
+        self.span_id = next(_span_ids)
+        open_spans = _open_spans()
+        self.parent_id = open_spans[-1].span_id if open_spans else None
+        self.name = name
+        self.attributes = attributes
+        self.start = time.time()
+        self.end = None
+        self.duration = None
+        self.error = None
+
+    def to_dict(self):
+        """
+        :return: dictionary of the span fields
+        """
+        return {k: getattr(self, k) for k in self.__slots__}
+
+
+def register_hook(hook):
+    """
+    Register a hook to be called on for all spans and events
+    :param hook: Hook
+    :return: Hook, the registered hook
+    """
+    _hooks.append(hook)
+    return hook
+
+
+def unregister_hook(hook):
+    """
+    Stop calling on a registered hook
+    :param hook: Hook
+    """
+    if hook in _hooks:
+        _hooks.remove(hook)
+
+
+def clear_hooks():
+    """
+    Unregister all hooks
+    """
+    _hooks.clear()
+
+
+@contextmanager
+def _span(name, attributes):
+    """
+    Open a span, calling on the hooks registered when the span opens
+    """
+    s = Span(name, attributes)
+    hooks = list(_hooks)
+    for hook in hooks:
+        hook.start_span(s)
+    _open_spans().append(s)
+    wall_start = time.perf_counter()
+    try:
+        yield s
+    except BaseException as e:
+        s.error = repr(e)
+        raise
+    finally:
+        s.duration = time.perf_counter() - wall_start
+        s.end = s.start + s.duration
+        _open_spans().remove(s)
+        for hook in reversed(hooks):
+            hook.end_span(s)
+
+
+def span(name, **attributes):
+    """
+    Context manager of a span passed to the registered hooks:
+        with span('fetch', url=url):
+            r = make_http_request(url)
+    :param name: str, span name
+    :param attributes: span attributes, such as source and year
+    :return: context manager yielding the Span, or None if no hooks are registered
+    """
+    if not _hooks:
+        return _null_span
+    return _span(name, attributes)
+
+
+def traced(name=None):
+    """
+    Decorator opening a span for each call of a function
+    :param name: str, span name, defaults to the function name
+    :return: decorator
+    """
+    def decorator(fxn):
+        span_name = name or fxn.__name__
+
+        @functools.wraps(fxn)
+        def wrapper(*args, **kwargs):
+            if not _hooks:
+                return fxn(*args, **kwargs)
+            with _span(span_name, {}):
+                return fxn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def emit(event, **data):
+    """
+    Send an event to the registered hooks
+    :param event: str, name of the event
+    :param data: event data
+    """
+    for hook in list(_hooks):
+        hook.on_event(event, data)
+
+
+class CProfileHook(Hook):
+    """
+    Profile spans with cProfile. Spans nested in a profiled span are included
+    in the profile of the outer span
+    """
+
+    def __init__(self, span_names=None, path=None):
+        """
+        :param span_names: list, names of the spans to profile, defaults to all spans
+        :param path: str, optional folder to save a '<span>_<id>.prof' file for each profile
+        """
+        self.span_names = span_names
+        self.path = path
+        # list of (span, cProfile.Profile)
+        self.profiles = []
+        self._profiled_span = None
+        self._profiler = None
+
+    def start_span(self, span):
+        if self._profiler is not None or \
+                (self.span_names is not None and span.name not in self.span_names):
+            return
+        import cProfile
+        self._profiled_span = span
+        self._profiler = cProfile.Profile()
+        self._profiler.enable()
+
+    def end_span(self, span):
+        if span is not self._profiled_span:
+            return
+        self._profiler.disable()
+        self.profiles.append((span, self._profiler))
+        if self.path is not None:
+            os.makedirs(self.path, exist_ok=True)
+            self._profiler.dump_stats(os.path.join(self.path, '{}_{}.prof'.format(
+                span.name, span.span_id)))
+        self._profiled_span = None
+        self._profiler = None
+
+    def print_stats(self, sort='cumulative', limit=20):
+        """
+        Print the stats of each profile
+        :param sort: str, pstats sort key
+        :param limit: int, number of functions to print per profile
+        """
+        import pstats
+        for span, profiler in self.profiles:
+            print('Profile of ' + span.name + ' ' + str(span.attributes))
+            pstats.Stats(profiler).sort_stats(sort).print_stats(limit)
+
+
+class MemorySnapshotHook(Hook):
+    """
+    Take tracemalloc snapshots at the end of spans, tracing memory allocations
+    from the start of the first span
+    """
+
+    def __init__(self, span_names=None, path=None):
+        """
+        :param span_names: list, names of the spans to snapshot, defaults to all spans
+        :param path: str, optional folder to save a '<span>_<id>.snapshot' file for each snapshot
+        """
+        self.span_names = span_names
+        self.path = path
+        # list of (span, tracemalloc.Snapshot)
+        self.snapshots = []
+
+    def start_span(self, span):
+        import tracemalloc
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def end_span(self, span):
+        if self.span_names is not None and span.name not in self.span_names:
+            return
+        import tracemalloc
+        snapshot = tracemalloc.take_snapshot()
+        self.snapshots.append((span, snapshot))
+        if self.path is not None:
+            os.makedirs(self.path, exist_ok=True)
+            snapshot.dump(os.path.join(self.path, '{}_{}.snapshot'.format(
+                span.name, span.span_id)))
+
+    def stop(self):
+        """
+        Stop tracing memory allocations
+        """
+        import tracemalloc
+        tracemalloc.stop()
+
+
+class FileSpanExporter(Hook):
+    """
+    Write each completed span and each event as a line of json, for import to
+    tracing systems
+    """
+
+    def __init__(self, path):
+        """
+        :param path: str, file path of the json lines file, appended to if it exists
+        """
+        self.path = path
+
+    def _write(self, record):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record, default=str) + '\n')
+
+    def end_span(self, span):
+        self._write(dict(type='span', **span.to_dict()))
+
+    def on_event(self, event, data):
+        open_spans = _open_spans()
+        self._write({'type': 'event', 'name': event, 'time': time.time(),
+                     'span_id': open_spans[-1].span_id if open_spans else None,
+                     'attributes': data})
+
+
+class RunReport:
+    """
+    Records of the stages of a FlowBySector run, the recording only calls on the
+    system clocks and resource usage so it is cheap enough to always be on.
+    Each stage is also a span passed to the registered hooks
+    """
+
+    def __init__(self, method_name):
+        """
+        :param method_name: str, name of the FBS method yaml
+        """
+        self.method_name = method_name
+        self.created = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.stages = []
+
+    @contextmanager
+    def stage(self, stage, source=None, activity_set=None, df_in=None):
+        """
+        Record a stage of the run. Assign the df returned by the stage to 'df_out'
+        of the yielded record to record the output row count:
+            with report.stage('allocation', k, aset, df_in=flows) as s:
+                s['df_out'] = fbs = allocate(flows)
+        :param stage: str, name of the stage
+        :param source: str, datasource name
+        :param activity_set: str, activity set name
+        :param df_in: df, input to the stage
+        :return: dictionary, record of the stage
+        """
+        record = {'Stage': stage, 'Source': source, 'ActivitySet': activity_set,
+                  'RowsIn': None if df_in is None else len(df_in), 'df_out': None}
+        rss_start = get_peak_rss()
+        # CPU time of the calling thread, so datachecks running on the background
+        # validation thread are not counted in the stage
+        cpu_start = time.thread_time()
+        wall_start = time.perf_counter()
+        try:
+            with span(stage, source=source, activity_set=activity_set):
+                yield record
+        finally:
+            record['WallTime'] = time.perf_counter() - wall_start
+            record['CPUTime'] = time.thread_time() - cpu_start
+            rss_end = get_peak_rss()
+            record['PeakRSSDelta'] = None if rss_start is None else rss_end - rss_start
+            # only store the row count, not the df
+            df_out = record.pop('df_out')
+            record['RowsOut'] = None if df_out is None else len(df_out)
+            self.stages.append(record)
+
+    def add_stage(self, stage, source=None, activity_set=None, wall_time=None, rows_out=None,
+                  cpu_time=None):
+        """
+        Record a stage timed outside of the report, such as a datacheck run on the
+        background validation thread
+        :param stage: str, name of the stage
+        :param source: str, datasource name
+        :param activity_set: str, activity set name
+        :param wall_time: float, seconds spent in the stage
+        :param rows_out: int, output row count
+        :param cpu_time: float, CPU seconds of the thread running the stage
+        """
+        self.stages.append({'Stage': stage, 'Source': source, 'ActivitySet': activity_set,
+                            'RowsIn': None, 'RowsOut': rows_out, 'WallTime': wall_time,
+                            'CPUTime': cpu_time, 'PeakRSSDelta': None})
+
+    def to_df(self):
+        """
+        Convert the stage records to a df
+        :return: df, one row per stage, times in seconds and memory in MB
+        """
+        return pd.DataFrame(self.stages, columns=['Stage', 'Source', 'ActivitySet', 'RowsIn',
+                                                  'RowsOut', 'WallTime', 'CPUTime',
+                                                  'PeakRSSDelta'])
+
+    def summarize(self):
+        """
+        Sum the time spent in each stage across sources and activity sets
+        :return: df, one row per stage, in the order stages are first run
+        """
+        df = self.to_df()
+        summary = df.groupby('Stage', sort=False).agg(
+            Count=('Stage', 'size'), WallTime=('WallTime', 'sum'), CPUTime=('CPUTime', 'sum'),
+            PeakRSSDelta=('PeakRSSDelta', 'sum'))
+        summary['WallTimeShare'] = summary['WallTime'] / summary['WallTime'].sum()
+        return summary.reset_index()
+
+    def write(self, path=None):
+        """
+        Save the stage records as json next to the FBS output
+        :param path: str, optional file path, defaults to the FlowBySector output folder
+        :return: str, file path of the run report
+        """
+        if path is None:
+            os.makedirs(fbsoutputpath, exist_ok=True)
+            path = fbsoutputpath + self.method_name + '_run_report.json'
+        report = {'method': self.method_name, 'created': self.created,
+                  'stages': json.loads(self.to_df().to_json(orient='records'))}
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=1)
+        log.info('Saved run report to ' + path)
+        return path
+
+    def log_summary(self):
+        """
+        Log the time spent in each stage
+        """
+        summary = self.summarize()
+        log.info('Run report for ' + self.method_name + ' (times in seconds, memory in MB):\n' +
+                 summary.to_string(index=False, float_format=lambda x: '%.2f' % x))
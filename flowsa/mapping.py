@@ -4,10 +4,11 @@
 """
 Contains mapping functions
 """
+from functools import lru_cache
 import pandas as pd
 import numpy as np
-from flowsa.common import datapath, sector_source_name, activity_fields, load_source_catalog, \
-    load_sector_crosswalk, log, fba_activity_fields
+from flowsa.common import sector_source_name, activity_fields, load_source_catalog, \
+    load_sector_crosswalk, log, fba_activity_fields, load_activitytosector_crosswalk
 from flowsa.flowbyfunctions import fbs_activity_fields, load_sector_length_crosswalk
 from flowsa.datachecks import replace_naics_w_naics_from_another_year
 
@@ -21,9 +22,24 @@ def get_activitytosector_mapping(source):
         source = 'SCC'
     if 'BEA' in source:
         source = 'BEA_2012_Detail'
-    mapping = pd.read_csv(datapath+'activitytosectormapping/'+'Crosswalk_'+source+'_toNAICS.csv',
-                          dtype={'Activity': 'str',
-                                 'Sector': 'str'})
+    mapping = load_activitytosector_crosswalk(source)
+    return mapping
+
+
+@lru_cache(maxsize=None)
+def _read_activitytosector_lookup(source, sectorsourcename):
+    """
+    Subset the activity-to-sector mapping of a source to a sector source name
+    a single time per session
+    :param source: The data source name
+    :param sectorsourcename: A sector source name (ex. NAICS_2012_Code)
+    :return: df with columns 'ActivitySourceName', 'Activity', 'Sector', 'SectorType'
+    """
+    mapping = get_activitytosector_mapping(source)
+    # filter by SectorSourceName of interest
+    mapping = mapping[mapping['SectorSourceName'] == sectorsourcename]
+    # drop SectorSourceName
+    mapping = mapping.drop(columns=['SectorSourceName']).reset_index(drop=True)
     return mapping
 
 
@@ -80,11 +96,7 @@ def add_sectors_to_flowbyactivity(flowbyactivity_df, sectorsourcename=sector_sou
     else:
         # if source data activities are text strings, or sector-like
         # activities should be modified, call on the manually created source crosswalks
-        mapping = get_activitytosector_mapping(s)
-        # filter by SectorSourceName of interest
-        mapping = mapping[mapping['SectorSourceName'] == sectorsourcename]
-        # drop SectorSourceName
-        mapping = mapping.drop(columns=['SectorSourceName'])
+        mapping = _read_activitytosector_lookup(s, sectorsourcename).copy()
         # Include all digits of naics in mapping, if levelofNAICSagg is specified as "aggregated"
         if levelofSectoragg == 'aggregated':
             mapping = expand_naics_list(mapping, sectorsourcename)
@@ -191,7 +203,7 @@ def get_fba_allocation_subset(fba_allocation, source, activitynames, **kwargs):
     if src_info['sector-like_activities'] is False:
         # read in source crosswalk
         df = get_activitytosector_mapping(source)
-        sec_source_name = df['SectorSourceName'].all()
+        sec_source_name = pd.unique(df['SectorSourceName'])[0]
         df = expand_naics_list(df, sec_source_name)
         # subset source crosswalk to only contain values pertaining to list of activity names
         df = df.loc[df['Activity'].isin(activitynames)]
@@ -260,6 +272,156 @@ def get_fba_allocation_subset(fba_allocation, source, activitynames, **kwargs):
     return fba_allocation_subset
 
 
+def get_fba_allocation_subset_by_activity(fba_allocation, source, activitynames, **kwargs):
+    """
+    Subset the fba allocation data for each activity in a list of activity names at once.
+    Equivalent to calling get_fba_allocation_subset() for each activity name and
+    concatenating the results, but the source crosswalk is only loaded and matched once.
+    :param fba_allocation: fba allocation df with sectors
+    :param source: name of the FBA source being allocated
+    :param activitynames: list of activity names
+    :param kwargs: can be the mapping file, method of allocation, and activity set names
+    :return: df of the fba allocation subset, where column 'FBA_Activity' identifies the
+             activity name each row is subset for. Rows can repeat for multiple activities.
+    """
+    subset_by_sector_cols = False
+    asn = None
+    if 'flowSubsetMapped' in kwargs:
+        fsm = kwargs['flowSubsetMapped']
+    if kwargs.get('allocMethod') == 'proportional-flagged':
+        subset_by_sector_cols = True
+    if kwargs.get('activity_set_names') is not None:
+        if 'allocation_subset_col' in kwargs['activity_set_names']:
+            asn = kwargs['activity_set_names']
+
+    # create a df of the sectors associated with each activity name
+    cat = load_source_catalog()
+    src_info = cat[source]
+    if src_info['sector-like_activities'] is False:
+        # read in source crosswalk
+        cw = get_activitytosector_mapping(source)
+        sec_source_name = pd.unique(cw['SectorSourceName'])[0]
+        cw = expand_naics_list(cw, sec_source_name)
+        activity_sectors = cw.loc[cw['Activity'].isin(activitynames), ['Activity', 'Sector']]
+    elif subset_by_sector_cols and 'Sector' not in fba_allocation:
+        # if it is a special case, then base the subset of data on
+        # sectors in the sector columns, not on activitynames
+        activity_sectors = pd.concat(
+            [fsm[[a, s]].set_axis(['Activity', 'Sector'], axis=1)
+             for a in fba_activity_fields for s in ['SectorConsumedBy', 'SectorProducedBy']],
+            ignore_index=True)
+        activity_sectors = activity_sectors[(activity_sectors['Activity'].isin(activitynames)) &
+                                            (activity_sectors['Sector'].notnull())]
+    else:
+        activity_sectors = pd.DataFrame({'Activity': activitynames, 'Sector': activitynames})
+    activity_sectors = activity_sectors.rename(columns={'Activity': 'FBA_Activity',
+                                                        'Sector': 'Sector_tmp'}).drop_duplicates()
+
+    # tag the rows of the fba allocation table with each activity that has an
+    # overlapping sector, keeping a row once per activity
+    sector_cols = ['Sector'] if 'Sector' in fba_allocation else fbs_activity_fields
+    df = fba_allocation.assign(Row_tmp=np.arange(len(fba_allocation)))
+    fba_allocation_subset = pd.concat(
+        [df.merge(activity_sectors, left_on=c, right_on='Sector_tmp') for c in sector_cols],
+        ignore_index=True)
+    fba_allocation_subset = fba_allocation_subset.drop_duplicates(subset=['FBA_Activity', 'Row_tmp'])
+    # order rows by activity name, retaining the row order of the fba allocation table
+    fba_allocation_subset = fba_allocation_subset.assign(
+        FBA_Activity=pd.Categorical(fba_allocation_subset['FBA_Activity'],
+                                    categories=pd.unique(pd.Series(activitynames))))
+    fba_allocation_subset = fba_allocation_subset.sort_values(['FBA_Activity', 'Row_tmp'])
+    fba_allocation_subset = fba_allocation_subset.assign(
+        FBA_Activity=fba_allocation_subset['FBA_Activity'].astype(str))
+    fba_allocation_subset = fba_allocation_subset.drop(
+        columns=['Sector_tmp', 'Row_tmp']).reset_index(drop=True)
+
+    # if activity set names included in function call and activity set names is not null, \
+    # then subset data based on value and column specified for each activity
+    if asn is not None:
+        asn_subset = asn[asn['name'].isin(activitynames)]
+        # activities without a value to subset on are not subset further
+        na_names = asn_subset.loc[asn_subset['allocation_subset'].isna(), 'name']
+        if asn_subset.loc[asn_subset['allocation_subset'].notnull(), 'name'].isin(na_names).any():
+            log.error('Define column and value to subset on in the activity set csv for all rows')
+        asn_subset = asn_subset[~asn_subset['name'].isin(na_names)].drop_duplicates(subset='name')
+        for col_to_subset, asn_col in asn_subset.groupby('allocation_subset_col'):
+            val_to_subset = fba_allocation_subset['FBA_Activity'].map(
+                dict(zip(asn_col['name'], asn_col['allocation_subset'])))
+            log.debug('Subset the allocation dataset where ' + str(col_to_subset) +
+                      ' = ' + ', '.join(asn_col['allocation_subset'].astype(str).unique()))
+            fba_allocation_subset = fba_allocation_subset[
+                val_to_subset.isnull() |
+                (fba_allocation_subset[col_to_subset] == val_to_subset)].reset_index(drop=True)
+
+    return fba_allocation_subset
+
+
+# fields of a fedelemflowlist flow mapping used to map flows
+flowmapping_fields = ["SourceListName",
+                      "SourceFlowName",
+                      "SourceFlowContext",
+                      "SourceUnit",
+                      "ConversionFactor",
+                      "TargetFlowName",
+                      "TargetFlowContext",
+                      "TargetUnit"]
+
+
+def encode_flow_keys(flowable, context, flowable_index, context_index):
+    """
+    Encode (flowable, context) pairs as a single integer key, based on the
+    flowables and contexts in a flow mapping. Pairs that contain a value not
+    found in the mapping never share a key with a mapped pair.
+    :param flowable: series of flowables
+    :param context: series of contexts
+    :param flowable_index: index of flowables in a flow mapping
+    :param context_index: index of contexts in a flow mapping
+    :return: array of integer keys
+    """
+    codes = []
+    for values, index in ((flowable, flowable_index), (context, context_index)):
+        c = index.get_indexer(values)
+        # null values match null values, as in a merge, while values not in the mapping are -1
+        c = np.where(pd.isnull(values), len(index), c)
+        codes.append(c.astype(np.int64))
+    return codes[0] * (len(context_index) + 2) + codes[1]
+
+
+@lru_cache(maxsize=None)
+def _read_flowmapping(from_fba_source):
+    """
+    Load a fedelemflowlist flow mapping a single time per session, and encode
+    the source flow name and context as integer keys to join on
+    :param from_fba_source: str or tuple of source names of the flow mapping
+    :return: df of the flow mapping with column 'FlowKey', index of flowables, index of contexts
+    """
+    from fedelemflowlist import get_flowmapping
+
+    if isinstance(from_fba_source, tuple):
+        from_fba_source = list(from_fba_source)
+    flowmapping = get_flowmapping(from_fba_source)
+
+    return encode_flowmapping(flowmapping)
+
+
+def encode_flowmapping(flowmapping):
+    """
+    Encode the source flow name and context of a flow mapping as integer keys to join on
+    :param flowmapping: df, fedelemflowlist flow mapping
+    :return: df of the flow mapping with column 'FlowKey', index of flowables, index of contexts
+    """
+    if flowmapping.empty:
+        return flowmapping, None, None
+    flowmapping = flowmapping[flowmapping_fields].reset_index(drop=True)
+    flowable_index = pd.Index(flowmapping['SourceFlowName'].dropna().unique())
+    context_index = pd.Index(flowmapping['SourceFlowContext'].dropna().unique())
+    flowmapping = flowmapping.assign(FlowKey=encode_flow_keys(
+        flowmapping['SourceFlowName'], flowmapping['SourceFlowContext'],
+        flowable_index, context_index))
+
+    return flowmapping, flowable_index, context_index
+
+
 def map_elementary_flows(fba, from_fba_source, keep_unmapped_rows=False):
     """
     Applies mapping from fedelemflowlist to convert flows to fedelemflowlist flows
@@ -269,50 +431,41 @@ def map_elementary_flows(fba, from_fba_source, keep_unmapped_rows=False):
     :return:
     """
 
-    from fedelemflowlist import get_flowmapping
-
     # rename columns to match FBS formatting
     fba = fba.rename(columns={"FlowName": 'Flowable',
                               "Compartment": "Context"})
 
-    flowmapping = get_flowmapping(from_fba_source)
-    mapping_fields = ["SourceListName",
-                      "SourceFlowName",
-                      "SourceFlowContext",
-                      "SourceUnit",
-                      "ConversionFactor",
-                      "TargetFlowName",
-                      "TargetFlowContext",
-                      "TargetUnit"]
+    if not isinstance(from_fba_source, str):
+        from_fba_source = tuple(from_fba_source)
+    flowmapping, flowable_index, context_index = _read_flowmapping(from_fba_source)
     if flowmapping.empty:
         log.warning("No mapping file in fedelemflowlist found for " + ' '.join(from_fba_source))
         # return the original df but with columns renamed so can continue working on the FBS
         fba_mapped_df = fba.copy()
     else:
-        flowmapping = flowmapping[mapping_fields]
-
         # define merge type based on keeping or dropping unmapped data
         if keep_unmapped_rows is False:
             merge_type = 'inner'
         else:
             merge_type = 'left'
 
-        # merge fba with flows
-        fba_mapped_df = pd.merge(fba, flowmapping,
-                                 left_on=["Flowable", "Context"],
-                                 right_on=["SourceFlowName", "SourceFlowContext"],
-                                 how=merge_type)
-        fba_mapped_df.loc[fba_mapped_df["TargetFlowName"].notnull(), "Flowable"] =\
-            fba_mapped_df["TargetFlowName"]
-        fba_mapped_df.loc[fba_mapped_df["TargetFlowName"].notnull(), "Context"] =\
-            fba_mapped_df["TargetFlowContext"]
-        fba_mapped_df.loc[fba_mapped_df["TargetFlowName"].notnull(), "Unit"] =\
-            fba_mapped_df["TargetUnit"]
-        fba_mapped_df.loc[fba_mapped_df["TargetFlowName"].notnull(), "FlowAmount"] = \
-            fba_mapped_df["FlowAmount"] * fba_mapped_df["ConversionFactor"]
+        # merge fba with flows on the encoded flowable and context
+        fba_keys = encode_flow_keys(fba['Flowable'], fba['Context'], flowable_index, context_index)
+        fba_mapped_df = pd.merge(fba.assign(FlowKey=fba_keys),
+                                 flowmapping[['FlowKey', 'ConversionFactor', 'TargetFlowName',
+                                              'TargetFlowContext', 'TargetUnit']],
+                                 on='FlowKey', how=merge_type)
+        mapped = fba_mapped_df["TargetFlowName"].notnull()
+        fba_mapped_df = fba_mapped_df.assign(
+            Flowable=fba_mapped_df['TargetFlowName'].where(mapped, fba_mapped_df['Flowable']),
+            Context=fba_mapped_df['TargetFlowContext'].where(mapped, fba_mapped_df['Context']),
+            Unit=fba_mapped_df['TargetUnit'].where(mapped, fba_mapped_df['Unit']),
+            FlowAmount=(fba_mapped_df['FlowAmount'] *
+                        fba_mapped_df['ConversionFactor']).where(mapped, fba_mapped_df['FlowAmount']))
 
         # drop
-        fba_mapped_df = fba_mapped_df.drop(columns=mapping_fields)
+        fba_mapped_df = fba_mapped_df.drop(columns=['FlowKey', 'ConversionFactor', 'TargetFlowName',
+                                                    'TargetFlowContext', 'TargetUnit'])
 
     return fba_mapped_df
 
@@ -0,0 +1,119 @@
+# registry.py (flowsa)
+# !/usr/bin/env python3
+# coding=utf-8
+"""
+Registry of the data source functions named in the FlowByActivity and FlowBySector
+method yamls. Each data_source_scripts module is listed with the url helper, call,
+parse, clean, and allocation functions it defines, and a module is only imported
+when one of its functions is first called on, so runs only import the modules of
+the data sources used.
+
+Functions defined outside of flowsa are added with register_function():
+    register_function('my_fba_cleanup', my_fba_cleanup)
+after which 'my_fba_cleanup' can be named in a method yaml.
+"""
+
+import importlib
+
+# functions named in method yamls, by the data_source_scripts module defining them
+source_functions = {
+    'BEA': ['bea_gdp_parse', 'bea_make_ar_parse', 'bea_make_detail_br_parse',
+            'bea_use_detail_br_parse', 'subset_BEA_Use'],
+    'BLM_PLS': ['blm_pls_URL_helper', 'blm_pls_call', 'blm_pls_parse'],
+    'BLS_QCEW': ['BLS_QCEW_URL_helper', 'bls_qcew_call', 'bls_qcew_parse', 'clean_bls_qcew_fba',
+                 'clean_bls_qcew_fba_for_employment_sat_table',
+                 'bls_clean_allocation_fba_w_sec'],
+    'Blackhurst_IO': ['bh_call', 'bh_parse', 'convert_blackhurst_data_to_gal_per_year',
+                      'convert_blackhurst_data_to_gal_per_employee',
+                      'scale_blackhurst_results_to_usgs_values'],
+    'CalRecycle_WasteCharacterization': ['calR_parse'],
+    'Census_AHS': ['ahs_url_helper', 'ahs_call', 'ahs_parse'],
+    'Census_CBP': ['Census_CBP_URL_helper', 'census_cbp_call', 'census_cbp_parse'],
+    'Census_PEP_Population': ['Census_pop_URL_helper', 'census_pop_call', 'census_pop_parse'],
+    'EIA_CBECS_Land': ['eia_cbecs_land_URL_helper', 'eia_cbecs_land_call',
+                       'eia_cbecs_land_parse', 'cbecs_land_fba_cleanup'],
+    'EIA_CBECS_Water': ['eia_cbecs_water_call', 'eia_cbecs_water_parse'],
+    'EIA_MECS': ['eia_mecs_URL_helper', 'eia_mecs_land_call', 'eia_mecs_land_parse',
+                 'eia_mecs_energy_call', 'eia_mecs_energy_parse', 'mecs_energy_fba_cleanup',
+                 'eia_mecs_energy_clean_allocation_fba_w_sec', 'mecs_land_fba_cleanup',
+                 'mecs_land_fba_cleanup_for_land_2012_fbs',
+                 'mecs_land_clean_allocation_mapped_fba_w_sec'],
+    'EIA_MER': ['eia_mer_url_helper', 'eia_mer_call', 'eia_mer_parse'],
+    'EPA_GHGI': ['ghg_url_helper', 'ghg_call', 'ghg_parse'],
+    'EPA_NEI': ['epa_nei_url_helper', 'epa_nei_call', 'epa_nei_onroad_parse',
+                'epa_nei_nonroad_parse', 'epa_nei_nonpoint_parse', 'clean_NEI_fba',
+                'clean_NEI_fba_no_pesticides'],
+    'NOAA_FisheryLandings': ['noaa_parse'],
+    'StatCan_GDP': ['sc_gdp_call', 'sc_gdp_parse'],
+    'StatCan_IWS_MI': ['sc_call', 'sc_parse', 'convert_statcan_data_to_US_water_use'],
+    'StatCan_LFS': ['sc_lfs_call', 'sc_lfs_parse'],
+    'stewiFBS': ['stewicombo_to_sector', 'stewi_to_sector'],
+    'USDA_CoA_Cropland': ['CoA_Cropland_URL_helper', 'coa_cropland_call', 'coa_cropland_parse',
+                          'disaggregate_coa_cropland_to_6_digit_naics',
+                          'coa_irrigated_cropland_fba_cleanup',
+                          'coa_nonirrigated_cropland_fba_cleanup'],
+    'USDA_CoA_Cropland_NAICS': ['CoA_Cropland_NAICS_URL_helper', 'coa_cropland_NAICS_call',
+                                'coa_cropland_NAICS_parse',
+                                'coa_cropland_naics_fba_wsec_cleanup'],
+    'USDA_CoA_Livestock': ['CoA_Livestock_URL_helper', 'coa_livestock_call',
+                           'coa_livestock_parse'],
+    'USDA_ERS_FIWS': ['fiws_call', 'fiws_parse'],
+    'USDA_ERS_MLU': ['mlu_call', 'mlu_parse', 'allocate_usda_ers_mlu_land_in_urban_areas',
+                     'allocate_usda_ers_mlu_other_land',
+                     'allocate_usda_ers_mlu_land_in_rural_transportation_areas'],
+    'USDA_IWMS': ['iwms_url_helper', 'iwms_call', 'iwms_parse',
+                  'disaggregate_iwms_to_6_digit_naics'],
+    'USGS_MYB_SodaAsh': ['soda_url_helper', 'soda_call', 'soda_parse'],
+    'USGS_NWIS_WU': ['usgs_URL_helper', 'usgs_call', 'usgs_parse', 'usgs_fba_data_cleanup',
+                     'usgs_fba_w_sectors_data_cleanup'],
+    'USGS_WU_Coef': ['usgs_coef_parse'],
+}
+
+# module of each function
+_function_modules = {fxn: module for module, fxns in source_functions.items() for fxn in fxns}
+# functions registered or imported, by name
+_functions = {}
+
+
+def register_function(name, fxn):
+    """
+    Register a function to call on when a method yaml names the function, replacing any
+    function registered with the same name
+    :param name: str, function name used in method yamls
+    :param fxn: function
+    """
+    _functions[name] = fxn
+
+
+def unregister_function(name):
+    """
+    Remove a function added with register_function(), so functions of flowsa data
+    sources are imported from data_source_scripts again
+    :param name: str, function name used in method yamls
+    """
+    _functions.pop(name, None)
+
+
+def is_registered(name):
+    """
+    :param name: str, function name used in method yamls
+    :return: bool, True if the function is registered or defined by a data source module
+    """
+    return name in _functions or name in _function_modules
+
+
+def get_function(name):
+    """
+    Get a function named in a method yaml, importing the data_source_scripts module
+    defining the function on first use
+    :param name: str, function name used in method yamls
+    :return: function
+    """
+    if name not in _functions:
+        if name not in _function_modules:
+            raise KeyError(name + ' is not a registered data source function, add the '
+                                  'function to flowsa.registry.source_functions or call '
+                                  'register_function()')
+        module = importlib.import_module('flowsa.data_source_scripts.' + _function_modules[name])
+        _functions[name] = getattr(module, name)
+    return _functions[name]
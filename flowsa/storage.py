@@ -0,0 +1,307 @@
+# storage.py (flowsa)
+# !/usr/bin/env python3
+# coding=utf-8
+"""
+Read FlowByActivity parquet files with only the columns and rows requested. Filters on
+Class, geographic level, activities, and flow names are passed to the pyarrow reader,
+which skips row groups using the column statistics and only converts matching rows to
+pandas, instead of loading the whole FBA and subsetting the df.
+
+FBAs are saved either as a single parquet file per source and year ('file' layout), or
+to a hive-partitioned dataset ('partitioned' layout) of
+    FlowByActivityDataset/source=<source>/year=<year>/class=<Class>/geoscale=<level>/
+so loads of a Class, geoscale, or range of years only open the matching folders:
+    python -m flowsa.flowbyactivity -s BLS_QCEW -y 2010-2018 -l partitioned
+FBA files saved in the 'file' layout are copied to the dataset with
+    python -m flowsa.storage -s BLS_QCEW
+"""
+
+import os
+import re
+import shutil
+import argparse
+import pandas as pd
+from esupy.processed_data_mgmt import find_file
+from flowsa.common import paths, US_FIPS, get_fips_codes, int_to_fips, log, fbaoutputpath, \
+    flow_by_activity_fields, configure_logging
+
+fba_layouts = ['file', 'partitioned']
+
+# root folder of the partitioned FBA dataset
+fba_dataset_path = os.path.join(paths.local_path, 'FlowByActivityDataset')
+
+# partition keys of the FBA dataset, named apart from the FBA columns
+partition_keys = ['source', 'year', 'class', 'geoscale']
+
+# names of the geoscale levels returned by geoscale_level()
+geoscale_names = ['national', 'state', 'county', 'other']
+
+# rows per row group of FBA parquet files
+fba_row_group_size = 100000
+
+
+def geoscale_level(location):
+    """
+    Order of the geoscale of FIPS Locations, used to sort FBAs so that each
+    row group holds a single geoscale
+    :param location: series of 5 digit FIPS strings
+    :return: series, 0 for national, 1 for state, 2 for county, 3 for other Locations
+    """
+    level = pd.Series(3, index=location.index)
+    level[location.str.fullmatch(r'\d{5}').fillna(False).astype(bool)] = 2
+    level[(level == 2) & location.str.endswith('000')] = 1
+    level[location == US_FIPS] = 0
+    return level
+
+
+def sort_fba(df):
+    """
+    Sort an FBA by the columns filtered on load, so the min/max statistics of each
+    row group of the parquet are selective
+    :param df: FlowByActivity df
+    :return: sorted FlowByActivity df
+    """
+    return df.assign(GeoscaleLevel=geoscale_level(df['Location'])).sort_values(
+        ['Class', 'GeoscaleLevel', 'Location', 'ActivityProducedBy', 'ActivityConsumedBy',
+         'FlowName', 'Compartment']).drop(columns='GeoscaleLevel').reset_index(drop=True)
+
+
+def fba_filters(flowclass=None, geographic_level=None, activities=None, flownames=None):
+    """
+    Build pyarrow filters selecting FBA rows
+    :param flowclass: str, a 'Class' of the flow
+    :param geographic_level: str, 'national', 'state', or 'county'
+    :param activities: list, activities matched to ActivityProducedBy or ActivityConsumedBy
+    :param flownames: list, FlowNames
+    :return: list of lists of filter tuples, rows matching any list are kept,
+        None if there are no filters
+    """
+    conditions = []
+    if flowclass is not None:
+        conditions.append(('Class', '==', flowclass))
+    if geographic_level is not None:
+        fips = int_to_fips(pd.Series(get_fips_codes(geographic_level))).tolist()
+        conditions.append(('Location', 'in', fips))
+    if flownames is not None:
+        conditions.append(('FlowName', 'in', list(flownames)))
+    if activities is not None:
+        return [conditions + [(c, 'in', list(activities))]
+                for c in ['ActivityProducedBy', 'ActivityConsumedBy']]
+    if len(conditions) == 0:
+        return None
+    return [conditions]
+
+
+def read_fba_file(file, columns=None, filters=None):
+    """
+    Read an FBA parquet file, or a folder of parquet files
+    :param file: str, file path
+    :param columns: list, columns to load, defaults to all columns
+    :param filters: list, pyarrow filters returned by fba_filters()
+    :return: FlowByActivity df
+    """
+    # imported on use, to keep importing flowsa fast
+    import pyarrow.parquet as pq
+    table = pq.read_table(file, columns=columns, filters=filters)
+    return table.to_pandas().reset_index(drop=True)
+
+
+def load_fba_output(meta, columns=None, filters=None):
+    """
+    Load a locally stored FBA
+    :param meta: FileMeta of the FBA
+    :param columns: list, columns to load, defaults to all columns
+    :param filters: list, pyarrow filters returned by fba_filters()
+    :return: FlowByActivity df, None if the FBA is not stored locally
+    """
+    file = find_file(meta, paths)
+    if not file or not os.path.exists(file):
+        return None
+    log.debug('Reading ' + file)
+    return read_fba_file(file, columns, filters)
+
+
+def fba_schema():
+    """
+    Parquet schema of the FBA fields, so the files of each partition of the FBA
+    dataset share column types
+    :return: pyarrow schema
+    """
+    import pyarrow as pa
+    types = {'str': pa.string(), 'float': pa.float64(), 'int': pa.int64()}
+    return pa.schema([(k, types[v[0]['dtype']]) for k, v in flow_by_activity_fields.items()])
+
+
+def fba_table(df):
+    """
+    Convert an FBA to a pyarrow table with the FBA schema
+    :param df: FlowByActivity df
+    :return: pyarrow table
+    """
+    import pyarrow as pa
+    schema = fba_schema()
+    return pa.Table.from_pandas(df.reindex(columns=schema.names), schema=schema,
+                                preserve_index=False)
+
+
+def write_fba_file(df, paths, meta):
+    """
+    Save an FBA as a parquet file in the local FlowByActivity folder, in row groups of
+    fba_row_group_size rows with column statistics, so filtered loads skip row groups
+    :param df: FlowByActivity df, sorted by sort_fba()
+    :param paths: Paths of the local flowsa folder
+    :param meta: FileMeta of the FBA
+    :return: str, file path
+    """
+    import pyarrow.parquet as pq
+    folder = os.path.join(paths.local_path, meta.category)
+    os.makedirs(folder, exist_ok=True)
+    file = os.path.join(folder, meta.name_data + '.' + meta.ext)
+    pq.write_table(fba_table(df), file, row_group_size=fba_row_group_size)
+    return file
+
+
+def dataset_folder(source, year=None, root=None):
+    """
+    :param source: str, data source name
+    :param year: str, year
+    :param root: str, root folder of the FBA dataset
+    :return: str, folder of a source, or of a source and year, in the FBA dataset
+    """
+    folder = os.path.join(root or fba_dataset_path, 'source=' + source)
+    if year is not None:
+        folder = os.path.join(folder, 'year=' + str(year))
+    return folder
+
+
+def dataset_years(source, root=None):
+    """
+    Years of a data source saved to the FBA dataset
+    :param source: str, data source name
+    :param root: str, root folder of the FBA dataset
+    :return: list of int years
+    """
+    folder = dataset_folder(source, root=root)
+    if not os.path.isdir(folder):
+        return []
+    return sorted(int(f[len('year='):]) for f in os.listdir(folder) if f.startswith('year='))
+
+
+def write_fba_dataset(df, source, year, root=None):
+    """
+    Save an FBA to the FBA dataset, replacing any data saved for the source and year,
+    with one parquet file for each Class and geoscale
+    :param df: FlowByActivity df, with the columns of flow_by_activity_fields
+    :param source: str, data source name
+    :param year: str, year
+    :param root: str, root folder of the FBA dataset
+    :return: str, folder of the source and year
+    """
+    import pyarrow.parquet as pq
+    folder = dataset_folder(source, year, root)
+    # write to a temporary folder and swap it into place, so readers never see a
+    # partially written year. Folders starting with '.' are skipped by dataset_years()
+    # and the pyarrow reader
+    parent, name = os.path.split(folder)
+    tmp = os.path.join(parent, '.' + name + '.' + str(os.getpid()) + '.tmp')
+    old = os.path.join(parent, '.' + name + '.' + str(os.getpid()) + '.old')
+    shutil.rmtree(tmp, ignore_errors=True)
+    try:
+        df = sort_fba(df)
+        level = geoscale_level(df['Location']).map(dict(enumerate(geoscale_names)))
+        for (flowclass, geoscale), group in df.groupby([df['Class'], level], sort=False):
+            path = os.path.join(tmp, 'class=' + flowclass, 'geoscale=' + geoscale)
+            os.makedirs(path, exist_ok=True)
+            pq.write_table(fba_table(group), os.path.join(path, 'part-0.parquet'),
+                           row_group_size=fba_row_group_size)
+        os.makedirs(tmp, exist_ok=True)
+        # a folder can only replace an empty folder, so move the previous year aside first
+        if os.path.exists(folder):
+            os.replace(folder, old)
+        os.replace(tmp, folder)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+        shutil.rmtree(old, ignore_errors=True)
+    return folder
+
+
+def partition_filters(filters, years):
+    """
+    Add conditions on the partition keys of the FBA dataset to filters on Class and
+    Location, so only the partitions holding matching rows are read
+    :param filters: list, pyarrow filters returned by fba_filters()
+    :param years: list, years to load
+    :return: list of lists of filter tuples
+    """
+    conditions = [('year', 'in', [int(y) for y in years])]
+    dnf = []
+    for conjunction in filters or [[]]:
+        keys = []
+        for col, op, value in conjunction:
+            if col == 'Class':
+                keys.append(('class', op, value))
+            elif col == 'Location':
+                levels = geoscale_level(pd.Series(value, dtype=object)).unique()
+                keys.append(('geoscale', 'in', [geoscale_names[l] for l in levels]))
+        dnf.append(list(conjunction) + conditions + keys)
+    return dnf
+
+
+def load_fba_dataset(source, years, columns=None, filters=None, root=None):
+    """
+    Load years of a data source from the FBA dataset
+    :param source: str, data source name
+    :param years: list, years saved to the FBA dataset
+    :param columns: list, columns to load, defaults to all columns
+    :param filters: list, pyarrow filters returned by fba_filters()
+    :param root: str, root folder of the FBA dataset
+    :return: FlowByActivity df
+    """
+    import pyarrow.parquet as pq
+    table = pq.read_table(dataset_folder(source, root=root), columns=columns,
+                          filters=partition_filters(filters, years), partitioning='hive')
+    table = table.drop([k for k in partition_keys if k in table.column_names])
+    return table.to_pandas().reset_index(drop=True)
+
+
+def migrate_fba_files(sources=None, folder=None, root=None):
+    """
+    Copy FBAs saved in the 'file' layout to the FBA dataset, using the most recent
+    file of each source and year. The FBA files are not removed
+    :param sources: list, data source names, defaults to all sources
+    :param folder: str, folder of the FBA files, defaults to the local FlowByActivity folder
+    :param root: str, root folder of the FBA dataset
+    :return: df, source, year, file, and rows of each FBA copied
+    """
+    folder = folder or fbaoutputpath
+    files = {}
+    for f in sorted(os.listdir(folder) if os.path.isdir(folder) else [], key=lambda f: os.path.getmtime(os.path.join(folder, f))):
+        match = re.match(r'(?P<source>.+)_(?P<year>\d{4})(_v.*)?\.parquet$', f)
+        if match is None or (sources is not None and match['source'] not in sources):
+            continue
+        files[(match['source'], match['year'])] = f
+    migrated = []
+    for (source, year), f in sorted(files.items()):
+        df = pd.read_parquet(os.path.join(folder, f))
+        write_fba_dataset(df, source, year, root)
+        log.info('Copied ' + f + ' to ' + dataset_folder(source, year, root))
+        migrated.append({'Source': source, 'Year': int(year), 'File': f, 'Rows': len(df)})
+    return pd.DataFrame(migrated, columns=['Source', 'Year', 'File', 'Rows'])
+
+
+def parse_args():
+    """Make source and folder parameters"""
+    ap = argparse.ArgumentParser(description='Copy FBA files to the partitioned FBA dataset')
+    ap.add_argument('-s', '--source', nargs='*', default=None,
+                    help='Data source names, defaults to all FBA files')
+    ap.add_argument('-f', '--folder', default=None,
+                    help='Folder of the FBA files, defaults to the local FlowByActivity folder')
+    ap.add_argument('-d', '--dataset', default=None,
+                    help='Root folder of the FBA dataset, defaults to ' + fba_dataset_path)
+    return ap.parse_args()
+
+
+if __name__ == '__main__':
+    configure_logging()
+    args = parse_args()
+    print(migrate_fba_files(args.source, args.folder, args.dataset).to_string(index=False))
@@ -0,0 +1,182 @@
+# validation.py (flowsa)
+# !/usr/bin/env python3
+# coding=utf-8
+"""
+Run the datachecks of a FlowBySector build at a validation level:
+    'off': skip the datachecks
+    'fast': run the datachecks that only aggregate the activity set subsets, skipping
+        compare_fba_load_and_fbs_output_totals(), which maps and aggregates the FBA again
+    'full': run all datachecks on a background worker, so the checks do not block
+        the FBS build
+Results of the datachecks of a run are collected into one validation report, and the
+comparison dfs returned by the datachecks for all activity sets are saved to a single
+parquet file per method.
+"""
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+from flowsa.common import log, outputpath
+
+validation_levels = ['off', 'fast', 'full']
+
+# datachecks run at the 'fast' validation level
+fast_checks = ['compare_geographic_totals', 'check_allocation_ratios',
+               'check_for_differences_between_fba_load_and_fbs_output']
+
+
+def snapshot(arg):
+    """
+    Copy dfs passed to a datacheck run in the background, so the check is not
+    affected by later changes to the df
+    :param arg: datacheck argument
+    :return: copy of a df, or the argument
+    """
+    if isinstance(arg, pd.DataFrame):
+        return arg.copy()
+    return arg
+
+
+class Validator:
+    """
+    Runs the datachecks of a FlowBySector build at a validation level and collects
+    the results. At the 'full' level, checks run in order on a single background
+    thread, from snapshots of the dfs taken when the check is submitted
+    """
+
+    def __init__(self, method_name, level='full'):
+        """
+        :param method_name: str, name of the FBS method yaml
+        :param level: str, 'off', 'fast', or 'full'
+        """
+        if level not in validation_levels:
+            raise ValueError('Validation level must be one of ' + ', '.join(validation_levels))
+        self.method_name = method_name
+        self.level = level
+        # list of the results of each check
+        self.records = []
+        # dictionary of (check, source, activity set) and the df returned by the check
+        self.results = {}
+        self._futures = []
+        self._executor = None
+
+    def runs(self, check):
+        """
+        :param check: str, name of the datacheck function
+        :return: bool, True if the check runs at the validation level
+        """
+        return self.level == 'full' or (self.level == 'fast' and check in fast_checks)
+
+    def _run(self, fxn, source, activity_set, args):
+        check = fxn.__name__
+        record = {'Check': check, 'Source': source, 'ActivitySet': activity_set,
+                  'Status': 'ok', 'Rows': None, 'Flagged': None, 'Error': None}
+        start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            result = fxn(*args)
+            self.results[(check, source, activity_set)] = result
+            if result is None:
+                record['Status'] = 'no comparison'
+            else:
+                record['Rows'] = len(result)
+                if isinstance(result, pd.DataFrame) and 'Flag' in result:
+                    record['Flagged'] = int(result['Flag'].sum())
+        except Exception as e:
+            log.warning(check + ' failed for ' + source + ' ' + str(activity_set) + ': ' +
+                        repr(e))
+            record['Status'] = 'error'
+            record['Error'] = repr(e)
+        record['WallTime'] = time.perf_counter() - start
+        record['CPUTime'] = time.thread_time() - cpu_start
+        self.records.append(record)
+
+    def submit(self, fxn, source, activity_set, *args):
+        """
+        Run a datacheck if it runs at the validation level, in the background at
+        the 'full' level
+        :param fxn: datacheck function
+        :param source: str, datasource name
+        :param activity_set: str, activity set name
+        :param args: arguments of the datacheck
+        """
+        if not self.runs(fxn.__name__):
+            return
+        if self.level == 'full':
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1,
+                                                    thread_name_prefix='flowsa-validation')
+            self._futures.append(self._executor.submit(
+                self._run, fxn, source, activity_set, [snapshot(a) for a in args]))
+        else:
+            self._run(fxn, source, activity_set, args)
+
+    def wait(self):
+        """
+        Wait for the datachecks running in the background to finish
+        :return: df, validation report
+        """
+        for f in self._futures:
+            f.result()
+        self._futures = []
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+        return self.to_df()
+
+    def to_df(self):
+        """
+        Convert the check records to a df
+        :return: df, one row per check, in the order checks finish
+        """
+        return pd.DataFrame(self.records, columns=['Check', 'Source', 'ActivitySet', 'Status',
+                                                   'Rows', 'Flagged', 'WallTime', 'CPUTime',
+                                                   'Error'])
+
+    def results_df(self):
+        """
+        Combine the comparison dfs returned by the datachecks, with the union of the
+        columns of each check
+        :return: df, one row per compared value, labeled by check, source, and activity set
+        """
+        dfs = [df.assign(Check=check, Source=source, ActivitySet=activity_set)
+               for (check, source, activity_set), df in self.results.items()
+               if isinstance(df, pd.DataFrame) and len(df) > 0]
+        if len(dfs) == 0:
+            return pd.DataFrame(columns=['Check', 'Source', 'ActivitySet'])
+        df = pd.concat(dfs, ignore_index=True, sort=False)
+        df = df[['Check', 'Source', 'ActivitySet'] +
+                [c for c in df.columns if c not in ['Check', 'Source', 'ActivitySet']]]
+        # columns with different types across checks, such as Year, are saved as strings
+        for c in df.columns[df.dtypes == object]:
+            if pd.api.types.infer_dtype(df[c], skipna=True).startswith('mixed'):
+                df[c] = df[c].where(df[c].isnull(), df[c].astype(str))
+        return df
+
+    def write(self, path=None, results_path=None):
+        """
+        Wait for the datachecks and save the validation report as a csv, and the
+        datacheck results of all activity sets as one parquet file
+        :param path: str, optional file path, defaults to the FlowBySectorMethodAnalysis folder
+        :param results_path: str, optional file path of the datacheck results,
+            defaults to the folder of the validation report
+        :return: str, file path of the validation report
+        """
+        df = self.wait()
+        if path is None:
+            os.makedirs(outputpath + 'FlowBySectorMethodAnalysis', exist_ok=True)
+            path = outputpath + 'FlowBySectorMethodAnalysis/' + self.method_name + \
+                '_validation_report.csv'
+        if results_path is None:
+            results_path = os.path.join(os.path.dirname(path),
+                                        self.method_name + '_datachecks.parquet')
+        df.to_csv(path, index=False)
+        results = self.results_df()
+        results.to_parquet(results_path, engine='pyarrow', index=False)
+        errors = (df['Status'] == 'error').sum()
+        log.info('Saved validation report of ' + str(len(df)) + ' datachecks to ' + path +
+                 ' and ' + str(len(results)) + ' rows of datacheck results to ' +
+                 results_path + ('' if errors == 0 else ', ' + str(errors) +
+                                 ' datachecks failed'))
+        return path
@@ -0,0 +1,18 @@
+# write_crosswalk_store.py (scripts)
+# !/usr/bin/env python3
+# coding=utf-8
+
+"""
+Compiles the activity-to-sector crosswalks in 'data/activitytosectormapping', the NAICS year
+crosswalk, and the NAICS length crosswalk into parquet files in the local flowsa 'Crosswalks'
+folder. flowsa compiles the store on first use and whenever a csv is newer than the store, this
+script forces a rebuild.
+
+- Writes parquet files to crosswalkoutputpath.
+"""
+
+from flowsa.common import compile_crosswalk_store
+
+
+if __name__ == '__main__':
+    compile_crosswalk_store()
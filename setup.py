@@ -16,7 +16,7 @@ setup(
         'setuptools>=41',
         'pyyaml>=5.3',
         'ruamel.yaml>=0.16.13',
-        'pyarrow>=0.15',
+        'pyarrow>=1.0.0',
         'requests>=2.22.0',
         'appdirs>=1.4.3',
         'pycountry>=19.8.18',
@@ -24,6 +24,7 @@ setup(
         'requests_ftp==0.3.1',
         'tabula-py>=2.1.1',
         'numpy<1.20',
+        'scipy>=1.5.0',
         'bibtexparser>=1.2.0'
     ],
     url='https://github.com/USEPA/FLOWSA',
@@ -6,7 +6,8 @@
 """Add docstring in public module."""  # TODO add docstring.
 
 import unittest
-from flowsa.common import getFIPS
+import pandas as pd
+from flowsa.common import getFIPS, get_fips_level, update_geoscale
 
 
 class TestFIPS(unittest.TestCase):
@@ -33,3 +34,14 @@ class TestFIPS(unittest.TestCase):
         state = "IOWA"
         county = "Dubuque"
         self.assertEqual(getFIPS(state=state, county=county), "19061")
+
+    def test_fips_level(self):
+        """Geoscale of FIPS codes is determined from the integer code."""
+        locations = pd.Series(["00000", "19000", "19061"])
+        self.assertEqual(["national", "state", "county"], list(get_fips_level(locations)))
+
+    def test_update_geoscale_to_state(self):
+        """County FIPS roll up to zero-padded state FIPS."""
+        df = pd.DataFrame({"Location": ["19061", "01001", "13000"]})
+        df = update_geoscale(df, "state")
+        self.assertEqual(["19000", "01000", "13000"], df["Location"].tolist())
@@ -0,0 +1,181 @@
+# test_allocation.py (tests)
+# !/usr/bin/env python3
+# coding=utf-8
+
+""" Tests of allocating flows to sectors with allocation ratios """
+import unittest
+import numpy as np
+import pandas as pd
+from flowsa.common import flow_by_activity_wsec_mapped_fields, fba_mapped_default_grouping_fields, \
+    create_fill_na_dict, fba_activity_fields, fbs_activity_fields, flow_by_sector_fields_w_activity
+from flowsa.datachecks import check_if_losing_sector_data
+from flowsa.dataclean import clean_df
+from flowsa.flowbyfunctions import allocate_by_ratio_matrix, allocate_by_sector
+from flowsa.fbs_allocation import helper_allocation_key, direct_allocation_method
+from flowsa.mapping import get_fba_allocation_subset, get_fba_allocation_subset_by_activity
+
+
+def allocation_ratios_reference(fba_allocation, source, names, group_cols):
+    """
+    Create allocation ratios for each activity name in a loop, as dataset_allocation_method()
+    did before creating the ratios of all activity names at once, used to test the single pass
+    """
+    flow_alloc_list = []
+    for n in names:
+        fba_allocation_subset = get_fba_allocation_subset(fba_allocation, source, [n],
+                                                          allocMethod='proportional')
+        if len(fba_allocation_subset) != 0:
+            flow_alloc = allocate_by_sector(fba_allocation_subset, source, 'BLS_QCEW',
+                                            'proportional', group_cols)
+            flow_alloc_list.append(flow_alloc.assign(FBA_Activity=n))
+    return pd.concat(flow_alloc_list, ignore_index=True)
+
+
+def allocation_fba(sectors, locations=('01000', '02000'), seed=0):
+    """
+    Allocation FBA with sectors, with random employment for each location and sector
+    """
+    rng = np.random.default_rng(seed)
+    fba = pd.DataFrame([(l, s) for l in locations for s in sectors],
+                       columns=['Location', 'SectorProducedBy'])
+    fba = fba.assign(FlowAmount=rng.random(len(fba)) * 100, Class='Employment',
+                     SourceName='BLS_QCEW', FlowName='Number of employees', Unit='p',
+                     FlowType='ELEMENTARY_FLOW', LocationSystem='FIPS_2015', Year=2015,
+                     ActivityProducedBy=fba['SectorProducedBy'], SectorSourceName='NAICS_2012_Code')
+    return clean_df(fba, flow_by_activity_wsec_mapped_fields,
+                    create_fill_na_dict(flow_by_activity_wsec_mapped_fields))
+
+
+def direct_allocation_reference(fbs, names, target_sector_level):
+    """
+    Check each activity name for sector data loss in a loop, as direct_allocation_method()
+    did before batching the activity names, used to test the batched check
+    """
+    activity_list = []
+    for n in names:
+        fbs_subset = fbs[(fbs[fba_activity_fields[0]] == n) |
+                         (fbs[fba_activity_fields[1]] == n)].reset_index(drop=True)
+        activity_list.append(check_if_losing_sector_data(fbs_subset, target_sector_level))
+    return pd.concat(activity_list, ignore_index=True)
+
+
+def allocate_by_merge_reference(df, flow_allocation):
+    """
+    Allocate flows by merging the allocation ratios on both activity/sector pairs, as the
+    merge engine of dataset_allocation_method() does, used to test the sparse engine
+    """
+    for a, s in zip(fba_activity_fields, fbs_activity_fields):
+        df = df.merge(flow_allocation[['Location', 'Sector', 'FlowAmountRatio', 'FBA_Activity']],
+                      left_on=['Location', s, a], right_on=['Location', 'Sector', 'FBA_Activity'],
+                      how='left')
+    df.loc[:, 'FlowAmountRatio'] = df['FlowAmountRatio_x'].fillna(df['FlowAmountRatio_y'])
+    df['FlowAmountRatio'] = df['FlowAmountRatio'].fillna(0)
+    fbs = df.dropna(subset=['Sector_x', 'Sector_y'], how='all').reset_index()
+    fbs.loc[:, 'FlowAmount'] = fbs['FlowAmount'] * fbs['FlowAmountRatio']
+    return fbs
+
+
+class TestAllocation(unittest.TestCase):
+
+    def test_allocation_ratios_by_activity(self):
+        # activity names of USGS_NWIS_WU that share sectors, '1122' is disaggregated to
+        # '11221' and '112210' within each activity, and 2 digit denominators are by activity
+        names = ['Irrigation', 'Irrigation Crop', 'Livestock', 'Irrigation Golf Courses']
+        fba = allocation_fba(['111110', '111120', '11121', '1113', '111310', '112111', '112112',
+                              '1122', '11251', '11291', '713910', '2111'])
+        group_cols = [e for e in fba_mapped_default_grouping_fields
+                      if e not in ('ActivityProducedBy', 'ActivityConsumedBy')]
+        expected = allocation_ratios_reference(fba, 'USGS_NWIS_WU', names, group_cols)
+        subset = get_fba_allocation_subset_by_activity(fba, 'USGS_NWIS_WU', names,
+                                                       allocMethod='proportional')
+        result = allocate_by_sector(subset, 'USGS_NWIS_WU', 'BLS_QCEW', 'proportional',
+                                    group_cols + ['FBA_Activity'])
+        keys = ['FBA_Activity', 'Location', 'SectorProducedBy']
+        expected = expected.sort_values(keys).reset_index(drop=True)
+        result = result.sort_values(keys).reset_index(drop=True)
+        self.assertEqual(expected[keys].values.tolist(), result[keys].values.tolist())
+        self.assertTrue(np.isclose(expected['FlowAmountRatio'], result['FlowAmountRatio']).all())
+        for n in ['Irrigation', 'Irrigation Crop', 'Livestock']:
+            self.assertIn('112210', result.loc[result['FBA_Activity'] == n,
+                                               'SectorProducedBy'].tolist())
+        # ratios of the 2 digit sectors sum to 1 within each activity and location
+        two_digit = result[result['SectorProducedBy'].str.len() == 2]
+        self.assertTrue(np.isclose(two_digit.groupby(['FBA_Activity', 'Location'])
+                                   ['FlowAmountRatio'].sum(), 1).all())
+
+    def test_allocate_by_ratio_matrix(self):
+        flow_allocation = pd.DataFrame({'Location': ['01000', '01000', '01000', '02000'],
+                                        'FBA_Activity': ['Mining', 'Mining', 'Domestic', 'Mining'],
+                                        'Sector': ['21', '22', '22', '21'],
+                                        'FlowAmountRatio': [0.25, 0.75, 1.0, np.nan]})
+        df = pd.DataFrame({'Location': ['01000', '01000', '01000', '02000', '02000'],
+                           'ActivityProducedBy': ['Mining', 'Mining', None, 'Mining', 'Mining'],
+                           'ActivityConsumedBy': [None, None, 'Domestic', None, None],
+                           'SectorProducedBy': ['21', '22', None, '21', '22'],
+                           'SectorConsumedBy': [None, None, '22', None, None],
+                           'FlowAmount': [8.0, 8.0, 4.0, 2.0, 2.0]})
+        fbs = allocate_by_ratio_matrix(df, flow_allocation)
+        # the last row has no allocation data, null ratios allocate 0
+        self.assertEqual([0, 1, 2, 3], fbs['index'].tolist())
+        self.assertEqual([2.0, 6.0, 4.0, 0.0], fbs['FlowAmount'].tolist())
+        merged = allocate_by_merge_reference(df.assign(Row=range(len(df))), flow_allocation)
+        self.assertEqual(merged['Row'].tolist(), fbs['index'].tolist())
+        self.assertEqual(merged['FlowAmount'].tolist(), fbs['FlowAmount'].tolist())
+
+        # a repeated (Location, FBA_Activity, Sector) ratio allocates a flow twice with the
+        # merge engine, and once with the summed ratios with the sparse engine
+        flow_allocation = pd.concat([flow_allocation, flow_allocation.iloc[[0]].assign(
+            FlowAmountRatio=0.5)], ignore_index=True)
+        fbs = allocate_by_ratio_matrix(df, flow_allocation)
+        merged = allocate_by_merge_reference(df.assign(Row=range(len(df))), flow_allocation)
+        self.assertEqual(5, len(merged))
+        self.assertEqual([0, 1, 2, 3], fbs['index'].tolist())
+        self.assertEqual([6.0, 6.0, 4.0, 0.0], fbs['FlowAmount'].tolist())
+        self.assertEqual(merged.groupby('Row')['FlowAmount'].sum().tolist(),
+                         fbs['FlowAmount'].tolist())
+
+    def test_direct_allocation_sector_loss(self):
+        # 'Irrigation' has data at '112' without 4 digit data in the activity, while
+        # 'Livestock' has data at '1121' and '1122' without 5 digit data at some locations
+        rows = [('Irrigation', '111', 1.0), ('Irrigation', '1111', 0.6), ('Irrigation', '11111', 0.6),
+                ('Irrigation', '111110', 0.6), ('Irrigation', '112', 2.0),
+                ('Irrigation Crop', '111', 3.0), ('Irrigation Crop', '111998', 3.0),
+                ('Livestock', '1121', 4.0), ('Livestock', '112111', 2.5),
+                ('Livestock', '1122', 5.0), ('Domestic', 'F01000', 6.0)]
+        fbs = pd.DataFrame([(a, s, f * m, l) for l, m in [('01000', 1), ('02000', 2)]
+                            for a, s, f in rows if l == '01000' or s != '112111'],
+                           columns=['ActivityConsumedBy', 'SectorConsumedBy', 'FlowAmount',
+                                    'Location'])
+        fbs = fbs.assign(Flowable='Water', Class='Water', Context='resource/water', Unit='kg',
+                         FlowType='ELEMENTARY_FLOW', LocationSystem='FIPS_2015', Year=2015,
+                         SectorSourceName='NAICS_2012_Code')
+        fbs = clean_df(fbs, flow_by_sector_fields_w_activity,
+                       create_fill_na_dict(flow_by_sector_fields_w_activity))
+        names = ['Irrigation', 'Irrigation Crop', 'Livestock']
+        method = {'target_sector_level': 'NAICS_6'}
+        expected = direct_allocation_reference(fbs, names, 'NAICS_6')
+        result = direct_allocation_method(fbs, 'USGS_NWIS_WU', names, method)
+        self.assertGreater(len(result), len(fbs[fbs['ActivityConsumedBy'].isin(names)]))
+        self.assertNotIn('Domestic', result['ActivityConsumedBy'].tolist())
+        cols = sorted(expected.columns)
+        expected = expected[cols].sort_values(cols).reset_index(drop=True)
+        result = result[cols].sort_values(cols).reset_index(drop=True)
+        pd.testing.assert_frame_equal(expected, result)
+
+    def test_helper_allocation_key(self):
+        method = {'target_sector_source': 'NAICS_2012_Code'}
+        v = {'geoscale_to_use': 'state'}
+        attr = {'helper_source': 'BLS_QCEW', 'names': ['a']}
+        # activity sets with the same helper parameters share a table
+        self.assertEqual(helper_allocation_key(attr, method, v),
+                         helper_allocation_key(dict(attr, names=['b']), method, v))
+        # unless the attr and method passed to a helper clean function differ
+        attr = dict(attr, clean_helper_fba_wsec='clean')
+        self.assertNotEqual(helper_allocation_key(attr, method, v),
+                            helper_allocation_key(dict(attr, names=['b']), method, v))
+        self.assertNotEqual(helper_allocation_key(attr, method, v),
+                            helper_allocation_key(attr, dict(method, other=1), v))
+
+
+if __name__ == '__main__':
+    unittest.main()
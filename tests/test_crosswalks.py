@@ -0,0 +1,41 @@
+# test_crosswalks.py (tests)
+# !/usr/bin/env python3
+# coding=utf-8
+
+""" Tests of the compiled crosswalk store """
+import os
+import unittest
+import pandas as pd
+from flowsa.common import crosswalkpath, datapath, activitytosector_crosswalk_names, \
+    load_activitytosector_crosswalk, load_sector_length_crosswalk, compile_crosswalk_store, \
+    crosswalk_store_is_current, crosswalkoutputpath
+
+
+class TestCrosswalkStore(unittest.TestCase):
+
+    def test_activitytosector_crosswalks_match_csv(self):
+        for name, f in activitytosector_crosswalk_names().items():
+            csv = pd.read_csv(crosswalkpath + f, dtype={'Activity': 'str', 'Sector': 'str'},
+                              encoding='utf-8-sig')
+            pd.testing.assert_frame_equal(csv, load_activitytosector_crosswalk(name),
+                                          check_dtype=False)
+
+    def test_sector_length_crosswalk_matches_csv(self):
+        csv = pd.read_csv(datapath + 'NAICS_2012_Crosswalk.csv', dtype='str')
+        pd.testing.assert_frame_equal(csv, load_sector_length_crosswalk())
+
+    def test_recompile_replaces_store(self):
+        compile_crosswalk_store()
+        compile_crosswalk_store()
+        self.assertTrue(crosswalk_store_is_current())
+        # the temporary folder and previous tables are removed
+        self.assertEqual([], [f for f in os.listdir(crosswalkoutputpath) if f.startswith('.')])
+        name = list(activitytosector_crosswalk_names())[0]
+        self.assertEqual(sorted(os.listdir(crosswalkoutputpath + 'ActivityToSector.parquet')),
+                         sorted('CrosswalkName=' + n for n in activitytosector_crosswalk_names()))
+        self.assertGreater(len(pd.read_parquet(crosswalkoutputpath + 'ActivityToSector.parquet',
+                                               filters=[('CrosswalkName', '==', name)])), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
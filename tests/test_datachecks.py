@@ -0,0 +1,212 @@
+# test_datachecks.py (tests)
+# !/usr/bin/env python3
+# coding=utf-8
+
+""" Tests of the data checks """
+import unittest
+import numpy as np
+import pandas as pd
+from flowsa.common import flow_by_sector_fields, fbs_fill_na_dict, fbs_activity_fields, \
+    sector_level_key, load_sector_length_crosswalk, load_sector_crosswalk, log
+from flowsa.dataclean import clean_df, replace_strings_with_NoneType, \
+    replace_NoneType_with_empty_cells
+from flowsa.datachecks import check_if_losing_sector_data, check_if_sectors_are_naics, \
+    melt_naics_crosswalk, replace_naics_w_naics_from_another_year
+from flowsa.flowbyfunctions import aggregator
+
+
+def check_if_losing_sector_data_reference(df, target_sector_level):
+    """
+    Implementation of check_if_losing_sector_data() that loops over sector lengths,
+    used to test the vectorized implementation
+    """
+
+    # exclude nonsectors
+    df = replace_NoneType_with_empty_cells(df)
+
+    rows_lost = pd.DataFrame()
+    for i in range(2, sector_level_key[target_sector_level]):
+        # create df of i length
+        df_x1 = df.loc[(df[fbs_activity_fields[0]].apply(lambda x: len(x) == i)) &
+                       (df[fbs_activity_fields[1]] == '')]
+        df_x2 = df.loc[(df[fbs_activity_fields[0]] == '') &
+                       (df[fbs_activity_fields[1]].apply(lambda x: len(x) == i))]
+        df_x3 = df.loc[(df[fbs_activity_fields[0]].apply(lambda x: len(x) == i)) &
+                       (df[fbs_activity_fields[1]].apply(lambda x: len(x) == i))]
+        df_x = pd.concat([df_x1, df_x2, df_x3], ignore_index=True, sort=False)
+
+        # create df of i + 1 length
+        df_y1 = df.loc[df[fbs_activity_fields[0]].apply(lambda x: len(x) == i + 1) |
+                       df[fbs_activity_fields[1]].apply(lambda x: len(x) == i + 1)]
+        df_y2 = df.loc[df[fbs_activity_fields[0]].apply(lambda x: len(x) == i + 1) &
+                       df[fbs_activity_fields[1]].apply(lambda x: len(x) == i + 1)]
+        df_y = pd.concat([df_y1, df_y2], ignore_index=True, sort=False)
+
+        # create temp sector columns in df y, that are i digits in length
+        df_y.loc[:, 'spb_tmp'] = df_y[fbs_activity_fields[0]].apply(lambda x: x[0:i])
+        df_y.loc[:, 'scb_tmp'] = df_y[fbs_activity_fields[1]].apply(lambda x: x[0:i])
+        # don't modify household sector lengths
+        df_y = df_y.replace({'F0': 'F010',
+                             'F01': 'F010'})
+
+        # merge the two dfs
+        df_m = pd.merge(df_x,
+                        df_y[['Class', 'Context', 'FlowType', 'Flowable',
+                              'Location', 'LocationSystem', 'Unit',
+                              'Year', 'spb_tmp', 'scb_tmp']],
+                        how='left',
+                        left_on=['Class', 'Context', 'FlowType', 'Flowable',
+                                 'Location', 'LocationSystem', 'Unit',
+                                 'Year', 'SectorProducedBy', 'SectorConsumedBy'],
+                        right_on=['Class', 'Context', 'FlowType', 'Flowable',
+                                  'Location', 'LocationSystem', 'Unit',
+                                  'Year', 'spb_tmp', 'scb_tmp'])
+
+        # extract the rows that are not disaggregated to more specific naics
+        rl = df_m[(df_m['scb_tmp'].isnull()) & (df_m['spb_tmp'].isnull())]
+        # clean df
+        rl = clean_df(rl, flow_by_sector_fields, fbs_fill_na_dict)
+        rl_list = rl[['SectorProducedBy', 'SectorConsumedBy']].drop_duplicates().values.tolist()
+
+        # match sectors with target sector length sectors
+
+        # import cw and subset to current sector length and target sector length
+        cw_load = load_sector_length_crosswalk()
+        nlength = list(sector_level_key.keys())[list(sector_level_key.values()).index(i)]
+        cw = cw_load[[nlength, target_sector_level]].drop_duplicates()
+        # add column with counts
+        cw['sector_count'] = cw.groupby(nlength)[nlength].transform('count')
+
+        # merge df & conditionally replace sector produced/consumed columns
+        rl_m = pd.merge(rl, cw, how='left', left_on=[fbs_activity_fields[0]], right_on=[nlength])
+        rl_m.loc[rl_m[fbs_activity_fields[0]] != '',
+                 fbs_activity_fields[0]] = rl_m[target_sector_level]
+        rl_m = rl_m.drop(columns=[nlength, target_sector_level])
+
+        rl_m2 = pd.merge(rl_m, cw, how='left', left_on=[fbs_activity_fields[1]], right_on=[nlength])
+        rl_m2.loc[rl_m2[fbs_activity_fields[1]] != '',
+                  fbs_activity_fields[1]] = rl_m2[target_sector_level]
+        rl_m2 = rl_m2.drop(columns=[nlength, target_sector_level])
+
+        # create one sector count column
+        rl_m2['sector_count_x'] = rl_m2['sector_count_x'].fillna(rl_m2['sector_count_y'])
+        rl_m3 = rl_m2.rename(columns={'sector_count_x': 'sector_count'})
+        rl_m3 = rl_m3.drop(columns=['sector_count_y'])
+
+        # calculate new flow amounts, based on sector count,
+        # allocating equally to the new sector length codes
+        rl_m3['FlowAmount'] = rl_m3['FlowAmount'] / rl_m3['sector_count']
+        rl_m3 = rl_m3.drop(columns=['sector_count'])
+
+        # append to df
+        if len(rl) != 0:
+            log.warning('Data found at ' + str(i) + ' digit NAICS not represented in current '
+                        'data subset: {}'.format(' '.join(map(str, rl_list))))
+            rows_lost = pd.concat([rows_lost, rl_m3], ignore_index=True, sort=True)
+
+    if len(rows_lost) == 0:
+        log.debug('Data exists at ' + target_sector_level)
+    else:
+        log.info('Allocating FlowAmounts equally to each ' + target_sector_level +
+                 ' associated with the sectors previously dropped')
+
+    # add rows of missing data to the fbs sector subset
+    df_w_lost_data = pd.concat([df, rows_lost], ignore_index=True, sort=True)
+    df_w_lost_data = replace_strings_with_NoneType(df_w_lost_data)
+
+    return df_w_lost_data
+
+
+def replace_naics_w_naics_from_another_year_reference(df_load, sectorsourcename):
+    """
+    Implementation of replace_naics_w_naics_from_another_year() that converts and
+    aggregates all rows, used to test the implementation converting only the rows
+    with codes from another NAICS year
+    """
+    df = replace_NoneType_with_empty_cells(df_load).reset_index(drop=True)
+    cw = load_sector_crosswalk()[sectorsourcename].drop_duplicates().tolist()
+    cw_melt = melt_naics_crosswalk().drop(columns='naics_count')
+    column_headers = ['SectorProducedBy', 'SectorConsumedBy']
+    non_naics = check_if_sectors_are_naics(df, cw, column_headers)
+    if len(non_naics) != 0:
+        for c in column_headers:
+            df = df.merge(cw_melt, left_on=c, right_on='NAICS', how='left')
+            df[c] = np.where((df[c] == df['NAICS']) &
+                             (df[c].isin(non_naics)), df[sectorsourcename], df[c])
+            df.loc[df[c] == df[sectorsourcename],
+                   'FlowAmount'] = df['FlowAmount'] * df['allocation_ratio']
+            df = df.drop(columns=[sectorsourcename, 'NAICS', 'allocation_ratio'])
+        nonsectors = check_if_sectors_are_naics(df, cw, column_headers)
+        if len(nonsectors) != 0:
+            for c in column_headers:
+                df = df[~df[c].isin(nonsectors)]
+        possible_column_headers = ('FlowAmount', 'Spread', 'Min', 'Max',
+                                   'DataReliability', 'TemporalCorrelation',
+                                   'GeographicalCorrelation', 'TechnologicalCorrelation',
+                                   'DataCollection', 'Description')
+        groupby_cols = [e for e in df.columns.values.tolist() if e not in possible_column_headers]
+        df = aggregator(df, groupby_cols)
+    df = df[~((df['SectorConsumedBy'].isnull()) &
+              (df['SectorProducedBy'].isnull()))].reset_index(drop=True)
+    return replace_strings_with_NoneType(df)
+
+
+class TestDataChecks(unittest.TestCase):
+
+    def test_check_if_losing_sector_data(self):
+        cw = load_sector_length_crosswalk()
+        rng = np.random.default_rng(0)
+        sectors = pd.unique(cw[['NAICS_2', 'NAICS_3', 'NAICS_4', 'NAICS_5', 'NAICS_6']].values.ravel())
+        sectors = [s for s in sectors if s[0:2] in ('11', '21', '22', '31', '42')] + ['F010', 'F01', '']
+        n = 500
+        df = pd.DataFrame({'SectorProducedBy': rng.choice(sectors, n),
+                           'SectorConsumedBy': np.where(rng.random(n) < 0.7, '', rng.choice(sectors, n)),
+                           'Location': rng.choice(['00000', '01000'], n),
+                           'FlowAmount': rng.random(n)})
+        df = df.assign(Flowable='Jobs', Class='Employment', SectorSourceName='NAICS_2012_Code',
+                       Context=None, LocationSystem='FIPS_2015', Unit='p', FlowType='ELEMENTARY_FLOW',
+                       Year=2015)
+        df = clean_df(df, flow_by_sector_fields, fbs_fill_na_dict)
+        for target in ['NAICS_4', 'NAICS_6']:
+            expected = check_if_losing_sector_data_reference(df, target)
+            result = check_if_losing_sector_data(df, target)
+            self.assertGreater(len(result), len(df))
+            pd.testing.assert_frame_equal(expected, result)
+
+    def test_replace_naics_w_naics_from_another_year(self):
+        # 2012 codes, 2007 codes 323121 and 722213, 2017 codes 211130, 212230, 454110
+        # that convert to some of the 2012 codes, and a code that is not NAICS
+        sectors = ['211111', '212231', '722515', '323120', '111110', '211130', '212230',
+                   '722213', '323121', '454110', 'XYZ']
+        rng = np.random.default_rng(0)
+        n = 200
+        df = pd.DataFrame({'SectorProducedBy': rng.choice(sectors, n),
+                           'SectorConsumedBy': np.where(rng.random(n) < 0.7, '',
+                                                        rng.choice(sectors, n)),
+                           'Location': rng.choice(['00000', '01000', '02000', '04000'], n),
+                           'FlowAmount': np.where(rng.random(n) < 0.1, 0, rng.random(n)),
+                           'Spread': rng.random(n),
+                           'Description': 'Test'})
+        df = df.assign(Flowable='Jobs', Class='Employment', SectorSourceName='NAICS_2012_Code',
+                       Context=None, LocationSystem='FIPS_2015', Unit='p',
+                       FlowType='ELEMENTARY_FLOW', Year=2015)
+        df = clean_df(df, flow_by_sector_fields, fbs_fill_na_dict, drop_description=False)
+        # the 2012 codes are not also listed as codes of another NAICS year
+        self.assertFalse(melt_naics_crosswalk()['NAICS'].isin(sectors[0:5]).any())
+        expected = replace_naics_w_naics_from_another_year_reference(df, 'NAICS_2012_Code')
+        result = replace_naics_w_naics_from_another_year(df, 'NAICS_2012_Code')
+        self.assertEqual(list(expected.columns), list(result.columns))
+        self.assertNotIn('Description', result.columns)
+        self.assertFalse((result['FlowAmount'] == 0).any())
+        keys = [e for e in expected.columns if e not in ('FlowAmount', 'Spread')]
+        expected = expected.sort_values(keys).reset_index(drop=True)
+        result = result.sort_values(keys).reset_index(drop=True)
+        self.assertEqual(expected[keys].fillna('').values.tolist(),
+                         result[keys].fillna('').values.tolist())
+        self.assertTrue(np.isclose(expected['FlowAmount'], result['FlowAmount']).all())
+        self.assertTrue(np.isclose(expected['Spread'], result['Spread']).all())
+        self.assertAlmostEqual(expected['FlowAmount'].sum(), result['FlowAmount'].sum())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+# test_dataclean.py (tests)
+# !/usr/bin/env python3
+# coding=utf-8
+
+""" Tests of cleaning and harmonizing FBS dataframes """
+import unittest
+import pandas as pd
+from flowsa.common import flow_by_sector_fields, fbs_fill_na_dict
+from flowsa.dataclean import clean_df, harmonize_FBS_columns, replace_NoneType_with_empty_cells, \
+    replace_strings_with_NoneType
+
+
+def harmonize_metasources_reference(df):
+    """
+    Combine MetaSources with a groupby/apply and a merge, as harmonize_FBS_columns() did
+    before factorizing the groups, used to test the vectorized implementation
+    """
+    df = replace_NoneType_with_empty_cells(df)
+    string_cols = ['Flowable', 'Class', 'SectorProducedBy', 'SectorConsumedBy',
+                   'SectorSourceName', 'Context', 'Location', 'LocationSystem',
+                   'Unit', 'FlowType', 'Year', 'MeasureofSpread', 'MetaSources']
+    df_sub = df[string_cols].drop_duplicates().reset_index(drop=True)
+    df_sub = df_sub.sort_values(['MetaSources', 'SectorProducedBy',
+                                 'SectorConsumedBy']).reset_index(drop=True)
+    group_no_meta = [e for e in string_cols if e not in 'MetaSources']
+    df_sub = df_sub.groupby(group_no_meta)['MetaSources'].apply(', '.join).reset_index()
+    df = df.drop(columns='MetaSources')
+    harmonized_df = df.merge(df_sub, how='left')
+    return replace_strings_with_NoneType(harmonized_df)
+
+
+class TestDataClean(unittest.TestCase):
+
+    def setUp(self):
+        df = pd.DataFrame({
+            'Flowable': ['Water', 'Water', 'Water', 'Water', 'Jobs', 'Water'],
+            'Context': ['resource/water', 'resource/water', 'resource/water', 'resource/water',
+                        None, 'resource/water'],
+            'SectorProducedBy': ['111', '111', '111', '112', '111', None],
+            'SectorConsumedBy': [None, None, None, None, None, '221'],
+            'MetaSources': ['USGS_NWIS_WU', 'BLS_QCEW', 'USGS_NWIS_WU', 'BLS_QCEW',
+                            'BLS_QCEW', 'USDA_IWMS'],
+            'FlowAmount': [1.0, 2.0, 3.0, 4.0, 5.0, 6.0]})
+        df = df.assign(Class=['Water'] * 4 + ['Employment', 'Water'], Location='00000',
+                       LocationSystem='FIPS_2015', Unit='kg', FlowType='ELEMENTARY_FLOW',
+                       Year=2015, SectorSourceName='NAICS_2012_Code')
+        self.fbs = clean_df(df, flow_by_sector_fields, fbs_fill_na_dict)
+
+    def test_harmonize_FBS_columns(self):
+        result = harmonize_FBS_columns(self.fbs)
+        # rows sharing a context, flowable and sector combine their MetaSources
+        self.assertEqual(['BLS_QCEW, USGS_NWIS_WU'] * 3 + ['BLS_QCEW', 'BLS_QCEW', 'USDA_IWMS'],
+                         result['MetaSources'].tolist())
+        self.assertEqual(['FIPS'], result['LocationSystem'].unique().tolist())
+        expected = harmonize_metasources_reference(self.fbs.assign(
+            LocationSystem='FIPS', MeasureofSpread=None, Spread=0, DistributionType=None))
+        pd.testing.assert_frame_equal(expected, result)
+
+    def test_harmonize_empty_FBS(self):
+        result = harmonize_FBS_columns(self.fbs.iloc[0:0])
+        self.assertEqual(0, len(result))
+        self.assertEqual(list(harmonize_FBS_columns(self.fbs).columns), list(result.columns))
+        expected = harmonize_metasources_reference(self.fbs.iloc[0:0].assign(
+            LocationSystem='FIPS', MeasureofSpread=None, Spread=0, DistributionType=None))
+        self.assertEqual(sorted(expected.columns), sorted(result.columns))
+
+
+if __name__ == '__main__':
+    unittest.main()
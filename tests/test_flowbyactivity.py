@@ -29,3 +29,72 @@ class TestFlowByActivityFunctions(unittest.TestCase):
         amount = flows['FlowAmount'][0]
         self.assertEqual(19000,amount)
 
+
+class TestEstimateSuppressedData(unittest.TestCase):
+
+    def test_estimate_suppressed_data(self):
+        rows = [('01000', '111', 100), ('01000', '1111', 30), ('01000', '1112', 0),
+                ('01000', '1113', 0), ('01000', '11121', 0), ('01000', '112', 50),
+                ('01000', '1121', 0), ('02000', '111', 80), ('02000', '1111', 0),
+                ('02000', '1112', 20), ('02000', '113', 10), ('02000', '1131', 10)]
+        df = pd.DataFrame(rows, columns=['Location', 'SectorConsumedBy', 'FlowAmount'])
+        df = df.assign(Class='Land', Compartment=None, FlowType='ELEMENTARY_FLOW',
+                       FlowName='Cropland', LocationSystem='FIPS_2015', Unit='Acres', Year=2017,
+                       SectorProducedBy=None, ActivityProducedBy=None,
+                       ActivityConsumedBy=df['SectorConsumedBy'])
+        df = estimate_suppressed_data(df, 'SectorConsumedBy', 3)
+        # each suppressed row is replaced once by its estimate
+        self.assertFalse(df.duplicated(subset=['FlowName', 'Location', 'SectorConsumedBy']).any())
+        self.assertEqual(len(rows), len(df))
+        amounts = df.set_index(['Location', 'SectorConsumedBy'])['FlowAmount'].to_dict()
+        # the parent flow less the unsuppressed children, divided equally between the
+        # suppressed children, which are in turn parents at the next sector length
+        self.assertEqual({('01000', '111'): 100, ('01000', '1111'): 30, ('01000', '1112'): 35,
+                          ('01000', '1113'): 35, ('01000', '11121'): 35, ('01000', '112'): 50,
+                          ('01000', '1121'): 50, ('02000', '111'): 80, ('02000', '1111'): 60,
+                          ('02000', '1112'): 20, ('02000', '113'): 10, ('02000', '1131'): 10},
+                         amounts)
+        self.assertEqual(df['SectorConsumedBy'].tolist(), df['ActivityConsumedBy'].tolist())
+
+
+class TestSubsetDfByGeoscale(unittest.TestCase):
+
+    def setUp(self):
+        # activity 'A' is only available at county, activity 'B' at national, state and
+        # county, and activity 'C' at state and county
+        rows = [('A', '01001', 10), ('A', '01003', 20), ('A', '02013', 5),
+                ('B', '00000', 100), ('B', '01000', 60), ('B', '02000', 30),
+                ('B', '01001', 7), ('C', '01000', 30), ('C', '02000', 15),
+                ('C', '01001', 3)]
+        df = pd.DataFrame(rows, columns=['ActivityConsumedBy', 'Location', 'FlowAmount'])
+        df = df.assign(Class='Water', SourceName='Test', FlowName='fresh', Unit='Mgal',
+                       FlowType='ELEMENTARY_FLOW', ActivityProducedBy=None,
+                       Compartment='ground', LocationSystem='FIPS_2015', Year=2015)
+        self.df = clean_df(df, flow_by_activity_fields, fba_fill_na_dict)
+
+    def subset_amounts(self, from_scale, to_scale):
+        df = subset_df_by_geoscale(self.df, from_scale, to_scale)
+        return df.set_index(['ActivityConsumedBy', 'Location'])['FlowAmount'].to_dict()
+
+    def test_activity_from_scale(self):
+        df = self.df.assign(geoscale_rank=assign_geoscale_rank(self.df))
+        df = df.assign(from_rank=activity_from_scale_rank(df, 'national'))
+        from_rank = df.groupby('ActivityConsumedBy')['from_rank'].unique()
+        self.assertEqual({'A': [5], 'B': [0], 'C': [2]},
+                         {k: list(v) for k, v in from_rank.items()})
+        df = df.assign(from_rank=activity_from_scale_rank(df, 'state'))
+        from_rank = df.groupby('ActivityConsumedBy')['from_rank'].unique()
+        self.assertEqual({'A': [5], 'B': [2], 'C': [2]},
+                         {k: list(v) for k, v in from_rank.items()})
+
+    def test_subset_national(self):
+        # 'A' aggregated from county, 'B' subset at national, 'C' aggregated from state
+        self.assertEqual({('A', '00000'): 35, ('B', '00000'): 100, ('C', '00000'): 45},
+                         self.subset_amounts('national', 'national'))
+
+    def test_subset_state(self):
+        # 'A' aggregated from county, 'B' and 'C' subset at state
+        self.assertEqual({('A', '01000'): 30, ('A', '02000'): 5,
+                          ('B', '01000'): 60, ('B', '02000'): 30,
+                          ('C', '01000'): 30, ('C', '02000'): 15},
+                         self.subset_amounts('state', 'state'))
@@ -0,0 +1,43 @@
+# test_import.py (tests)
+# !/usr/bin/env python3
+# coding=utf-8
+
+""" Tests that importing flowsa has no side effects """
+import sys
+import json
+import unittest
+import subprocess
+
+
+class TestImport(unittest.TestCase):
+
+    def test_import_is_side_effect_free(self):
+        code = ("import sys, json, logging, flowsa; "
+                "print(json.dumps([len(logging.getLogger().handlers), "
+                "'requests' in sys.modules, 'pkg_resources' in sys.modules]))")
+        out = subprocess.check_output([sys.executable, '-c', code])
+        handlers, requests_imported, pkg_resources_imported = \
+            json.loads(out.decode().strip().splitlines()[-1])
+        self.assertEqual(0, handlers)
+        self.assertFalse(requests_imported)
+        self.assertFalse(pkg_resources_imported)
+
+    def test_configure_logging(self):
+        import logging
+        from flowsa.common import configure_logging
+        root = logging.getLogger()
+        handlers = root.handlers[:]
+        try:
+            configure_logging(log_file=False)
+            self.assertEqual(1, len(root.handlers))
+        finally:
+            root.handlers = handlers
+
+    def test_deferred_imports_used(self):
+        # modules imported on use by common.py functions shared through star imports
+        from flowsa.data_source_scripts.StatCan_GDP import call_country_code
+        self.assertEqual('124', call_country_code('Canada'))
+
+
+if __name__ == '__main__':
+    unittest.main()
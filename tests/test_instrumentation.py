@@ -0,0 +1,160 @@
+# test_instrumentation.py (tests)
+# !/usr/bin/env python3
+# coding=utf-8
+
+""" Tests of the FlowBySector run report and profiling hooks """
+import os
+import json
+import tempfile
+import threading
+import time
+import unittest
+import pandas as pd
+from flowsa.instrumentation import RunReport, Hook, CProfileHook, FileSpanExporter, \
+    register_hook, clear_hooks, span, traced, emit
+
+
+class TestRunReport(unittest.TestCase):
+
+    def test_run_report(self):
+        report = RunReport('Test_method')
+        df = pd.DataFrame({'FlowAmount': range(10)})
+        for aset in ['a', 'b']:
+            with report.stage('geoscale_subset', 'Test', aset, df_in=df) as s:
+                s['df_out'] = df.head(3)
+            with report.stage('datachecks', 'Test', aset, df_in=df):
+                pass
+        stages = report.to_df()
+        self.assertEqual([10] * 4, stages['RowsIn'].tolist())
+        self.assertEqual(3, stages['RowsOut'][0])
+        self.assertTrue(pd.isnull(stages['RowsOut'][1]))
+        self.assertTrue((stages['WallTime'] >= 0).all())
+
+        summary = report.summarize()
+        self.assertEqual(['geoscale_subset', 'datachecks'], summary['Stage'].tolist())
+        self.assertEqual([2, 2], summary['Count'].tolist())
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = report.write(os.path.join(tmp, 'report.json'))
+            with open(path) as f:
+                saved = json.load(f)
+        self.assertEqual('Test_method', saved['method'])
+        self.assertEqual(4, len(saved['stages']))
+
+    def test_stage_recorded_on_error(self):
+        report = RunReport('Test_method')
+        with self.assertRaises(KeyError):
+            with report.stage('allocation'):
+                raise KeyError('missing')
+        self.assertEqual(['allocation'], report.to_df()['Stage'].tolist())
+
+    def test_add_stage(self):
+        report = RunReport('Test_method')
+        with report.stage('datachecks_submit', 'Test', 'a'):
+            pass
+        report.add_stage('datachecks', 'Test', 'a', 1.5, 10, 1.2)
+        summary = report.summarize()
+        self.assertEqual(['datachecks_submit', 'datachecks'], summary['Stage'].tolist())
+        self.assertEqual(1.5, summary['WallTime'][1])
+        self.assertEqual(1.2, summary['CPUTime'][1])
+
+    def test_cpu_time_of_stage_thread(self):
+        report = RunReport('Test_method')
+        stop = threading.Event()
+
+        def busy():
+            while not stop.is_set():
+                sum(range(1000))
+
+        # CPU used by another thread, such as the validation thread, is not counted
+        thread = threading.Thread(target=busy)
+        thread.start()
+        try:
+            with report.stage('finalize'):
+                time.sleep(0.3)
+        finally:
+            stop.set()
+            thread.join()
+        stages = report.to_df()
+        self.assertLess(stages['CPUTime'][0], 0.1)
+        self.assertGreater(stages['WallTime'][0], 0.25)
+
+
+class RecordingHook(Hook):
+
+    def __init__(self):
+        self.calls = []
+
+    def start_span(self, span):
+        self.calls.append(('start', span.name, span.parent_id))
+
+    def end_span(self, span):
+        self.calls.append(('end', span.name, span.error is None))
+
+    def on_event(self, event, data):
+        self.calls.append(('event', event, data))
+
+
+@traced()
+def add_one(x):
+    return x + 1
+
+
+class TestHooks(unittest.TestCase):
+
+    def tearDown(self):
+        clear_hooks()
+
+    def test_no_hooks(self):
+        with span('fetch', url='x') as s:
+            self.assertIsNone(s)
+        self.assertEqual(2, add_one(1))
+
+    def test_spans_and_events(self):
+        hook = register_hook(RecordingHook())
+        with span('flowbyactivity', source='Test') as outer:
+            self.assertEqual(2, add_one(1))
+            emit('fba_saved', name='Test_2015')
+        with self.assertRaises(ValueError):
+            with span('parse'):
+                raise ValueError()
+        self.assertEqual([('start', 'flowbyactivity', None),
+                          ('start', 'add_one', outer.span_id),
+                          ('end', 'add_one', True),
+                          ('event', 'fba_saved', {'name': 'Test_2015'}),
+                          ('end', 'flowbyactivity', True),
+                          ('start', 'parse', None),
+                          ('end', 'parse', False)], hook.calls)
+
+    def test_spans_per_thread(self):
+        hook = register_hook(RecordingHook())
+        with span('flowbysector'):
+            # spans opened by another thread, such as the validation thread, are not
+            # children of the spans open in this thread
+            worker = threading.Thread(target=add_one, args=(1,))
+            worker.start()
+            worker.join()
+        self.assertIn(('start', 'add_one', None), hook.calls)
+
+    def test_run_report_stages_are_spans(self):
+        hook = register_hook(RecordingHook())
+        report = RunReport('Test_method')
+        with report.stage('allocation', 'Test', 'a'):
+            pass
+        self.assertEqual([('start', 'allocation', None), ('end', 'allocation', True)], hook.calls)
+
+    def test_cprofile_and_exporter(self):
+        profiler = register_hook(CProfileHook(span_names=['add_one']))
+        with tempfile.TemporaryDirectory() as tmp:
+            register_hook(FileSpanExporter(os.path.join(tmp, 'spans.jsonl')))
+            with span('outer'):
+                add_one(1)
+            with open(os.path.join(tmp, 'spans.jsonl')) as f:
+                records = [json.loads(line) for line in f]
+        self.assertEqual(['add_one', 'outer'], [r['name'] for r in records])
+        self.assertEqual(records[1]['span_id'], records[0]['parent_id'])
+        self.assertEqual(['add_one'], [s.name for s, p in profiler.profiles])
+
+
+if __name__ == '__main__':
+    unittest.main()
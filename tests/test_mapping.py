@@ -0,0 +1,84 @@
+# test_mapping.py (tests)
+# !/usr/bin/env python3
+# coding=utf-8
+
+""" Tests of mapping flows to fedelemflowlist flows """
+import unittest
+import pandas as pd
+import flowsa.mapping
+from flowsa.mapping import encode_flowmapping, map_elementary_flows, flowmapping_fields
+
+
+def map_elementary_flows_reference(fba, flowmapping, keep_unmapped_rows=False):
+    """
+    Implementation of map_elementary_flows() that merges the flow mapping on the
+    flowable and context columns, used to test the merge on integer flow keys
+    """
+    fba = fba.rename(columns={"FlowName": 'Flowable',
+                              "Compartment": "Context"})
+    flowmapping = flowmapping[flowmapping_fields]
+    merge_type = 'left' if keep_unmapped_rows else 'inner'
+    fba_mapped_df = pd.merge(fba, flowmapping,
+                             left_on=["Flowable", "Context"],
+                             right_on=["SourceFlowName", "SourceFlowContext"],
+                             how=merge_type)
+    fba_mapped_df.loc[fba_mapped_df["TargetFlowName"].notnull(), "Flowable"] =\
+        fba_mapped_df["TargetFlowName"]
+    fba_mapped_df.loc[fba_mapped_df["TargetFlowName"].notnull(), "Context"] =\
+        fba_mapped_df["TargetFlowContext"]
+    fba_mapped_df.loc[fba_mapped_df["TargetFlowName"].notnull(), "Unit"] =\
+        fba_mapped_df["TargetUnit"]
+    fba_mapped_df.loc[fba_mapped_df["TargetFlowName"].notnull(), "FlowAmount"] = \
+        fba_mapped_df["FlowAmount"] * fba_mapped_df["ConversionFactor"]
+    return fba_mapped_df.drop(columns=flowmapping_fields)
+
+
+class TestMapElementaryFlows(unittest.TestCase):
+
+    def setUp(self):
+        # local stand-in for a fedelemflowlist flow mapping
+        self.flowmapping = pd.DataFrame({
+            'SourceListName': 'Test',
+            'SourceFlowName': ['Water', 'Water', 'Land', 'Jobs', 'Ammonia', None],
+            'SourceFlowContext': ['resource/water', 'emission/water', 'resource/ground',
+                                  None, 'emission/air', 'emission/air'],
+            'SourceUnit': ['Mgal', 'Mgal', 'Acres', 'p', 'lb', 'lb'],
+            'ConversionFactor': [3785411.784, 3785411.784, 4046.856, 1.0, 0.4536, 0.4536],
+            'TargetFlowName': ['Water, fresh', 'Water', 'Occupation, unspecified', 'Jobs',
+                               'Ammonia', 'Unknown'],
+            'TargetFlowContext': ['resource/water/fresh', 'emission/water',
+                                  'resource/ground/human-dominated', None, 'emission/air',
+                                  'emission/air'],
+            'TargetUnit': ['kg', 'kg', 'm2*a', 'p', 'kg', 'kg']})
+        # 'Land' in another context, 'Ammonia' with a context only in the fba, and
+        # 'Methane' only in the fba
+        self.fba = pd.DataFrame({
+            'FlowName': ['Water', 'Land', 'Land', 'Jobs', 'Ammonia', 'Methane', 'Water'],
+            'Compartment': ['resource/water', 'resource/ground', 'resource/air', None,
+                            'emission/soil', 'emission/air', 'emission/water'],
+            'Unit': ['Mgal', 'Acres', 'Acres', 'p', 'lb', 'lb', 'Mgal'],
+            'FlowAmount': [1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0],
+            'Location': ['00000', '00000', '01000', '00000', '00000', '01000', '01000']})
+        self._read_flowmapping = flowsa.mapping._read_flowmapping
+        flowmapping = encode_flowmapping(self.flowmapping)
+        flowsa.mapping._read_flowmapping = lambda from_fba_source: flowmapping
+
+    def tearDown(self):
+        flowsa.mapping._read_flowmapping = self._read_flowmapping
+
+    def test_map_elementary_flows(self):
+        for keep_unmapped_rows in [False, True]:
+            result = map_elementary_flows(self.fba, 'Test', keep_unmapped_rows)
+            expected = map_elementary_flows_reference(self.fba, self.flowmapping,
+                                                      keep_unmapped_rows)
+            pd.testing.assert_frame_equal(expected, result)
+        self.assertEqual(['Water, fresh', 'Occupation, unspecified', 'Jobs', 'Water'],
+                         map_elementary_flows(self.fba, 'Test')['Flowable'].tolist())
+        result = map_elementary_flows(self.fba, 'Test', keep_unmapped_rows=True)
+        self.assertEqual([3785411.784, 8093.712, 3.0, 4.0, 5.0, 6.0, 7 * 3785411.784],
+                         result['FlowAmount'].tolist())
+        self.assertEqual(['kg', 'm2*a', 'Acres', 'p', 'lb', 'lb', 'kg'], result['Unit'].tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+# test_registry.py (tests)
+# !/usr/bin/env python3
+# coding=utf-8
+
+""" Tests of the registry of data source functions named in method yamls """
+import os
+import importlib
+import unittest
+import yaml
+from flowsa.common import datapath
+from flowsa.registry import source_functions, get_function, register_function, \
+    unregister_function, is_registered
+
+# method yaml keys naming data source functions
+function_keys = ['url_replace_fxn', 'call_response_fxn', 'parse_response_fxn',
+                 'FBS_datapull_fxn', 'clean_fba_df_fxn', 'clean_fba_w_sec_df_fxn',
+                 'clean_mapped_fba_w_sec_df_fxn', 'clean_allocation_fba',
+                 'clean_allocation_fba_w_sec', 'clean_helper_fba', 'clean_helper_fba_wsec',
+                 'scale_helper_results']
+
+
+def yaml_function_names(d):
+    """Find the function names in a method yaml, including function allocation sources"""
+    names = set()
+    if isinstance(d, dict):
+        for k, v in d.items():
+            if k in function_keys and isinstance(v, str) and v != 'None':
+                names.add(v)
+            names.update(yaml_function_names(v))
+        if d.get('allocation_method') == 'function':
+            names.add(d['allocation_source'])
+    elif isinstance(d, list):
+        for v in d:
+            names.update(yaml_function_names(v))
+    return names
+
+
+class TestRegistry(unittest.TestCase):
+
+    def test_method_functions_registered(self):
+        for folder in ['flowbyactivitymethods', 'flowbysectormethods']:
+            for f in os.listdir(datapath + folder):
+                if not f.endswith('.yaml'):
+                    continue
+                with open(os.path.join(datapath, folder, f)) as fp:
+                    names = yaml_function_names(yaml.safe_load(fp))
+                for name in names:
+                    self.assertTrue(is_registered(name), name + ' in ' + f)
+
+    def test_modules_define_functions(self):
+        for module, fxns in source_functions.items():
+            m = importlib.import_module('flowsa.data_source_scripts.' + module)
+            for fxn in fxns:
+                self.assertIs(getattr(m, fxn), get_function(fxn))
+
+    def test_register_function(self):
+        with self.assertRaises(KeyError):
+            get_function('test_cleanup')
+        register_function('test_cleanup', len)
+        self.assertIs(len, get_function('test_cleanup'))
+        unregister_function('test_cleanup')
+        self.assertFalse(is_registered('test_cleanup'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+# test_storage.py (tests)
+# !/usr/bin/env python3
+# coding=utf-8
+
+""" Tests of loading FBA parquet files and the partitioned FBA dataset with column and row filters """
+import os
+import tempfile
+import unittest
+from types import SimpleNamespace
+import pandas as pd
+import pyarrow.parquet as pq
+import flowsa.storage
+from flowsa.common import flow_by_activity_fields
+from flowsa.storage import sort_fba, fba_filters, read_fba_file, write_fba_file, \
+    write_fba_dataset, dataset_years, load_fba_dataset, migrate_fba_files
+
+
+class TestStorage(unittest.TestCase):
+
+    def setUp(self):
+        self.fba = pd.DataFrame({
+            'Class': ['Employment', 'Money', 'Employment', 'Employment', 'Employment'],
+            'Location': ['01001', '00000', '00000', '01000', '06000'],
+            'ActivityProducedBy': ['111', '111', '112', '111', None],
+            'ActivityConsumedBy': [None, None, None, None, '111'],
+            'FlowName': ['Jobs', 'Wages', 'Jobs', 'Jobs', 'Jobs'],
+            'Compartment': None,
+            'FlowAmount': [1.0, 2.0, 3.0, 4.0, 5.0]})
+        self.tmp = tempfile.TemporaryDirectory()
+        self.file = os.path.join(self.tmp.name, 'fba.parquet')
+        sort_fba(self.fba).to_parquet(self.file, index=False, row_group_size=2)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def load(self, **kwargs):
+        columns = kwargs.pop('columns', None)
+        return read_fba_file(self.file, columns, fba_filters(**kwargs))
+
+    def test_sort_fba(self):
+        self.assertEqual(['00000', '01000', '06000', '01001', '00000'],
+                         sort_fba(self.fba)['Location'].tolist())
+
+    def test_filters(self):
+        self.assertIsNone(fba_filters())
+        self.assertEqual(pd.read_parquet(self.file).to_dict(), self.load().to_dict())
+        self.assertEqual([3.0, 4.0, 5.0, 1.0],
+                         self.load(flowclass='Employment')['FlowAmount'].tolist())
+        self.assertEqual([4.0, 5.0], self.load(flowclass='Employment',
+                                                geographic_level='state')['FlowAmount'].tolist())
+        self.assertEqual([4.0, 5.0, 1.0, 2.0],
+                         self.load(activities=['111'])['FlowAmount'].tolist())
+        self.assertEqual([2.0], self.load(flownames=['Wages'])['FlowAmount'].tolist())
+
+    def test_columns(self):
+        df = self.load(columns=['FlowAmount'], flowclass='Money')
+        self.assertEqual(['FlowAmount'], list(df.columns))
+        self.assertEqual([2.0], df['FlowAmount'].tolist())
+
+    def test_write_fba_file_row_groups(self):
+        fba = pd.concat([self.fba] * 10, ignore_index=True).assign(Year=2015)
+        row_group_size = flowsa.storage.fba_row_group_size
+        flowsa.storage.fba_row_group_size = 10
+        try:
+            file = write_fba_file(sort_fba(fba), SimpleNamespace(local_path=self.tmp.name),
+                                  SimpleNamespace(category='FlowByActivity',
+                                                  name_data='Test_2015', ext='parquet'))
+        finally:
+            flowsa.storage.fba_row_group_size = row_group_size
+        self.assertEqual(5, pq.ParquetFile(file).num_row_groups)
+        self.assertEqual([2.0] * 10, read_fba_file(file, ['FlowAmount'],
+                                                   fba_filters('Money'))['FlowAmount'].tolist())
+
+
+class TestDataset(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmp.name, 'dataset')
+        self.files = os.path.join(self.tmp.name, 'FlowByActivity')
+        os.makedirs(self.files)
+        for year in [2015, 2016]:
+            fba = pd.DataFrame({
+                'Class': ['Employment', 'Employment', 'Money', 'Employment'],
+                'SourceName': 'Test',
+                'FlowName': 'Jobs',
+                'FlowAmount': [1.0, 2.0, 3.0, 4.0],
+                'Location': ['00000', '01000', '00000', '01001'],
+                'ActivityProducedBy': ['111', '111', '112', '111'],
+                'Year': year}).reindex(columns=list(flow_by_activity_fields))
+            fba.to_parquet(os.path.join(self.files, 'Test_' + str(year) + '_v0.1.1.parquet'),
+                           index=False)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_migrate_and_load(self):
+        migrated = migrate_fba_files(folder=self.files, root=self.root)
+        self.assertEqual([2015, 2016], migrated['Year'].tolist())
+        self.assertEqual([2015, 2016], dataset_years('Test', self.root))
+        self.assertEqual(['class=Employment', 'class=Money'], sorted(os.listdir(
+            os.path.join(self.root, 'source=Test', 'year=2015'))))
+        df = load_fba_dataset('Test', ['2015', '2016'], root=self.root)
+        self.assertEqual(list(flow_by_activity_fields), list(df.columns))
+        self.assertEqual(8, len(df))
+        df = load_fba_dataset('Test', ['2016'], ['Year', 'FlowAmount'],
+                              fba_filters('Employment', 'national'), self.root)
+        self.assertEqual([[2016, 1.0]], df.values.tolist())
+
+    def test_write_replaces_year(self):
+        migrate_fba_files(folder=self.files, root=self.root)
+        df = load_fba_dataset('Test', ['2015'], root=self.root)
+        write_fba_dataset(df[df['Class'] == 'Money'], 'Test', 2015, self.root)
+        self.assertEqual(['Money'], load_fba_dataset('Test', ['2015'], root=self.root)
+                         ['Class'].tolist())
+        # the temporary and previous folders are removed
+        self.assertEqual(['year=2015', 'year=2016'],
+                         sorted(os.listdir(os.path.join(self.root, 'source=Test'))))
+
+    def test_failed_write_keeps_year(self):
+        migrate_fba_files(folder=self.files, root=self.root)
+        df = load_fba_dataset('Test', ['2015'], root=self.root)
+        with self.assertRaises(Exception):
+            write_fba_dataset(df.assign(Year='not a year'), 'Test', 2015, self.root)
+        self.assertEqual(4, len(load_fba_dataset('Test', ['2015'], root=self.root)))
+        self.assertEqual(['year=2015', 'year=2016'],
+                         sorted(os.listdir(os.path.join(self.root, 'source=Test'))))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+# test_unit_conversion.py (tests)
+# !/usr/bin/env python3
+# coding=utf-8
+
+""" Tests of the table-driven unit conversions """
+import unittest
+import pandas as pd
+from flowsa.common import convert_fba_unit, convert_units
+from flowsa.dataclean import harmonize_units
+
+
+class TestUnitConversion(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pd.DataFrame({'Class': ['Water', 'Water', 'Land', 'Land', 'Money'],
+                                'Unit': ['Bgal/d', 'Mgal', 'Thousand Acres', 'Acres', 'USD'],
+                                'FlowAmount': [1.0, 2.0, 3.0, 4.0, 5.0]})
+
+    def test_convert_fba_unit(self):
+        df = convert_fba_unit(self.df.copy())
+        self.assertEqual(['Mgal', 'Mgal', 'Acres', 'Acres', 'USD'], df['Unit'].tolist())
+        self.assertEqual([365000, 2, 3000, 4, 5], df['FlowAmount'].tolist())
+
+    def test_harmonize_units(self):
+        df = harmonize_units(convert_fba_unit(self.df.copy()))
+        self.assertEqual(['kg', 'kg', 'm2', 'm2', 'USD'], df['Unit'].tolist())
+        self.assertAlmostEqual(365000 * 3790000, df['FlowAmount'][0])
+        self.assertAlmostEqual(4 * 4046.8564224, df['FlowAmount'][3])
+
+    def test_class_specific_conversion(self):
+        table = pd.DataFrame({'ConversionSet': ['Test', 'Test'],
+                              'Class': [None, 'Land'],
+                              'SourceUnit': ['Acres', 'Acres'],
+                              'TargetUnit': ['m2', 'ha'],
+                              'ConversionFactor': [4046.8564224, 0.404686]})
+        df = self.df.assign(Class=['Water', 'Water', 'Land', 'Water', 'Money'],
+                            Unit=['Acres', 'Mgal', 'Acres', 'Acres', 'USD'])
+        df = convert_units(df, 'Test', conversion_table=table)
+        self.assertEqual(['m2', 'Mgal', 'ha', 'm2', 'USD'], df['Unit'].tolist())
+        self.assertAlmostEqual(3 * 0.404686, df['FlowAmount'][2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,85 @@
+# test_validation.py (tests)
+# !/usr/bin/env python3
+# coding=utf-8
+
+""" Tests of running datachecks at validation levels """
+import os
+import tempfile
+import threading
+import unittest
+import pandas as pd
+from flowsa.validation import Validator
+from flowsa.datachecks import check_allocation_ratios
+
+
+def compare_geographic_totals(df):
+    return df[df['FlowAmount'] > 1]
+
+
+def compare_fba_load_and_fbs_output_totals(df):
+    return threading.current_thread().name
+
+
+def failing_check(df):
+    raise KeyError('Context')
+
+
+class TestValidator(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pd.DataFrame({'FlowAmount': [1.0, 2.0, 3.0]})
+
+    def submit_checks(self, validator):
+        validator.submit(compare_geographic_totals, 'Test', 'a', self.df)
+        validator.submit(compare_fba_load_and_fbs_output_totals, 'Test', 'a', self.df)
+        return validator.wait()
+
+    def test_off(self):
+        self.assertEqual(0, len(self.submit_checks(Validator('Test_method', 'off'))))
+
+    def test_fast(self):
+        report = self.submit_checks(Validator('Test_method', 'fast'))
+        self.assertEqual(['compare_geographic_totals'], report['Check'].tolist())
+        self.assertEqual([2], report['Rows'].tolist())
+
+    def test_full(self):
+        validator = Validator('Test_method', 'full')
+        validator.submit(compare_geographic_totals, 'Test', 'a', self.df)
+        # checks run on snapshots of the dfs
+        self.df['FlowAmount'] = 0
+        validator.submit(compare_fba_load_and_fbs_output_totals, 'Test', 'a', self.df)
+        validator.submit(failing_check, 'Test', 'b', self.df)
+        report = validator.wait()
+        self.assertEqual(['ok', 'ok', 'error'], report['Status'].tolist())
+        self.assertTrue((report['CPUTime'] >= 0).all())
+        self.assertEqual(2, len(validator.results[('compare_geographic_totals', 'Test', 'a')]))
+        self.assertTrue(validator.results[('compare_fba_load_and_fbs_output_totals', 'Test', 'a')]
+                        .startswith('flowsa-validation'))
+        with tempfile.TemporaryDirectory() as tmp:
+            path = validator.write(os.path.join(tmp, 'report.csv'))
+            self.assertEqual(3, len(pd.read_csv(path)))
+            results = pd.read_parquet(os.path.join(tmp, 'Test_method_datachecks.parquet'))
+            self.assertEqual(['compare_geographic_totals'] * 2, results['Check'].tolist())
+            self.assertEqual([2.0, 3.0], results['FlowAmount'].tolist())
+
+    def test_allocation_ratios(self):
+        ratios = pd.DataFrame({'FBA_Activity': ['a', 'a', 'a', 'b', 'b'],
+                               'Location': '00000',
+                               'Sector': ['111', '112', '1111111', '111', '112'],
+                               'FlowAmountRatio': [0.5, 0.5, 0.3, 0.5, 0.2]})
+        validator = Validator('Test_method', 'fast')
+        validator.submit(check_allocation_ratios, 'Test', 'a', ratios, 'a', 'Test', 'Test_method')
+        report = validator.wait()
+        self.assertEqual([1], report['Flagged'].tolist())
+        result = validator.results[('check_allocation_ratios', 'Test', 'a')]
+        # sector lengths > 6 are not flagged
+        self.assertEqual([False, False, True],
+                         result.sort_values(['FBA_Activity', 'slength'])['Flag'].tolist())
+
+    def test_invalid_level(self):
+        with self.assertRaises(ValueError):
+            Validator('Test_method', 'some')
+
+
+if __name__ == '__main__':
+    unittest.main()